@@ -22,11 +22,13 @@ def custom_static_serve(request, path):
         return HttpResponseRedirect(settings.FRONTEND_URL)
 
 from .utils.redirects import smart_redirect, redirect_to_frontend
+from .utils.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
     path('auth/', include('accounts.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('', smart_redirect, name='root-redirect'),
 ]
 
@@ -0,0 +1,281 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from . import metrics, profiling
+
+logger = logging.getLogger("RataTutor.requests")
+
+_current_stats = ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    """Counters collected while one request is being handled."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.llm_calls = 0
+        self.llm_time = 0.0
+        self.llm_prompt_tokens = 0
+        self.llm_completion_tokens = 0
+        self.stages = defaultdict(float)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Value for the Server-Timing response header (durations in ms)."""
+        entries = [
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.db_queries} queries"',
+            f'llm;dur={self.llm_time * 1000:.1f};desc="{self.llm_calls} calls"',
+        ]
+        entries += [f"{stage};dur={duration * 1000:.1f}" for stage, duration in self.stages.items()]
+        entries.append(f"total;dur={self.elapsed * 1000:.1f}")
+        return ", ".join(entries)
+
+    def as_dict(self):
+        return {
+            "duration_ms": round(self.elapsed * 1000, 1),
+            "db_queries": self.db_queries,
+            "db_ms": round(self.db_time * 1000, 1),
+            "llm_calls": self.llm_calls,
+            "llm_ms": round(self.llm_time * 1000, 1),
+            "llm_prompt_tokens": self.llm_prompt_tokens,
+            "llm_completion_tokens": self.llm_completion_tokens,
+            **{f"{stage}_ms": round(duration * 1000, 1) for stage, duration in self.stages.items()},
+        }
+
+
+def current_stats():
+    """Stats of the request being handled, or None outside a request."""
+    return _current_stats.get()
+
+
+@contextmanager
+def timed(stage):
+    """
+    Add the time spent in the block to `stage` of the current request
+    (and record it as a span when the request is being profiled).
+    """
+    started = time.perf_counter()
+    try:
+        with profiling.span(stage):
+            yield
+    finally:
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.stages[stage] += time.perf_counter() - started
+
+
+def record_llm_call(duration, usage=None):
+    stats = _current_stats.get()
+    if stats is None:
+        return
+    stats.llm_calls += 1
+    stats.llm_time += duration
+    if usage is not None:
+        stats.llm_prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+        stats.llm_completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+
+def _count_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_time += time.perf_counter() - started
+
+
+# ===== ROLLING ENDPOINT AGGREGATE =====
+
+class EndpointTracker:
+    """
+    Keeps the last `window` requests per endpoint in this process and
+    periodically publishes a summary to the cache, so the slowest endpoints
+    can be read across all gunicorn workers.
+    """
+    WORKERS_KEY = "instrumentation:workers"
+    SNAPSHOT_KEY = "instrumentation:endpoints:{}"
+
+    def __init__(self, window=200, publish_interval=30):
+        self.window = window
+        self.publish_interval = publish_interval
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+        self._last_publish = 0.0
+
+    def record(self, endpoint, stats):
+        sample = (stats.elapsed, stats.db_queries, stats.llm_time)
+        with self._lock:
+            self._samples[endpoint].append(sample)
+            due = time.monotonic() - self._last_publish >= self.publish_interval
+            if due:
+                self._last_publish = time.monotonic()
+        if due:
+            self.publish()
+
+    def snapshot(self):
+        with self._lock:
+            samples = {endpoint: list(window) for endpoint, window in self._samples.items()}
+        summary = {}
+        for endpoint, rows in samples.items():
+            durations = sorted(row[0] for row in rows)
+            summary[endpoint] = {
+                "count": len(rows),
+                "avg_ms": round(sum(durations) / len(rows) * 1000, 1),
+                "p95_ms": round(durations[min(len(rows) - 1, int(len(rows) * 0.95))] * 1000, 1),
+                "max_ms": round(durations[-1] * 1000, 1),
+                "avg_db_queries": round(sum(row[1] for row in rows) / len(rows), 1),
+                "avg_llm_ms": round(sum(row[2] for row in rows) / len(rows) * 1000, 1),
+            }
+        return summary
+
+    def publish(self):
+        timeout = self.publish_interval * 10
+        try:
+            cache.set(self.SNAPSHOT_KEY.format(os.getpid()), self.snapshot(), timeout)
+            workers = set(cache.get(self.WORKERS_KEY) or ())
+            if os.getpid() not in workers:
+                cache.set(self.WORKERS_KEY, workers | {os.getpid()}, None)
+        except Exception as e:
+            logger.warning("Could not publish endpoint timings: %s", e)
+
+    def slowest(self, limit=20):
+        """Merge every worker's published window and return the slowest endpoints by p95."""
+        self.publish()
+        workers = cache.get(self.WORKERS_KEY) or ()
+        snapshots = cache.get_many([self.SNAPSHOT_KEY.format(pid) for pid in workers])
+
+        merged = {}
+        for snapshot in snapshots.values():
+            for endpoint, row in snapshot.items():
+                current = merged.get(endpoint)
+                if current is None:
+                    merged[endpoint] = dict(row)
+                    continue
+                total = current["count"] + row["count"]
+                for field in ("avg_ms", "avg_db_queries", "avg_llm_ms"):
+                    current[field] = round((current[field] * current["count"] + row[field] * row["count"]) / total, 1)
+                current["p95_ms"] = max(current["p95_ms"], row["p95_ms"])
+                current["max_ms"] = max(current["max_ms"], row["max_ms"])
+                current["count"] = total
+
+        rows = [{"endpoint": endpoint, **row} for endpoint, row in merged.items()]
+        return sorted(rows, key=lambda row: row["p95_ms"], reverse=True)[:limit]
+
+
+endpoint_tracker = EndpointTracker()
+
+
+# ===== MIDDLEWARE =====
+
+class InstrumentedStream:
+    """
+    Body of a streaming response, iterated with the request's stats and DB
+    query counting active (the view has returned by then). `on_close` runs
+    once, when the server closes the response.
+    """
+
+    def __init__(self, content, stats, on_close):
+        self._content = iter(content)
+        self._stats = stats
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = _current_stats.set(self._stats)
+        try:
+            with connections["default"].execute_wrapper(_count_query):
+                return next(self._content)
+        finally:
+            _current_stats.reset(token)
+
+    def close(self):
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close()
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Records wall time, DB query count/time, LLM calls/latency/tokens and
+    named stages (e.g. file extraction) for every request. Emits them as a
+    Server-Timing header and one JSON log line, and feeds the rolling
+    slowest-endpoints aggregate.
+
+    Streaming responses are measured until their body has been sent, so
+    they get no Server-Timing header (it goes out before the body) and are
+    logged when the response is closed.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, "REQUEST_INSTRUMENTATION", True)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        try:
+            with connections["default"].execute_wrapper(_count_query):
+                response = self.get_response(request)
+        finally:
+            _current_stats.reset(token)
+
+        if response.streaming and not response.is_async:
+            response.streaming_content = InstrumentedStream(
+                response.streaming_content, stats, lambda: self._finish(request, response, stats)
+            )
+            return response
+
+        response["Server-Timing"] = stats.server_timing()
+        self._finish(request, response, stats)
+        return response
+
+    def _finish(self, request, response, stats):
+        endpoint = self._endpoint_name(request)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                "event": "request",
+                "method": request.method,
+                "endpoint": endpoint,
+                "path": request.path,
+                "status": response.status_code,
+                "user": request.user.pk if getattr(request, "user", None) and request.user.is_authenticated else None,
+                **stats.as_dict(),
+            }))
+        endpoint_tracker.record(endpoint, stats)
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            stats.elapsed,
+            view=endpoint.split(" ", 1)[1],
+            method=request.method,
+            status=f"{response.status_code // 100}xx",
+        )
+        metrics.registry.maybe_publish()
+
+    @staticmethod
+    def _endpoint_name(request):
+        # Group by route, not by concrete URL, to keep the aggregate small
+        match = getattr(request, "resolver_match", None)
+        if match is None:
+            return f"{request.method} <unresolved>"
+        return f"{request.method} {match.view_name or match.route}"
@@ -0,0 +1,61 @@
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+
+class NonBlockingStreamHandler(QueueHandler):
+    """
+    Logging handler that never writes in the calling thread.
+
+    Records are put on an in-memory queue and written to `stream` by a
+    background QueueListener thread, so request threads do not block on
+    stdout/stderr. When the queue is full, records are dropped (and counted)
+    rather than stalling the request.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread, in the target handler
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # The queue never leaves the process, so skip QueueHandler's eager
+        # message formatting: %-args are rendered on the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # Called by logging.shutdown() at exit: flush what is still queued
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.target.close()
+        super().close()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Let through roughly `rate` (0..1) of the records it sees. Attach it to
+    loggers used for per-item messages (e.g. one line per quiz question)
+    so enabling DEBUG does not flood the log. Warnings and errors always pass.
+    """
+
+    def __init__(self, rate=0.1):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
@@ -0,0 +1,423 @@
+"""
+Minimal in-process metrics in the Prometheus text exposition format.
+
+Every worker process keeps its own counters/histograms/gauges and publishes
+a snapshot to the cache at most every PUBLISH_INTERVAL seconds; GET /metrics
+merges the snapshots of all live workers, so any worker can answer a scrape.
+
+Workers that stop publishing (restarted, stopped, or idle) are retired: their
+counters and histograms are folded into a "retired" snapshot that is part of
+every merge, so the totals never go down (which Prometheus would read as a
+counter reset). A retired worker that publishes again only reports what it
+counted since.
+"""
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.views.decorators.cache import never_cache
+
+logger = logging.getLogger(__name__)
+
+PUBLISH_INTERVAL = 15
+# A worker that hasn't published for this long is retired
+RETIRE_AFTER = PUBLISH_INTERVAL * 4
+# Snapshots are retired on scrape long before this; it only bounds leftovers
+SNAPSHOT_TTL = 24 * 60 * 60
+WORKERS_KEY = "metrics:workers"
+# Held around every read-modify-write of WORKERS_KEY
+WORKERS_LOCK_KEY = "metrics:workers-lock"
+WORKERS_LOCK_WAIT = 1.0
+SNAPSHOT_KEY = "metrics:snapshot:{}"
+RETIRED_KEY = "metrics:retired"
+RETIRE_LOCK_KEY = "metrics:retire-lock"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LLM_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [non-cumulative count per bucket..., +Inf count, sum]
+            row = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            row[bisect_left(self.buckets, value)] += 1
+            row[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._last_publish = 0.0
+        self._lock = threading.Lock()
+        self._worker = None
+        self._published = None   # Last snapshot written to the cache
+        self._baseline = {}      # Values already folded into the retired snapshot
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    # ----- cross-worker publishing -----
+
+    def _worker_id(self, renew=False):
+        # pid plus a random part: a new worker may get the pid of a dead one
+        if renew or self._worker is None or self._worker[0] != os.getpid():
+            if self._worker is None or self._worker[0] != os.getpid():
+                self._published, self._baseline = None, {}
+            self._worker = (os.getpid(), f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        return self._worker[1]
+
+    def maybe_publish(self):
+        with self._lock:
+            if time.monotonic() - self._last_publish < PUBLISH_INTERVAL:
+                return
+            self._last_publish = time.monotonic()
+        try:
+            self.publish()
+        except Exception as e:
+            logger.warning("Could not publish metrics snapshot: %s", e)
+
+    def publish(self):
+        # Under the lock, so registering never overwrites another worker's
+        # registration and retirement never folds a snapshot being replaced
+        with _workers_lock() as locked:
+            if not locked:
+                return  # Published next time; nothing is lost meanwhile
+            worker = self._worker_id()
+            workers = set(cache.get(WORKERS_KEY) or ())
+            if worker not in workers:
+                if self._published is not None:
+                    # Only retirement removes a worker that has published: our
+                    # last snapshot is in the retired totals, so report only
+                    # what we count from now on, as a new worker
+                    self._baseline = self._published
+                    worker = self._worker_id(renew=True)
+                cache.set(WORKERS_KEY, workers | {worker}, None)
+
+            values = self._subtract(self.snapshot(), self._baseline)
+            cache.set(SNAPSHOT_KEY.format(worker), {"published_at": time.time(), "values": values}, SNAPSHOT_TTL)
+            self._published = self._add(self._baseline, values)
+
+    def collect(self):
+        """Merge the retired totals, this process and every live worker's snapshot."""
+        self.publish()
+        workers = set(cache.get(WORKERS_KEY) or ())
+        keys = {SNAPSHOT_KEY.format(worker): worker for worker in workers}
+        # One read, so a concurrent retirement is seen either before or after
+        found = cache.get_many([RETIRED_KEY, *keys])
+        retired = found.pop(RETIRED_KEY, None) or {"workers": set(), "values": {}}
+        snapshots = {keys[key]: snapshot for key, snapshot in found.items() if keys[key] not in retired["workers"]}
+
+        now = time.time()
+        stale = {worker for worker in workers if now - snapshots.get(worker, {}).get("published_at", 0) > RETIRE_AFTER}
+        if stale:
+            retired = self._retire(stale) or retired
+            snapshots = {worker: snapshot for worker, snapshot in snapshots.items() if worker not in retired["workers"]}
+
+        merged = {name: {} for name in self._metrics}
+        self._merge_into(merged, retired["values"])
+        for snapshot in snapshots.values():
+            self._merge_into(merged, snapshot["values"])
+        return merged
+
+    def _retire(self, stale):
+        """
+        Fold the counters and histograms of `stale` workers into the retired
+        totals and return them (None if another worker is doing it).
+        The totals and the set of folded workers are one cache value, so
+        readers never count a worker twice or not at all.
+        """
+        if not cache.add(RETIRE_LOCK_KEY, os.getpid(), 30):
+            return None
+        try:
+            with _workers_lock() as locked:
+                if locked:
+                    return self._fold(stale)
+                return None
+        finally:
+            cache.delete(RETIRE_LOCK_KEY)
+
+    def _fold(self, stale):
+        keys = {SNAPSHOT_KEY.format(worker): worker for worker in stale}
+        found = cache.get_many([RETIRED_KEY, *keys])
+        retired = found.pop(RETIRED_KEY, None) or {"workers": set(), "values": {}}
+        folded = set()
+        # Stale workers without a snapshot (it expired) have nothing left to fold
+        gone = {worker for key, worker in keys.items() if key not in found}
+        for key, snapshot in found.items():
+            worker = keys[key]
+            if worker in retired["workers"] or time.time() - snapshot["published_at"] <= RETIRE_AFTER:
+                continue  # Already folded, or published again in the meantime
+            self._merge_into(retired["values"], snapshot["values"], kinds=("counter", "histogram"))
+            folded.add(worker)
+        # Workers whose snapshot is already deleted no longer need to be remembered
+        leftover = cache.get_many([SNAPSHOT_KEY.format(worker) for worker in retired["workers"]])
+        retired["workers"] = {worker for worker in retired["workers"] if SNAPSHOT_KEY.format(worker) in leftover}
+        retired["workers"] |= folded
+
+        cache.set(RETIRED_KEY, retired, None)
+        cache.delete_many([SNAPSHOT_KEY.format(worker) for worker in folded])
+        # Workers that published again stay registered, or they would take
+        # themselves for retired and drop what they counted since
+        cache.set(WORKERS_KEY, set(cache.get(WORKERS_KEY) or ()) - folded - gone, None)
+        return retired
+
+    def _merge_into(self, target, snapshot, kinds=None):
+        for name, values in snapshot.items():
+            metric = self._metrics.get(name)
+            if metric is None or (kinds is not None and metric.kind not in kinds):
+                continue
+            rows = target.setdefault(name, {})
+            for key, value in values.items():
+                rows[key] = _combine(rows.get(key), value, 1)
+
+    def _subtract(self, snapshot, baseline):
+        """Counters/histograms minus what was already reported (gauges are current values)."""
+        if not baseline:
+            return snapshot
+        return {
+            name: {
+                key: value if self._metrics[name].kind == "gauge"
+                else _combine(value, baseline.get(name, {}).get(key), -1)
+                for key, value in values.items()
+            }
+            for name, values in snapshot.items()
+        }
+
+    def _add(self, baseline, values):
+        if not baseline:
+            return values
+        return {
+            name: {
+                key: value if self._metrics[name].kind == "gauge"
+                else _combine(value, baseline.get(name, {}).get(key), 1)
+                for key, value in rows.items()
+            }
+            for name, rows in values.items()
+        }
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        merged = self.collect()
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(merged[name].items()):
+                labels = dict(zip(metric.labelnames, key))
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (math.inf,), value[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def _workers_lock():
+    """Take WORKERS_LOCK_KEY, waiting up to WORKERS_LOCK_WAIT seconds; yields whether it was taken."""
+    deadline = time.monotonic() + WORKERS_LOCK_WAIT
+    while not cache.add(WORKERS_LOCK_KEY, os.getpid(), 10):
+        if time.monotonic() > deadline:
+            yield False
+            return
+        time.sleep(0.01)
+    try:
+        yield True
+    finally:
+        cache.delete(WORKERS_LOCK_KEY)
+
+
+def _combine(value, other, sign):
+    """value + sign * other, for numbers and histogram rows (None counts as zero)."""
+    if other is None:
+        return list(value) if isinstance(value, list) else value
+    if value is None:
+        return [sign * b for b in other] if isinstance(other, list) else sign * other
+    if isinstance(value, list):
+        return [a + sign * b for a, b in zip(value, other)]
+    return value + sign * other
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+
+# ===== METRICS =====
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "ratatutor_http_request_duration_seconds",
+    "HTTP request latency by view.",
+    ("view", "method", "status"),
+)
+LLM_REQUEST_SECONDS = registry.histogram(
+    "ratatutor_llm_request_duration_seconds",
+    "Latency of chat completion calls by task.",
+    ("task",),
+    buckets=LLM_BUCKETS,
+)
+LLM_ERRORS = registry.counter(
+    "ratatutor_llm_errors_total",
+    "Chat completion calls that raised, by task.",
+    ("task",),
+)
+LLM_PROMPT_TOKENS = registry.counter(
+    "ratatutor_llm_prompt_tokens_total",
+    "Prompt tokens sent to the LLM by task.",
+    ("task",),
+)
+LLM_COMPLETION_TOKENS = registry.counter(
+    "ratatutor_llm_completion_tokens_total",
+    "Completion tokens received from the LLM by task.",
+    ("task",),
+)
+EXTRACTION_SECONDS = registry.histogram(
+    "ratatutor_extraction_duration_seconds",
+    "Attachment text extraction time by file type.",
+    ("file_type",),
+)
+QUEUE_DEPTH = registry.gauge(
+    "ratatutor_queue_depth",
+    "Background jobs queued or running, by queue.",
+    ("queue",),
+)
+MATERIAL_CONTEXT_DECISIONS = registry.counter(
+    "ratatutor_material_context_decisions_total",
+    "Chat turns by material context decision (retrieved, explicit, skipped, unindexed).",
+    ("decision",),
+)
+TUTOR_ANSWER_CACHE_LOOKUPS = registry.counter(
+    "ratatutor_tutor_answer_cache_lookups_total",
+    "Tutor answer cache lookups by result (exact, similar, miss); hit rate = (exact + similar) / total.",
+    ("result",),
+)
+COALESCED_REQUESTS = registry.counter(
+    "ratatutor_coalesced_requests_total",
+    "Duplicate requests answered with the result of an identical in-flight request.",
+    ("view",),
+)
+
+
+# ===== VIEW =====
+
+@never_cache
+def metrics_view(request):
+    """
+    GET /metrics
+    Requires `Authorization: Bearer <METRICS_TOKEN>`. Without a token it is
+    only served in development (DEBUG).
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if not token and not settings.DEBUG:
+        return HttpResponse("Forbidden: set METRICS_TOKEN to enable /metrics\n", status=403, content_type="text/plain")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponse("Unauthorized\n", status=401, content_type="text/plain")
+
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,177 @@
+"""
+Opt-in per-request profiling for the slow AI endpoints.
+
+A request is profiled when:
+- a staff user sends `X-Profile: sampling` or `X-Profile: cprofile`
+  (`X-Profile: 1` picks PROFILING_DEFAULT_MODE), or
+- an admin switched profiling on for everyone via POST /api/admin/profiling/.
+
+Each profiled request writes to PROFILING_DIR:
+- <id>.spans.json: stage-level spans (extraction, llm:<task>, generate, db_write, ...)
+- <id>.folded (sampling mode): collapsed stacks, ready for flamegraph.pl or speedscope
+- <id>.prof (cprofile mode): pstats dump, for snakeviz / `python -m pstats`
+"""
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+HEADER = "X-Profile"
+MODES = ("sampling", "cprofile")
+TOGGLE_KEY = "profiling:mode"
+
+_current_session = ContextVar("profile_session", default=None)
+
+
+# ===== ENABLING =====
+
+def get_global_mode():
+    """Mode switched on by an admin for all requests, or None."""
+    return cache.get(TOGGLE_KEY)
+
+
+def set_global_mode(mode, timeout=None):
+    if mode is None:
+        cache.delete(TOGGLE_KEY)
+    else:
+        cache.set(TOGGLE_KEY, mode, timeout or settings.PROFILING_TOGGLE_TIMEOUT)
+
+
+def requested_mode(request):
+    """Return the profiling mode for this (authenticated) request, or None."""
+    header = request.headers.get(HEADER, "").strip().lower()
+    if header and header not in ("0", "false", "off") and request.user.is_staff:
+        return header if header in MODES else settings.PROFILING_DEFAULT_MODE
+    return get_global_mode()
+
+
+# ===== SPANS =====
+
+@contextmanager
+def span(name):
+    """Record a named stage of the current profiled request (no-op otherwise)."""
+    session = _current_session.get()
+    if session is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    session.depth += 1
+    try:
+        yield
+    finally:
+        session.depth -= 1
+        session.spans.append({
+            "name": name,
+            "start_ms": round((started - session.started) * 1000, 2),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            "depth": session.depth,
+        })
+
+
+# ===== SESSIONS =====
+
+class ProfileSession:
+    def __init__(self, mode, label):
+        self.mode = mode
+        self.label = label
+        self.id = f"{timezone.now():%Y%m%d-%H%M%S}-{label}-{uuid.uuid4().hex[:8]}"
+        self.spans = []
+        self.depth = 0
+        self.started = time.perf_counter()
+        self._token = _current_session.set(self)
+        self._profiler = None
+        self._sampler = None
+
+        if mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = StackSampler(threading.get_ident(), settings.PROFILING_SAMPLE_INTERVAL)
+            self._sampler.start()
+
+    def _finish(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        _current_session.reset(self._token)
+
+    def abort(self):
+        """Stop profiling without writing anything (the request raised)."""
+        self._finish()
+
+    def stop(self, request, response):
+        """Stop profiling and write the output files; returns the profile id."""
+        total = time.perf_counter() - self.started
+        self._finish()
+
+        try:
+            os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+            base = os.path.join(settings.PROFILING_DIR, self.id)
+            with open(f"{base}.spans.json", "w", encoding="utf-8") as f:
+                json.dump({
+                    "id": self.id,
+                    "view": self.label,
+                    "mode": self.mode,
+                    "method": request.method,
+                    "path": request.path,
+                    "user": request.user.pk,
+                    "status": response.status_code,
+                    "total_ms": round(total * 1000, 2),
+                    "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+                }, f, indent=2)
+            if self._profiler is not None:
+                self._profiler.dump_stats(f"{base}.prof")
+            if self._sampler is not None:
+                self._sampler.write_folded(f"{base}.folded")
+        except OSError as e:
+            logger.error("Could not write profile %s: %s", self.id, e)
+
+        logger.info("Wrote %s profile %s (%.0f ms)", self.mode, self.id, total * 1000)
+        return self.id
+
+
+class StackSampler(threading.Thread):
+    """Samples the stack of one thread at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True, name="profile-sampler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.counts[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def write_folded(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
@@ -15,6 +15,12 @@ class UserProfile(models.Model):
         help_text="Selected premade avatar identifier or filename."
     )
 
+    class Meta:
+        indexes = [
+            # Uniqueness checks in generate_guaranteed_unique_name
+            models.Index(fields=['full_name'], name='userprofile_full_name_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
@@ -1,3 +1,4 @@
+import logging
 import random
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -10,6 +11,8 @@ import os
 if os.name == 'nt':
     sys.stdout.reconfigure(encoding='utf-8')
 
+logger = logging.getLogger(__name__)
+
 
 # Cooking/Culinary-themed first names
 CHEF_FIRST_NAMES = [
@@ -87,10 +90,10 @@ def create_user_profile(sender, instance, created, **kwargs):
             # Create Streak instance for the newly created UserProfile
             Streak.objects.create(profile=user_profile)
             
-            print(f"✅ Created profile and streak for user: {instance.username}")
+            logger.info("Created profile and streak for user: %s", instance.username)
             
         except Exception as e:
-            print(f"❌ Error creating profile/streak for {instance.username}: {e}")
+            logger.warning("Error creating profile/streak for %s: %s", instance.username, e)
             
             # Fallback: create minimal profile without custom name
             try:
@@ -99,6 +102,6 @@ def create_user_profile(sender, instance, created, **kwargs):
                     full_name=f"User {instance.id}",  # Simple fallback
                 )
                 Streak.objects.create(profile=user_profile)
-                print(f"✅ Created fallback profile for user: {instance.username}")
+                logger.info("Created fallback profile for user: %s", instance.username)
             except Exception as fallback_error:
-                print(f"❌ Critical error creating profile: {fallback_error}")
+                logger.error("Critical error creating profile for %s: %s", instance.username, fallback_error)
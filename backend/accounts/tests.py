@@ -1,3 +1,15 @@
-from django.test import TestCase
+from unittest import skipUnless
 
-# Create your tests here.
+from django.db import connection
+
+from accounts.models import UserProfile
+from api.tests import QueryPlanTestCase
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN checks are SQLite specific")
+class UserProfileIndexTests(QueryPlanTestCase):
+
+    def test_full_name_lookup_uses_index(self):
+        # Same lookup as generate_guaranteed_unique_name
+        queryset = UserProfile.objects.filter(full_name="Chef Remy#1234")
+        self.assertUsesIndex(queryset, "userprofile_full_name_idx")
@@ -1,3 +1,5 @@
+import logging
+
 from .imports import APIView, Response, status
 from django.contrib.auth import get_user_model
 from ..serializers import UpdateProfileSerializer, UserProfileSerializer, StreakSerializer
@@ -5,6 +7,7 @@ from rest_framework.permissions import IsAuthenticated
 from ..models import UserProfile, Streak
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 class GetProfileView(APIView):
     """
@@ -83,7 +86,7 @@ class UpdateProfileView(APIView):
                 streak.record_activity()  # This counts as meaningful activity
             except Exception as streak_error:
                 # Don't fail the whole request if streak update fails
-                print(f"Warning: Failed to update streak: {streak_error}")
+                logger.warning("Failed to update streak for user %s: %s", request.user.pk, streak_error)
 
             return Response(
                 {"detail": "Profile updated successfully."}, 
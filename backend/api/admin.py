@@ -44,10 +44,10 @@ class MaterialAdmin(admin.ModelAdmin):
 
 @admin.register(Attachment)
 class AttachmentAdmin(admin.ModelAdmin):
-    list_display = ('id', 'material', 'file', 'uploaded_at')
-    search_fields = ('material__title',)
+    list_display = ('id', 'material', 'file', 'content_hash', 'uploaded_at')
+    search_fields = ('material__title', 'content_hash')
     list_filter = ('uploaded_at',)
-    readonly_fields = ('uploaded_at',)
+    readonly_fields = ('content_hash', 'uploaded_at')
 
 
 @admin.register(Note)
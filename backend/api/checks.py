@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core import checks
+
+PER_PROCESS_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Feed invalidation, throttling, the in-flight cap, single-flight,
+    Idempotency-Key, metrics and the answer cache keep their state in the
+    default cache, so with several workers it must be shared between them.
+    """
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if not settings.REQUIRE_SHARED_CACHE or backend not in PER_PROCESS_CACHES:
+        return []
+    return [checks.Error(
+        f"The default cache ({backend}) is per process, so each worker would keep its own copy of shared state.",
+        hint="Set CACHE_URL to a shared backend (e.g. dbcache://rata_cache or rediscache://...), "
+             "or REQUIRE_SHARED_CACHE=False for a single-process deployment.",
+        id="api.E001",
+    )]
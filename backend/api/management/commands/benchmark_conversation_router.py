@@ -0,0 +1,119 @@
+import random
+import re
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.services import conversation_router
+from api.services.conversation_router import COMPLEXITY_KEYWORDS, MATERIAL_KEYWORDS, TOPIC_KEYWORDS
+
+FILLER = (
+    "the mitochondria produces energy for the cell while the nucleus stores genetic information "
+    "and ribosomes assemble proteins from amino acids according to instructions carried by rna "
+).split()
+
+
+def legacy_complexity_score(messages):
+    return sum(
+        1 for msg in messages
+        for indicator in COMPLEXITY_KEYWORDS
+        if indicator in msg.lower()
+    )
+
+
+def legacy_mentions_material(prompt):
+    return any(indicator in prompt.lower() for indicator in MATERIAL_KEYWORDS)
+
+
+def legacy_detect_topic(messages):
+    recent_content = " ".join(messages)
+    for topic, keywords in TOPIC_KEYWORDS.items():
+        if any(keyword in recent_content.lower() for keyword in keywords):
+            return topic
+    return "general"
+
+
+class Command(BaseCommand):
+    help = 'Compare the keyword routing heuristics of a chat turn against the per-keyword substring scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--words', type=int, default=2000, help='Words per message (default: 2000)')
+        parser.add_argument('--turns', type=int, default=200, help='Simulated chat turns')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        keywords = COMPLEXITY_KEYWORDS + MATERIAL_KEYWORDS + [k for ks in TOPIC_KEYWORDS.values() for k in ks]
+
+        def message():
+            words = [rng.choice(FILLER) for _ in range(options['words'])]
+            # A few keywords, at random positions, in mixed case
+            for _ in range(rng.randint(0, 3)):
+                words.insert(rng.randrange(len(words)), rng.choice(keywords).upper())
+            return " ".join(words)
+
+        turns = [[message() for _ in range(5)] for _ in range(options['turns'])]
+
+        # One chat turn: summary threshold, material check on the prompt, and
+        # the topic (asked twice: system prompt and response)
+        def legacy(messages):
+            return (
+                legacy_complexity_score(messages),
+                legacy_mentions_material(messages[-1]),
+                legacy_detect_topic(messages),
+                legacy_detect_topic(messages),
+            )
+
+        def routed(messages):
+            lowered = [content.lower() for content in messages]
+            topic = conversation_router.detect_topic(" ".join(lowered))
+            return (
+                conversation_router.complexity_score(lowered),
+                conversation_router.mentions_material(lowered[-1]),
+                topic,
+                topic,
+            )
+
+        # Single-pass alternative: one alternation regex with an overlapping
+        # lookahead, so every keyword occurrence is seen
+        def combined_regex(keywords):
+            alternation = "|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+            return re.compile(f"(?=({alternation}))")
+
+        complexity_regex = combined_regex(COMPLEXITY_KEYWORDS)
+        material_regex = combined_regex(MATERIAL_KEYWORDS)
+        topic_regex = combined_regex([k for ks in TOPIC_KEYWORDS.values() for k in ks])
+
+        def regex(messages):
+            lowered = [content.lower() for content in messages]
+            hits = set(topic_regex.findall(" ".join(lowered)))
+            topic = next((t for t, ks in TOPIC_KEYWORDS.items() if hits.intersection(ks)), "general")
+            return (
+                sum(len(set(complexity_regex.findall(content))) for content in lowered),
+                material_regex.search(lowered[-1]) is not None,
+                topic,
+                topic,
+            )
+
+        results = {}
+        for name, fn in (('substring scans', legacy), ('combined regex', regex), ('router', routed)):
+            samples, outputs = [], []
+            for messages in turns:
+                started = time.perf_counter()
+                outputs.append(fn(messages))
+                samples.append(time.perf_counter() - started)
+            results[name] = (samples, outputs)
+
+        for name in ('combined regex', 'router'):
+            if results[name][1] != results['substring scans'][1]:
+                self.stderr.write(self.style.ERROR(f"{name} results differ from the substring scans"))
+
+        self.stdout.write(f"Messages:     5 x {options['words']} words, {options['turns']} turns")
+        for name, (samples, _) in results.items():
+            self.stdout.write(
+                f"{name + ':':<17} median {statistics.median(samples) * 1000:.3f}ms, "
+                f"max {max(samples) * 1000:.3f}ms per turn"
+            )
+        speedup = statistics.median(results['substring scans'][0]) / statistics.median(results['router'][0])
+        self.stdout.write(self.style.SUCCESS(f"Speedup:      {speedup:.1f}x"))
@@ -0,0 +1,102 @@
+import statistics
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+
+from accounts.models import Streak
+from api.models import AIConversation, Material, Note
+
+class Command(BaseCommand):
+    help = 'Measure concurrent write throughput of the configured database (run once per database profile)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=3, help='Concurrent writers (default: 3, like gunicorn)')
+        parser.add_argument('--writes', type=int, default=200, help='Write transactions per worker')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark user and its rows')
+
+    def handle(self, *args, **options):
+        workers, writes = options['workers'], options['writes']
+
+        user = User.objects.create_user(f"db-benchmark-{uuid.uuid4().hex[:8]}")
+        material = Material.objects.create(owner=user, title='DB benchmark')
+        conversation = AIConversation.objects.create(user=user, material=material)
+
+        # The three kinds of writes that contend in production
+        def chat_save(worker, n):
+            convo = AIConversation.objects.select_for_update().get(pk=conversation.pk)
+            convo.messages = (convo.messages + [{'sender': 'user', 'text': f'message {worker}-{n}'}])[-50:]
+            convo.last_user_message = f'message {worker}-{n}'
+            convo.save(update_fields=['messages', 'last_user_message', 'updated_at'])
+
+        def streak_update(worker, n):
+            Streak.objects.filter(profile__user=user).update(total_days=F('total_days') + 1)
+
+        def generation_insert(worker, n):
+            Note.objects.create(material=material, title=f'Note {worker}-{n}', content='lorem ipsum ' * 200)
+
+        operations = [chat_save, streak_update, generation_insert]
+        latencies = [[] for _ in range(workers)]
+        failures = [0] * workers
+        barrier = threading.Barrier(workers)
+
+        def run(worker):
+            try:
+                barrier.wait()
+                for n in range(writes):
+                    started = time.perf_counter()
+                    try:
+                        with transaction.atomic():
+                            operations[n % len(operations)](worker, n)
+                    except OperationalError:
+                        failures[worker] += 1
+                        continue
+                    latencies[worker].append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        samples = sorted(latency for worker_latencies in latencies for latency in worker_latencies)
+        failed = sum(failures)
+
+        self.stdout.write(f"Database:     {self._describe_database()}")
+        self.stdout.write(f"Workers:      {workers} x {writes} write transactions")
+        self.stdout.write(f"Committed:    {len(samples)} ({failed} failed with 'database is locked' or similar)")
+        self.stdout.write(f"Elapsed:      {elapsed:.2f}s")
+        self.stdout.write(self.style.SUCCESS(f"Throughput:   {len(samples) / elapsed:.1f} writes/s"))
+        if samples:
+            p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            self.stdout.write(
+                f"Latency:      p50 {statistics.median(samples) * 1000:.1f}ms, "
+                f"p95 {p95 * 1000:.1f}ms, max {samples[-1] * 1000:.1f}ms"
+            )
+
+        if not options['keep']:
+            user.delete()
+
+    def _describe_database(self):
+        if connection.vendor != 'sqlite':
+            settings_dict = connection.settings_dict
+            pooled = 'pool' in settings_dict.get('OPTIONS', {})
+            return (
+                f"{connection.vendor} (pool={'on' if pooled else 'off'}, "
+                f"CONN_MAX_AGE={settings_dict.get('CONN_MAX_AGE')})"
+            )
+
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+            cursor.execute('PRAGMA synchronous')
+            synchronous = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}.get(cursor.fetchone()[0])
+        return f"sqlite (journal_mode={journal_mode}, synchronous={synchronous})"
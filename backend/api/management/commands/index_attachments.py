@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Attachment, SearchEntry
+from api.services.search import ATTACHMENT_KIND, index_attachment
+
+class Command(BaseCommand):
+    help = 'Build the page-level search index for attachment text'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-index attachments that are already indexed')
+
+    def handle(self, *args, **options):
+        attachments = Attachment.objects.order_by('id')
+        if not options['all']:
+            indexed = SearchEntry.objects.filter(kind=ATTACHMENT_KIND).values('object_id')
+            attachments = attachments.exclude(id__in=indexed)
+
+        count = 0
+        for attachment in attachments.iterator():
+            index_attachment(attachment)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} attachment(s)."))
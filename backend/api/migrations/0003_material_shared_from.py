@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-19 18:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_attachment_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='shared_from',
+            field=models.ForeignKey(blank=True, help_text='Copy-on-write fork: while set, this material shows the notes, flashcard sets and quizzes of the source material instead of having its own.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='forks', to='api.material'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-19 18:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_material_shared_from'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(condition=models.Q(('public', True), ('status', 'active')), fields=['-updated_at', '-id'], name='material_public_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,96 @@
+from django.db import migrations
+
+ENTRY_TABLE = "api_searchentry"
+FTS_TABLE = f"{ENTRY_TABLE}_fts"
+
+SQLITE_CREATE = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        title, body,
+        content='{ENTRY_TABLE}', content_rowid='id',
+        tokenize='porter unicode61'
+    )""",
+    f"""CREATE TRIGGER {ENTRY_TABLE}_ai AFTER INSERT ON {ENTRY_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    f"""CREATE TRIGGER {ENTRY_TABLE}_ad AFTER DELETE ON {ENTRY_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    f"""CREATE TRIGGER {ENTRY_TABLE}_au AFTER UPDATE ON {ENTRY_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+SQLITE_DROP = [
+    f"DROP TRIGGER IF EXISTS {ENTRY_TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {ENTRY_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {ENTRY_TABLE}_ai",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+# Must match PG_DOCUMENT in api/services/search.py
+PG_CREATE = [
+    f"""CREATE INDEX {ENTRY_TABLE}_tsv_idx ON {ENTRY_TABLE}
+        USING GIN (to_tsvector('english', coalesce(title, '') || ' ' || coalesce(body, '')))""",
+]
+PG_DROP = [f"DROP INDEX IF EXISTS {ENTRY_TABLE}_tsv_idx"]
+
+
+def _run(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_full_text_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        _run(schema_editor, SQLITE_CREATE)
+    elif vendor == "postgresql":
+        _run(schema_editor, PG_CREATE)
+
+
+def drop_full_text_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        _run(schema_editor, SQLITE_DROP)
+    elif vendor == "postgresql":
+        _run(schema_editor, PG_DROP)
+
+
+def backfill_search_entries(apps, schema_editor):
+    Material = apps.get_model("api", "Material")
+    Note = apps.get_model("api", "Note")
+    Flashcard = apps.get_model("api", "Flashcard")
+    QuizQuestion = apps.get_model("api", "QuizQuestion")
+    SearchEntry = apps.get_model("api", "SearchEntry")
+
+    entries = [
+        SearchEntry(kind="material", object_id=m.pk, material_id=m.pk, title=m.title, body=m.description)
+        for m in Material.objects.all()
+    ]
+    entries += [
+        SearchEntry(kind="note", object_id=n.pk, material_id=n.material_id, title=n.title, body=n.content)
+        for n in Note.objects.all()
+    ]
+    entries += [
+        SearchEntry(kind="flashcard", object_id=c.pk, material_id=c.flashcard_set.material_id,
+                    title=c.question, body=c.answer)
+        for c in Flashcard.objects.select_related("flashcard_set")
+    ]
+    entries += [
+        SearchEntry(kind="quiz_question", object_id=q.pk, material_id=q.quiz.material_id,
+                    title=q.question_text, body="")
+        for q in QuizQuestion.objects.select_related("quiz")
+    ]
+    SearchEntry.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_searchentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_full_text_index, drop_full_text_index),
+        migrations.RunPython(backfill_search_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-19 18:48
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+search_index = import_module("api.migrations.0006_search_index")
+
+
+def recreate_sqlite_triggers(apps, schema_editor):
+    # SQLite applies the operations below by rebuilding the table, which drops
+    # the FTS sync triggers from 0006_search_index along with the old table.
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    triggers = search_index.SQLITE_CREATE[1:]
+    search_index._run(schema_editor, search_index.SQLITE_DROP[:len(triggers)] + triggers)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, recreate_sqlite_triggers),
+        migrations.RemoveConstraint(
+            model_name='searchentry',
+            name='unique_search_entry',
+        ),
+        migrations.AddField(
+            model_name='searchentry',
+            name='page',
+            field=models.PositiveIntegerField(default=0, help_text='Page/slide/section number for attachment text; 0 for everything else.'),
+        ),
+        migrations.AlterField(
+            model_name='searchentry',
+            name='kind',
+            field=models.CharField(choices=[('material', 'Material'), ('note', 'Note'), ('flashcard', 'Flashcard'), ('quiz_question', 'Quiz question'), ('attachment_page', 'Attachment page')], max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='searchentry',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id', 'page'), name='unique_search_entry'),
+        ),
+        migrations.RunPython(recreate_sqlite_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 18:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_searchentry_page'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='aiconversation',
+            index=models.Index(fields=['user', '-updated_at'], name='conversation_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(fields=['owner', 'status', '-pinned', '-updated_at'], name='material_owner_status_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2 on 2026-10-19 19:18
+
+from django.db import migrations, models
+
+from api.services import conversation_router
+
+
+def backfill_conversation_metadata(apps, schema_editor):
+    AIConversation = apps.get_model("api", "AIConversation")
+    Attachment = apps.get_model("api", "Attachment")
+
+    with_attachments = set(Attachment.objects.values_list("material_id", flat=True).distinct())
+    conversations = list(AIConversation.objects.only("id", "material_id", "messages"))
+    for conversation in conversations:
+        messages = conversation.messages if isinstance(conversation.messages, list) else []
+        recent = [msg.get("content", "").lower() for msg in messages[-conversation_router.RECENT_MESSAGES:]]
+        conversation.complexity_score = conversation_router.complexity_score(recent)
+        conversation.topic = conversation_router.detect_topic(" ".join(recent)) if recent else "general"
+        conversation.material_has_attachments = conversation.material_id in with_attachments
+    AIConversation.objects.bulk_update(
+        conversations, ["complexity_score", "topic", "material_has_attachments"], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiconversation',
+            name='complexity_score',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Complexity keywords found in the recent messages'),
+        ),
+        migrations.AddField(
+            model_name='aiconversation',
+            name='material_has_attachments',
+            field=models.BooleanField(default=False, help_text='Whether the material currently has attachments'),
+        ),
+        migrations.AddField(
+            model_name='aiconversation',
+            name='topic',
+            field=models.CharField(default='general', help_text='Topic detected from the recent messages', max_length=20),
+        ),
+        migrations.RunPython(backfill_conversation_metadata, migrations.RunPython.noop),
+    ]
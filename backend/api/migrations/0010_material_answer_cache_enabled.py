@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_aiconversation_cached_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='material',
+            name='answer_cache_enabled',
+            field=models.BooleanField(default=False, help_text='If true, tutor answers to standalone questions are cached and shared with materials that have the same attachments.'),
+        ),
+    ]
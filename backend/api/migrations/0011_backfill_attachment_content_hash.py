@@ -0,0 +1,40 @@
+import hashlib
+import logging
+
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_attachment_content_hash(apps, schema_editor):
+    """
+    Hash the attachments uploaded before content_hash existed, so new uploads
+    deduplicate against them and the tutor answer cache can fingerprint them.
+    Each stored blob is read once, even if several rows point at it.
+    """
+    Attachment = apps.get_model("api", "Attachment")
+
+    pending = Attachment.objects.filter(content_hash="").exclude(file="")
+    for name in list(pending.values_list("file", flat=True).distinct()):
+        attachment = pending.filter(file=name).first()
+        try:
+            digest = hashlib.sha256()
+            with attachment.file.open("rb") as stored:
+                for chunk in stored.chunks():
+                    digest.update(chunk)
+        except Exception as e:
+            # Missing or unreachable blob: leave the rows unhashed
+            logger.warning("Could not hash attachment file %s: %s", name, e)
+            continue
+        Attachment.objects.filter(file=name, content_hash="").update(content_hash=digest.hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_material_answer_cache_enabled'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_attachment_content_hash, migrations.RunPython.noop),
+    ]
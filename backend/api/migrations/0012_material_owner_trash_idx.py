@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-19 19:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_backfill_attachment_content_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(condition=models.Q(('status', 'trash')), fields=['owner', '-updated_at'], name='material_owner_trash_idx'),
+        ),
+    ]
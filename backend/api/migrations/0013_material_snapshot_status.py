@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_material_owner_trash_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='material',
+            name='status',
+            field=models.CharField(choices=[('active', 'Active'), ('trash', 'Trash'), ('snapshot', 'Snapshot')], default='active', max_length=10),
+        ),
+    ]
@@ -1,8 +1,10 @@
 import os
 import uuid
-from django.db import models
+import hashlib
+from django.db import models, transaction
 from django.utils import timezone
 from django.contrib.auth.models import User
+from api.services import conversation_router
 
 class Material(models.Model):
     owner = models.ForeignKey(
@@ -14,6 +16,8 @@ class Material(models.Model):
     STATUS_CHOICES = [
         ("active", "Active"),
         ("trash", "Trash"),
+        # Frozen content that pending forks show after their source changed
+        ("snapshot", "Snapshot"),
     ]
 
     title = models.CharField(max_length=255)
@@ -34,6 +38,20 @@ class Material(models.Model):
         default=False,
         help_text="If true, this material can be shared publicly; otherwise it's private."
     )
+    answer_cache_enabled = models.BooleanField(
+        default=False,
+        help_text="If true, tutor answers to standalone questions are cached and shared with "
+                  "materials that have the same attachments."
+    )
+    shared_from = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="forks",
+        help_text="Copy-on-write fork: while set, this material shows the notes, flashcard sets "
+                  "and quizzes of the source material instead of having its own."
+    )
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -42,6 +60,42 @@ class Material(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['owner', 'title'], name='unique_owner_title')
         ]
+        indexes = [
+            # Owner's library/pinned views: filter on owner + status, pinned first then newest
+            models.Index(
+                fields=['owner', 'status', '-pinned', '-updated_at'],
+                name='material_owner_status_idx',
+            ),
+            # Owner's trash: newest first, only the (few) trashed materials
+            models.Index(
+                fields=['owner', '-updated_at'],
+                name='material_owner_trash_idx',
+                condition=models.Q(status='trash'),
+            ),
+            # Public feed: only public, active materials, newest first
+            models.Index(
+                fields=['-updated_at', '-id'],
+                name='material_public_feed_idx',
+                condition=models.Q(public=True, status='active'),
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember visibility as loaded so saves can tell if the public feed changed
+        instance._loaded_public = instance.__dict__.get('public', False)
+        return instance
+
+    @property
+    def affects_public_feed(self):
+        """True if saving/deleting this material changes what the public feed shows."""
+        return self.public or getattr(self, '_loaded_public', False)
+
+    @property
+    def content_material(self):
+        """The material whose notes/sets/quizzes this one currently shows."""
+        return self.shared_from if self.shared_from_id else self
 
     def __str__(self):
         if self.description:
@@ -60,8 +114,45 @@ class Attachment(models.Model):
         upload_to='attachments/',
         help_text="Upload your file (DOCX, PPTX, TXT, PDF)."
     )
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        help_text="SHA-256 of the file contents; attachments with the same hash share one stored blob."
+    )
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    def save(self, *args, **kwargs):
+        # ✅ Content-addressed storage: hash new uploads and point at an
+        # existing blob with the same contents instead of storing the bytes again.
+        # Only the uploader's own blobs are reused: another user's file name
+        # (or the fact that they uploaded the file) must not leak to them.
+        if not (self.file and not self.file._committed):
+            return super().save(*args, **kwargs)
+
+        self.content_hash = self.hash_file(self.file)
+        with transaction.atomic():
+            # Lock the row we share with, so deleting it (and its blob, see
+            # delete_attachment_file) waits for this row to be committed
+            shared = (
+                Attachment.objects.select_for_update()
+                .filter(content_hash=self.content_hash, material__owner_id=self.material.owner_id)
+                .exclude(pk=self.pk)
+                .first()
+            )
+            if shared and shared.file and shared.file.storage.exists(shared.file.name):
+                self.file = shared.file.name
+            super().save(*args, **kwargs)
+
+    @staticmethod
+    def hash_file(file):
+        """Return the SHA-256 hex digest of a file, reading it in chunks."""
+        digest = hashlib.sha256()
+        for chunk in file.chunks():
+            digest.update(chunk)
+        file.seek(0)
+        return digest.hexdigest()
+
     def __str__(self):
         return f"Attachment {self.id} for {self.material.title}"
 
@@ -147,9 +238,33 @@ class AIConversation(models.Model):
         help_text="When the summary was last generated"
     )
 
+    # ✅ Derived from the recent messages / the material, kept up to date on
+    # append and by attachment signals so chat turns don't recompute them
+    topic = models.CharField(
+        max_length=20,
+        default="general",
+        help_text="Topic detected from the recent messages"
+    )
+
+    complexity_score = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="Complexity keywords found in the recent messages"
+    )
+
+    material_has_attachments = models.BooleanField(
+        default=False,
+        help_text="Whether the material currently has attachments"
+    )
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Fields written back after an LLM call (save(update_fields=...)).
+    # material_has_attachments is left out: attachment signals may flip it
+    # while the call runs, and this instance would hold the stale value.
+    SUMMARY_FIELDS = ["summary_context", "messages_since_summary", "last_summary_at", "updated_at"]
+    CHAT_TURN_FIELDS = SUMMARY_FIELDS + ["last_user_message", "messages", "context", "topic", "complexity_score"]
+
     # ✅ ADD THIS: Meta class to enforce one conversation per material per user
     class Meta:
         constraints = [
@@ -159,6 +274,10 @@ class AIConversation(models.Model):
                 condition=models.Q(material__isnull=False)  # Only apply when material is not null
             )
         ]
+        indexes = [
+            # Conversation list: the user's conversations, most recent first
+            models.Index(fields=['user', '-updated_at'], name='conversation_user_recent_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         # ✅ Ensure messages is always a list
@@ -166,6 +285,8 @@ class AIConversation(models.Model):
             self.messages = []
         elif not isinstance(self.messages, list):
             self.messages = []
+        if self._state.adding:
+            self.refresh_derived_fields()
         super().save(*args, **kwargs)
 
     def addToMessage(self):
@@ -190,9 +311,49 @@ class AIConversation(models.Model):
                 
                 # Track messages since summary
                 self.messages_since_summary += 1
+                self._track_appended_message()
+
+    def add_assistant_message(self, content):
+        self.messages.append({
+            "role": "assistant",
+            "content": content,
+            "timestamp": timezone.now().isoformat()
+        })
+
+        # Keep old context for backward compatibility + track messages
+        self.context += f"\n assistant: {content}"
+        self.messages_since_summary += 1
+        self._track_appended_message()
 
     # ✅ CONVERSATION MANAGER METHODS (built into the model)
     
+    def _track_appended_message(self):
+        """
+        Update the cached topic and complexity score for the message just
+        appended: only the new message and the one leaving the recent window
+        are scanned, whatever the length of the conversation.
+        """
+        window = conversation_router.RECENT_MESSAGES
+        new = self.messages[-1].get('content', '').lower()
+        score = self.complexity_score + conversation_router.complexity_score([new])
+        if len(self.messages) > window:
+            leaving = self.messages[-window - 1].get('content', '').lower()
+            score -= conversation_router.complexity_score([leaving])
+        self.complexity_score = max(score, 0)
+        # Keywords can span two messages, so the topic is read from the joined window
+        self.topic = conversation_router.detect_topic(
+            " ".join(msg.get('content', '') for msg in self.messages[-window:]).lower()
+        )
+
+    def refresh_derived_fields(self):
+        """Recompute topic, complexity_score and material_has_attachments from scratch."""
+        recent = [msg.get('content', '').lower() for msg in self.messages[-conversation_router.RECENT_MESSAGES:]]
+        self.complexity_score = conversation_router.complexity_score(recent)
+        self.topic = conversation_router.detect_topic(" ".join(recent)) if recent else "general"
+        self.material_has_attachments = bool(self.material_id) and Attachment.objects.filter(
+            material_id=self.material_id
+        ).exists()
+
     def get_summary_threshold(self):
         """
         Dynamically adjust when to regenerate summaries based on conversation patterns
@@ -201,21 +362,9 @@ class AIConversation(models.Model):
             return 8  # Default
 
         # More frequent summaries for complex topics
-        recent_messages = self.messages[-5:]
-        complexity_indicators = [
-            'explain', 'how', 'why', 'complex', 'detail', 'elaborate',
-            'understand', 'clarify', 'what does this mean'
-        ]
-
-        complexity_score = sum(
-            1 for msg in recent_messages 
-            for indicator in complexity_indicators
-            if indicator in msg.get('content', '').lower()
-        )
-
-        if complexity_score > 3:
+        if self.complexity_score > 3:
             return 5  # More frequent summaries for complex discussions
-        elif complexity_score > 1:
+        elif self.complexity_score > 1:
             return 6
         else:
             return 8  # Standard frequency
@@ -233,18 +382,14 @@ class AIConversation(models.Model):
 
     def should_include_material_context(self, prompt):
         """
-        Decide whether to include material text based on question relevance
+        Whether the prompt explicitly asks about the material ("in the pdf",
+        "according to the document"). Other questions still get material
+        passages when retrieval finds relevant ones.
         """
-        if not self.material or not self.material.attachments.exists():
+        if not self.material_has_attachments:
             return False
-            
-        material_indicators = [
-            'document', 'text', 'material', 'content', 'attachment',
-            'what does it say', 'according to', 'in the material',
-            'from the file', 'in the pdf', 'the document says'
-        ]
-        
-        return any(indicator in prompt.lower() for indicator in material_indicators)
+
+        return conversation_router.mentions_material(prompt.lower())
 
     def detect_conversation_topic(self):
         """
@@ -253,24 +398,7 @@ class AIConversation(models.Model):
         if not self.messages:
             return "general"
 
-        recent_content = " ".join([
-            msg.get('content', '') for msg in self.messages[-5:]
-        ])
-
-        # Topic detection with keywords
-        topics = {
-            'flashcards': ['flashcard', 'term', 'definition', 'memorize', 'remember'],
-            'quiz': ['quiz', 'test', 'question', 'answer', 'multiple choice', 'exam'],
-            'notes': ['note', 'summary', 'key point', 'important', 'summarize'],
-            'study': ['study', 'learn', 'understand', 'explain', 'teach me'],
-            'homework': ['homework', 'assignment', 'project', 'due date'],
-        }
-
-        for topic, keywords in topics.items():
-            if any(keyword in recent_content.lower() for keyword in keywords):
-                return topic
-
-        return "general"
+        return self.topic
 
     def get_context_for_ai(self):
         """
@@ -322,7 +450,7 @@ class AIConversation(models.Model):
         material_info = ""
         if self.material:
             material_info = f"The student is working with material titled '{self.material.title}'. "
-            if self.material.attachments.exists():
+            if self.material_has_attachments:
                 material_info += "Reference the uploaded content when relevant. "
         
         return base_prompt + topic_prompts.get(topic, topic_prompts['general']) + material_info
@@ -438,4 +566,40 @@ class Flashcard(models.Model):
 
     def __str__(self):
         short_q = (self.question[:27] + "...") if len(self.question) > 30 else self.question
-        return f"Card for '{self.flashcard_set.title}': {short_q}"
\ No newline at end of file
+        return f"Card for '{self.flashcard_set.title}': {short_q}"
+
+class SearchEntry(models.Model):
+    """
+    Denormalised search document for one searchable row.
+    Kept in sync by signals; the full-text index on top of this table is
+    backend specific (SQLite FTS5 / PostgreSQL tsvector, see services/search.py).
+    """
+    KIND_CHOICES = [
+        ("material", "Material"),
+        ("note", "Note"),
+        ("flashcard", "Flashcard"),
+        ("quiz_question", "Quiz question"),
+        ("attachment_page", "Attachment page"),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    material = models.ForeignKey(
+        Material,
+        on_delete=models.CASCADE,
+        related_name="search_entries"
+    )
+    page = models.PositiveIntegerField(
+        default=0,
+        help_text="Page/slide/section number for attachment text; 0 for everything else."
+    )
+    title = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id', 'page'], name='unique_search_entry')
+        ]
+
+    def __str__(self):
+        return f"SearchEntry {self.kind}:{self.object_id}"
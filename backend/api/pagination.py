@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PublicFeedPagination(CursorPagination):
+    """
+    Cursor pagination for the public materials feed.
+    Ordering matches the `material_public_feed_idx` partial index.
+    """
+    page_size = 24
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("-updated_at", "-id")
@@ -1,4 +1,5 @@
 from django.core.validators import MinLengthValidator
+from django.db import transaction
 from rest_framework import serializers
 
 from api.models import (
@@ -11,6 +12,7 @@ from api.models import (
     Quiz,
     QuizQuestion,
 )
+from api.services.material_copy import materialize_fork
 
 def validate_file_extension(value):
     import os
@@ -113,6 +115,10 @@ class NoteSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         material = validated_data['material']
         base_title = validated_data['title']
+
+        # Copy-on-write fork: give it its own content before adding to it
+        if material.shared_from_id:
+            materialize_fork(material)
         
         # Generate unique title
         unique_title = self._generate_unique_title(base_title, material)
@@ -250,10 +256,15 @@ class FlashcardSetSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError("You do not have permission to create flashcard sets for this Material.")
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         flashcards_data = validated_data.pop('cards')
         material = validated_data['material']
         base_title = validated_data['title']
+
+        # Copy-on-write fork: give it its own content before adding to it
+        if material.shared_from_id:
+            materialize_fork(material)
         
         # Generate unique title
         unique_title = self._generate_unique_title(base_title, material)
@@ -268,6 +279,7 @@ class FlashcardSetSerializer(serializers.ModelSerializer):
         
         return flashcard_set
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         # Handle flashcards if they're provided in the update
         flashcards_data = validated_data.pop('cards', None)
@@ -523,10 +535,15 @@ class QuizSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError("You do not have permission to create a quiz for this Material.")
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         questions_data = validated_data.pop('questions')
         material = validated_data['material']
         base_title = validated_data['title']
+
+        # Copy-on-write fork: give it its own content before adding to it
+        if material.shared_from_id:
+            materialize_fork(material)
         
         # Generate unique title
         unique_title = self._generate_unique_title(base_title, material)
@@ -541,6 +558,7 @@ class QuizSerializer(serializers.ModelSerializer):
         
         return quiz
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         # Handle questions if they're provided in the update
         questions_data = validated_data.pop('questions', None)
@@ -584,7 +602,8 @@ class MaterialSerializer(serializers.ModelSerializer):
         help_text="(Optional) A short description of this material.",
     )
     status = serializers.ChoiceField(
-        choices=Material.STATUS_CHOICES,
+        # Snapshots are only created by fork freezing
+        choices=[choice for choice in Material.STATUS_CHOICES if choice[0] != "snapshot"],
         default="active",
         help_text="Must be one of: 'active' or 'trash'.",
     )
@@ -596,15 +615,24 @@ class MaterialSerializer(serializers.ModelSerializer):
         default=False,
         help_text="Whether this Material is shared publicly."
     )
+    answer_cache_enabled = serializers.BooleanField(
+        default=False,
+        help_text="Whether tutor answers about this Material may be cached and reused."
+    )
     
     # Add owner as read-only field
     owner = serializers.StringRelatedField(read_only=True)
     
     # Related objects (read-only)
     attachments = AttachmentSerializer(many=True, read_only=True)
-    notes = NoteSerializer(many=True, read_only=True)
-    flashcard_sets = FlashcardSetSerializer(many=True, read_only=True)
-    quizzes = QuizSerializer(many=True, read_only=True)
+    # Copy-on-write forks show the content of the material they were forked from
+    notes = NoteSerializer(many=True, read_only=True, source="content_material.notes")
+    flashcard_sets = FlashcardSetSerializer(many=True, read_only=True, source="content_material.flashcard_sets")
+    quizzes = QuizSerializer(many=True, read_only=True, source="content_material.quizzes")
+    shared_from = serializers.PrimaryKeyRelatedField(
+        read_only=True,
+        help_text="ID of the source material while this is an unmodified copy-on-write fork."
+    )
 
     class Meta:
         model = Material
@@ -616,14 +644,16 @@ class MaterialSerializer(serializers.ModelSerializer):
             "status",
             "pinned",
             "public",
+            "answer_cache_enabled",
             "attachments",
             "notes",
             "flashcard_sets",
             "quizzes",
+            "shared_from",
             "created_at",
             "updated_at",
         ]
-        read_only_fields = ["id", "owner", "created_at", "updated_at"]
+        read_only_fields = ["id", "owner", "shared_from", "created_at", "updated_at"]
 
     def validate_title(self, value):
         clean = value.strip()
@@ -651,6 +681,37 @@ class MaterialSerializer(serializers.ModelSerializer):
         return data
 
 
+class MaterialSummarySerializer(serializers.ModelSerializer):
+    """
+    Lightweight Material representation for feeds: content counts
+    (annotated on the queryset) instead of the nested trees.
+    """
+    owner = serializers.StringRelatedField(read_only=True)
+    attachments_count = serializers.IntegerField(read_only=True)
+    notes_count = serializers.IntegerField(read_only=True)
+    flashcard_sets_count = serializers.IntegerField(read_only=True)
+    quizzes_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Material
+        fields = [
+            "id",
+            "owner",
+            "title",
+            "description",
+            "status",
+            "pinned",
+            "public",
+            "attachments_count",
+            "notes_count",
+            "flashcard_sets_count",
+            "quizzes_count",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = fields
+
+
 # ===== GENERATION SERIALIZERS =====
 
 class FlashcardGenerationSerializer(serializers.Serializer):
@@ -673,4 +734,18 @@ class QuizGenerationSerializer(serializers.Serializer):
         max_value=20,
         default=5,
         help_text="How many multiple-choice questions to generate (1–20)."
-    )
\ No newline at end of file
+    )
+
+class GenerateAllSerializer(serializers.Serializer):
+    num_cards = serializers.IntegerField(
+        min_value=1,
+        max_value=20,
+        default=5,
+        help_text="How many flashcards to generate (1–20)."
+    )
+    num_questions = serializers.IntegerField(
+        min_value=1,
+        max_value=20,
+        default=5,
+        help_text="How many multiple-choice questions to generate (1–20)."
+    )
@@ -1,50 +1,207 @@
 import os
-import json
-import re
+import logging
+import time
 from django.conf import settings
-from openai import OpenAI
+from openai import BadRequestError, OpenAI
 from docx import Document as DocxDocument
 from pptx import Presentation as PptxPresentation
 from PyPDF2 import PdfReader
 
+from api.services.llm_json import (
+    FLASHCARD_SCHEMA,
+    FLASHCARDS_SCHEMA,
+    KEY_FACTS_SCHEMA,
+    NOTE_SCHEMA,
+    QUIZ_QUESTION_SCHEMA,
+    QUIZ_SCHEMA,
+    IncrementalJSONParser,
+    SchemaError,
+    loads_model_json,
+    locate_json,
+    parse_model_output,
+)
+from api.services import conversation_router
+from api.services.map_reduce import chunk_text, dedupe_facts, map_bounded, run_concurrently
+from api.services.material_retrieval import relevant_chunks
+from api.services.near_duplicates import NearDuplicateFilter, get_index as get_near_duplicate_index
+from RataTutor.utils import metrics
+from RataTutor.utils.profiling import span
+from RataTutor.utils.instrumentation import record_llm_call, timed
+
 import sys
 
 if os.name == 'nt':
     sys.stdout.reconfigure(encoding='utf-8')
 
 
+logger = logging.getLogger(__name__)
+# Per-item messages (one per file, question, ...) are sampled, see LOGGING in settings
+item_logger = logging.getLogger("api.items")
+
 client = OpenAI(
     base_url="https://openrouter.ai/api/v1",
     api_key=settings.OPENROUTER_API_KEY,
 )
 
+def _chat_completion(task, **kwargs):
+    """
+    client.chat.completions.create() that records latency and token usage,
+    both for the current request and in the /metrics histograms for `task`
+    (chat, summary, flashcards, notes, quiz, key_facts, and <task>_repair).
+    """
+    started = time.perf_counter()
+    response = None
+    try:
+        with span(f"llm:{task}"):
+            response = client.chat.completions.create(**kwargs)
+        return response
+    except Exception:
+        metrics.LLM_ERRORS.inc(task=task)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        usage = getattr(response, "usage", None)
+        record_llm_call(duration, usage)
+        metrics.LLM_REQUEST_SECONDS.observe(duration, task=task)
+        if usage is not None:
+            metrics.LLM_PROMPT_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, task=task)
+            metrics.LLM_COMPLETION_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, task=task)
+
+def _stream_completion(task, **kwargs):
+    """
+    Streaming counterpart of _chat_completion: returns an iterator of content
+    deltas. The request is sent (and may raise) before this returns; metrics
+    are recorded once the stream is exhausted or closed.
+    """
+    started = time.perf_counter()
+    try:
+        stream = client.chat.completions.create(stream=True, **kwargs)
+    except Exception:
+        metrics.LLM_ERRORS.inc(task=task)
+        metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, task=task)
+        raise
+    return _iter_stream(task, stream, started)
+
+
+def _iter_stream(task, stream, started):
+    usage = None
+    try:
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception:
+        metrics.LLM_ERRORS.inc(task=task)
+        raise
+    finally:
+        # Also reached when the client disconnects and the generator is closed
+        stream.close()
+        duration = time.perf_counter() - started
+        record_llm_call(duration, usage)
+        metrics.LLM_REQUEST_SECONDS.observe(duration, task=task)
+        if usage is not None:
+            metrics.LLM_PROMPT_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, task=task)
+            metrics.LLM_COMPLETION_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, task=task)
+
+
+GENERATION_MODEL = "deepseek/deepseek-chat-v3-0324:free"
+
+# Digests still over the threshold are condensed again (textbook-sized
+# uploads); each round shrinks the text several times over
+MAP_REDUCE_MAX_ROUNDS = 4
+
+# Expected shapes, sent with repair requests instead of the whole prompt
+JSON_SHAPES = {
+    "flashcards": '{"title": "...", "description": "...", "flashcards": [{"question": "...", "answer": "..."}]}',
+    "notes": '{"title": "...", "description": "...", "content": "<markdown>"}',
+    "quiz": '{"title": "...", "description": "...", "questions": [{"question_text": "...", '
+            '"choices": ["...", "..."], "correct_answer": "<exact text of one choice>"}]}',
+    "key_facts": '{"facts": ["..."]}',
+}
+
+# Models the provider rejected response_format for (per process)
+_json_mode_unsupported = set()
+
+
+def _rejects_json_mode(error):
+    """Whether a BadRequestError is about response_format, not the request itself."""
+    if getattr(error, "param", None) == "response_format":
+        return True
+    message = str(getattr(error, "message", error)).lower()
+    return any(hint in message for hint in ("response_format", "json_object", "json mode"))
+
+
+def _json_mode_call(call, task, messages):
+    """
+    call(task, **kwargs) with response_format json_object when LLM_JSON_MODE
+    is on, falling back to a plain request if the model rejects it. Other
+    bad requests (context too long, invalid messages, ...) are raised as is.
+    """
+    kwargs = {"model": GENERATION_MODEL, "messages": messages}
+    if not settings.LLM_JSON_MODE or GENERATION_MODEL in _json_mode_unsupported:
+        return call(task, **kwargs)
+    try:
+        return call(task, response_format={"type": "json_object"}, **kwargs)
+    except BadRequestError as e:
+        if not _rejects_json_mode(e):
+            raise
+        logger.info("JSON mode rejected for %s, retrying without it: %s", GENERATION_MODEL, e)
+        _json_mode_unsupported.add(GENERATION_MODEL)
+        return call(task, **kwargs)
+
+
+def _generate_json(task, system_prompt, schema):
+    """
+    Run a generation prompt and return its validated JSON payload.
+
+    Uses JSON mode (response_format json_object) when LLM_JSON_MODE is on and
+    the model accepts it. If the output still does not parse or validate,
+    one cheap repair call is made with only the broken JSON and the error,
+    instead of failing after the full (expensive) completion.
+    """
+    response = _json_mode_call(_chat_completion, task, [{"role": "system", "content": system_prompt}])
+
+    raw = (response.choices[0].message.content or "").strip()
+    try:
+        return parse_model_output(raw, schema)
+    except ValueError as e:
+        if not settings.LLM_JSON_REPAIR:
+            logger.warning("%s JSON invalid (%s); raw response: %s", task, e, raw)
+            raise ValueError(f"AI did not return valid JSON for {task}: {e}\n\nRaw response: {raw}")
+        logger.info("%s JSON invalid (%s); requesting a repair", task, e)
+        return _repair_json(task, raw, e, schema)
+
+
+def _repair_json(task, raw, error, schema):
+    """Ask the model to fix only the broken JSON (no source material is resent)."""
+    located = locate_json(raw)
+    fragment = raw[located[0]:] if located else raw
+    prompt = (
+        "The JSON below is invalid. Fix it and return ONLY the corrected JSON object. "
+        "Keep all existing content; do not add new items.\n\n"
+        f"Problem: {error}\n"
+        f"Required structure: {JSON_SHAPES[task]}\n\n"
+        f"JSON:\n{fragment}"
+    )
+    response = _json_mode_call(_chat_completion, f"{task}_repair", [{"role": "user", "content": prompt}])
+    repaired = (response.choices[0].message.content or "").strip()
+    try:
+        return parse_model_output(repaired, schema)
+    except ValueError as e:
+        logger.warning("%s JSON still invalid after repair (%s); raw response: %s", task, e, raw)
+        raise ValueError(f"AI did not return valid JSON for {task}: {e}\n\nRaw response: {raw}")
+
+
 # ===== UTILITY FUNCTIONS =====
 
 def extract_json_from_response(text):
-    """Extract JSON from markdown code blocks or return as-is"""
-    # Try to find JSON in code blocks first
-    
-    # Look for ```json ... ``` blocks
-    json_match = re.search(r'```json\s*\n(.*?)\n```', text, re.DOTALL)
-    if json_match:
-        print("🔍 Found JSON in ```json code block")
-        return json_match.group(1).strip()
-    
-    # Look for ``` ... ``` blocks (any language)
-    code_match = re.search(r'```[a-zA-Z]*\s*\n(.*?)\n```', text, re.DOTALL)
-    if code_match:
-        print("🔍 Found JSON in generic code block")
-        return code_match.group(1).strip()
-    
-    # Look for just the JSON object (starts with { and ends with })
-    json_obj_match = re.search(r'\{.*\}', text, re.DOTALL)
-    if json_obj_match:
-        print("🔍 Found JSON object in text")
-        return json_obj_match.group(0).strip()
-    
-    # Return as-is if no patterns found
-    print("🔍 No JSON patterns found, returning raw text")
-    return text.strip()
+    """Return the JSON object in a model response (fenced, bare or inside prose), or the text as-is"""
+    located = locate_json(text)
+    if located is None:
+        logger.debug("No JSON object found, returning raw text")
+        return text.strip()
+    start, end = located
+    return text[start:end].strip() if end is not None else text[start:].strip()
 
 
 def validate_and_improve_title(title, content_type, material_title):
@@ -88,33 +245,76 @@ def generate_fallback_title(content_type, material_title, timestamp=None):
 
 # ===== FILE EXTRACTION FUNCTIONS =====
 
-def extract_text_from_pdf(path_on_disk: str) -> str:
-    reader = PdfReader(path_on_disk)
-    full_text = []
-    for page in reader.pages:
-        full_text.append(page.extract_text() or "")
-    return "\n".join(full_text)
+SUPPORTED_EXTENSIONS = ['.pdf', '.docx', '.txt', '.pptx']
 
-def extract_text_from_docx(path_on_disk: str) -> str:
-    doc = DocxDocument(path_on_disk)
-    paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
-    return "\n".join(paragraphs)
+# DOCX/TXT have no real pages: group paragraphs into sections of roughly this size
+SECTION_CHAR_LIMIT = 3000
 
-def read_text_file(path_on_disk: str) -> str:
-    with open(path_on_disk, "r", encoding="utf-8") as f:
-        return f.read()
+def iter_pdf_pages(path_on_disk: str):
+    """Yield (page_number, text) for every page of a PDF, starting at 1."""
+    reader = PdfReader(path_on_disk)
+    for number, page in enumerate(reader.pages, start=1):
+        yield number, page.extract_text() or ""
 
-def extract_text_from_pptx(path_on_disk: str) -> str:
+def iter_pptx_slides(path_on_disk: str):
+    """Yield (slide_number, text) for every slide that has text, starting at 1."""
     prs = PptxPresentation(path_on_disk)
-    slides_text = []
-    for slide in prs.slides:
+    for number, slide in enumerate(prs.slides, start=1):
         slide_paras = []
         for shape in slide.shapes:
             if hasattr(shape, "text") and shape.text.strip():
                 slide_paras.append(shape.text.strip())
         if slide_paras:
-            slides_text.append("\n".join(slide_paras))
-    return "\n\n".join(slides_text)
+            yield number, "\n".join(slide_paras)
+
+def iter_sections(lines):
+    """Yield (section_number, text) groups of lines of about SECTION_CHAR_LIMIT characters."""
+    number, section, size = 1, [], 0
+    for line in lines:
+        if section and size + len(line) > SECTION_CHAR_LIMIT:
+            yield number, "\n".join(section)
+            number, section, size = number + 1, [], 0
+        section.append(line)
+        size += len(line) + 1
+    if section:
+        yield number, "\n".join(section)
+
+def iter_docx_sections(path_on_disk: str):
+    doc = DocxDocument(path_on_disk)
+    return iter_sections(p.text for p in doc.paragraphs if p.text.strip())
+
+def iter_text_file_sections(path_on_disk: str):
+    return iter_sections(read_text_file(path_on_disk).split("\n"))
+
+PAGE_EXTRACTORS = {
+    ".pdf": iter_pdf_pages,
+    ".docx": iter_docx_sections,
+    ".txt": iter_text_file_sections,
+    ".pptx": iter_pptx_slides,
+}
+
+def iter_file_pages(path_on_disk: str):
+    """
+    Yield (page_number, text) for a supported file: PDF pages, PPTX slides,
+    or fixed-size sections for DOCX/TXT. Raises ValueError for other types.
+    """
+    ext = os.path.splitext(path_on_disk)[1].lower()
+    if ext not in PAGE_EXTRACTORS:
+        raise ValueError(f"Unsupported file type: {ext}")
+    return PAGE_EXTRACTORS[ext](path_on_disk)
+
+def extract_text_from_pdf(path_on_disk: str) -> str:
+    return "\n".join(text for _, text in iter_pdf_pages(path_on_disk))
+
+def extract_text_from_docx(path_on_disk: str) -> str:
+    return "\n".join(text for _, text in iter_docx_sections(path_on_disk))
+
+def read_text_file(path_on_disk: str) -> str:
+    with open(path_on_disk, "r", encoding="utf-8") as f:
+        return f.read()
+
+def extract_text_from_pptx(path_on_disk: str) -> str:
+    return "\n\n".join(text for _, text in iter_pptx_slides(path_on_disk))
 
 def gather_material_text(material, specific_attachment_ids=None) -> str:
     """Extract text from specific attachments or all attachments in a material"""
@@ -124,10 +324,10 @@ def gather_material_text(material, specific_attachment_ids=None) -> str:
     
     if specific_attachment_ids:
         attachments = material.attachments.filter(id__in=specific_attachment_ids)
-        print(f"🎯 Processing {len(specific_attachment_ids)} specific attachments from material '{material.title}'")
+        logger.debug("Processing %d specific attachments from material %s", len(specific_attachment_ids), material.pk)
     else:
         attachments = material.attachments.all()
-        print(f"📁 Processing all {attachments.count()} attachments from material '{material.title}'")
+        logger.debug("Processing all attachments from material %s", material.pk)
     
     attachment_count = attachments.count()
     
@@ -145,41 +345,41 @@ def gather_material_text(material, specific_attachment_ids=None) -> str:
             )
     
     texts = []
-    supported_extensions = ['.pdf', '.docx', '.txt', '.pptx']
     
     for attachment in attachments:
         try:
             path = attachment.file.path
             ext = os.path.splitext(path)[1].lower()
             
-            print(f"🔍 Processing: {attachment.file.name} (ext: {ext})")
+            item_logger.debug("Processing %s (ext: %s)", attachment.file.name, ext)
             
-            if ext not in supported_extensions:
-                print(f"⚠️ Skipping unsupported file type: {ext}")
+            if ext not in SUPPORTED_EXTENSIONS:
+                logger.info("Skipping unsupported file type %s: %s", ext, attachment.file.name)
                 continue
                 
             if not os.path.exists(path):
-                print(f"❌ File not found on disk: {path}")
+                logger.warning("Attachment file not found on disk: %s", path)
                 continue
             
             extracted_text = ""
-            if ext == ".pdf":
-                extracted_text = extract_text_from_pdf(path)
-            elif ext == ".docx":
-                extracted_text = extract_text_from_docx(path)
-            elif ext == ".txt":
-                extracted_text = read_text_file(path)
-            elif ext == ".pptx":
-                extracted_text = extract_text_from_pptx(path)
+            with timed("extraction"), metrics.EXTRACTION_SECONDS.time(file_type=ext.lstrip(".")):
+                if ext == ".pdf":
+                    extracted_text = extract_text_from_pdf(path)
+                elif ext == ".docx":
+                    extracted_text = extract_text_from_docx(path)
+                elif ext == ".txt":
+                    extracted_text = read_text_file(path)
+                elif ext == ".pptx":
+                    extracted_text = extract_text_from_pptx(path)
             
             if extracted_text and extracted_text.strip():
                 texts.append(extracted_text)
-                print(f"✅ Extracted {len(extracted_text)} characters from {attachment.file.name}")
+                item_logger.debug("Extracted %d characters from %s", len(extracted_text), attachment.file.name)
             else:
-                print(f"⚠️ No text content in {attachment.file.name}")
+                logger.info("No text content in %s", attachment.file.name)
                 
         except Exception as e:
-            print(f"❌ Error processing {attachment.file.name}: {str(e)}")
+            logger.warning("Error processing %s: %s", attachment.file.name, e)
             continue
     
     result = "\n\n".join(texts).strip()
@@ -199,23 +399,28 @@ def gather_material_text(material, specific_attachment_ids=None) -> str:
                 "Please ensure files contain text content and are in supported formats (PDF, DOCX, TXT, PPTX)."
             )
     
-    print(f"✅ Total extracted text: {len(result)} characters")
+    logger.debug("Total extracted text: %d characters", len(result))
     return result
 
-def get_relevant_material_chunks(material, user_prompt, max_chunks=3):
+def get_relevant_material_chunks(material, user_prompt, explicit=False, max_chunks=3):
     """
-    Instead of sending entire material text, extract only relevant chunks
-    based on user's current question for large documents.
+    Material passages relevant to the user's question, or "" when none are
+    (retrieval over the indexed attachment pages, see material_retrieval).
+    `explicit`: the question asks about the material, include the best
+    matches even below the relevance threshold.
     """
+    chunks, decision = relevant_chunks(material, user_prompt, explicit)
+    metrics.MATERIAL_CONTEXT_DECISIONS.inc(decision=decision)
+    if chunks:
+        return "\n\n".join(f"[{label}]\n{text}" for label, text in chunks)
+    if decision != "unindexed" or not explicit:
+        return ""
+
+    # ✅ Pages not indexed (yet): previous behaviour, only when asked about the material
     full_text = gather_material_text(material)
     if len(full_text) < 2000:  # Small documents: use full text
         return full_text
-    
-    # Split into chunks
     chunks = [full_text[i:i+1000] for i in range(0, len(full_text), 1000)]
-    
-    # For now, just return first few chunks
-    # TODO: Could make this smarter with AI-based relevance scoring
     return "\n\n".join(chunks[:max_chunks])
 
 # ===== CONVERSATION SUMMARY FUNCTIONS =====
@@ -252,14 +457,15 @@ def generate_conversation_summary(messages, existing_summary=""):
     system_prompt += f"\nMessages:\n{messages_text}"
 
     try:
-        response = client.chat.completions.create(
+        response = _chat_completion(
+            "summary",
             model="deepseek/deepseek-chat-v3-0324:free",
             messages=[{"role": "system", "content": system_prompt}],
             max_tokens=300  # Limit summary length
         )
         return response.choices[0].message.content.strip()
     except Exception as e:
-        print(f"Failed to generate conversation summary: {e}")
+        logger.warning("Failed to generate conversation summary: %s", e)
         return existing_summary
 
 def generate_enhanced_conversation_summary(conversation):
@@ -286,13 +492,14 @@ def generate_enhanced_conversation_summary(conversation):
     """
     
     try:
-        response = client.chat.completions.create(
+        response = _chat_completion(
+            "summary",
             model="deepseek/deepseek-chat-v3-0324:free",
             messages=[{"role": "system", "content": system_prompt}],
             max_tokens=400
         )
         
-        return json.loads(response.choices[0].message.content)
+        return loads_model_json(response.choices[0].message.content)
     except:
         # Fallback to simple summary
         topic = conversation.detect_conversation_topic()
@@ -320,12 +527,12 @@ def generate_ai_response_with_context(conversation, prompt):
     # Build the user prompt with context
     prompt_parts = []
     
-    # Add material text if it's relevant to the question
-    if material and conversation.should_include_material_context(prompt):
-        if material.attachments.exists():
-            material_text = get_relevant_material_chunks(material, prompt)
-            if material_text:
-                prompt_parts.append(f"Study Material:\n{material_text}")
+    # ✅ Add material passages only if retrieval finds them relevant to the question
+    if material and conversation.material_has_attachments:
+        explicit = conversation.should_include_material_context(prompt)
+        material_text = get_relevant_material_chunks(material, prompt, explicit=explicit)
+        if material_text:
+            prompt_parts.append(f"Study Material:\n{material_text}")
     
     # Add conversation context (summary + recent messages)
     conversation_context = conversation.get_context_for_ai()
@@ -338,7 +545,8 @@ def generate_ai_response_with_context(conversation, prompt):
     combined_prompt = "\n\n".join(prompt_parts)
     
     try:
-        response = client.chat.completions.create(
+        response = _chat_completion(
+            "chat",
             model="deepseek/deepseek-chat-v3-0324:free",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -349,12 +557,45 @@ def generate_ai_response_with_context(conversation, prompt):
     except Exception as e:
         raise ValueError(f"AI response generation failed: {str(e)}")
 
+def generate_standalone_answer(material, prompt):
+    """
+    Answer a standalone question from the material alone: no conversation
+    summary, history or material title goes into the prompt, so the answer
+    can be shared through the tutor answer cache with anyone studying the
+    same attachments.
+    """
+    prompt_parts = []
+    explicit = conversation_router.mentions_material(prompt.lower())
+    material_text = get_relevant_material_chunks(material, prompt, explicit=explicit)
+    if material_text:
+        prompt_parts.append(f"Study Material:\n{material_text}")
+    prompt_parts.append(f"Current Question:\n{prompt}")
+
+    system_prompt = (
+        "You are an AI tutor helping students learn. "
+        "Assist with general learning questions in a helpful and encouraging manner. "
+        "Reference the uploaded content when relevant."
+    )
+    try:
+        response = _chat_completion(
+            "chat",
+            model="deepseek/deepseek-chat-v3-0324:free",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": "\n\n".join(prompt_parts)}
+            ],
+        )
+        return response.choices[0].message.content
+    except Exception as e:
+        raise ValueError(f"AI response generation failed: {str(e)}")
+
 # ===== LEGACY FUNCTIONS (for backward compatibility) =====
 
 def generate_ai_response(text: str) -> str:
     """Simple AI response for basic prompts without conversation context"""
     try:
-        response = client.chat.completions.create(
+        response = _chat_completion(
+            "chat",
             model="deepseek/deepseek-chat-v3-0324:free",
             messages=[{"role": "user", "content": text}],
         )
@@ -374,7 +615,8 @@ def generate_ai_response_for_material(material, prompt: str) -> str:
     combined = f"{text_body}\n\nUser prompt:\n{prompt}"
 
     try:
-        response = client.chat.completions.create(
+        response = _chat_completion(
+            "chat",
             model="deepseek/deepseek-chat-v3-0324:free",
             messages=[{"role": "user", "content": combined}]
         )
@@ -384,17 +626,73 @@ def generate_ai_response_for_material(material, prompt: str) -> str:
 
 # ===== CONTENT GENERATION FUNCTIONS =====
 
-def generate_flashcards_from_material(material, num_cards: int = 5, specific_attachment_ids=None) -> dict:
-    """Generate flashcards with more specific titles"""
+def _material_text(material, specific_attachment_ids=None):
+    """
+    Text of the material's attachments for a generation prompt (condensed to
+    key facts when too large, see _condense_material), or ValueError if there is none
+    """
     text_body = gather_material_text(material, specific_attachment_ids)
     if not text_body:
         if specific_attachment_ids:
             raise ValueError("No extractable text found in the specified attachments.")
         else:
             raise ValueError("No extractable text found in this Material's attachments.")
+    return _condense_material(text_body)
 
-    # ✅ IMPROVED: More specific prompt for unique titles
+
+def _extract_key_facts(chunk):
+    """Map step: the key facts of one chunk of a large material"""
     system_prompt = (
+        "You are an AI study helper. Extract the key facts from the excerpt below: definitions, "
+        "core concepts, important details, formulas, dates and examples. Each fact must be a short, "
+        "self-contained sentence. Do not add anything that is not in the excerpt.\n\n"
+        "**RETURN ONLY RAW JSON** in this structure:\n"
+        "{ \"facts\": [\"...\", \"...\"] }\n\n"
+        f"Excerpt:\n\"\"\"\n{chunk}\n\"\"\"\n"
+    )
+    return _generate_json("key_facts", system_prompt, KEY_FACTS_SCHEMA)["facts"]
+
+
+def _condense_material(text_body):
+    """
+    Map-reduce for materials longer than MAP_REDUCE_THRESHOLD_CHARS: split the
+    text into chunks of at most MAP_REDUCE_CHUNK_CHARS (one map prompt each),
+    extract key facts from them in passes of MAP_REDUCE_MAX_CHUNKS chunks (at
+    most MAP_REDUCE_MAX_WORKERS LLM calls at once) and return the
+    deduplicated facts, in document order, as the text for the final
+    generation prompt. Digests that are still too long are condensed again.
+    """
+    rounds = 0
+    while len(text_body) > settings.MAP_REDUCE_THRESHOLD_CHARS and rounds < MAP_REDUCE_MAX_ROUNDS:
+        rounds += 1
+        chunks = chunk_text(text_body, settings.MAP_REDUCE_CHUNK_CHARS)
+        batch_size = max(1, settings.MAP_REDUCE_MAX_CHUNKS)
+        logger.info("Condensing %d characters in %d chunks (round %d)", len(text_body), len(chunks), rounds)
+
+        results = []
+        for start in range(0, len(chunks), batch_size):
+            with timed("map"):
+                results.extend(map_bounded(
+                    _extract_key_facts, chunks[start:start + batch_size], settings.MAP_REDUCE_MAX_WORKERS
+                ))
+        if all(result is None for result in results):
+            raise ValueError("Could not extract key facts from this material.")
+
+        facts = dedupe_facts([fact for result in results if result for fact in result])
+        if not facts:
+            raise ValueError("No key facts found in this material.")
+        logger.info("Reduced to %d key facts (%d chunks failed)", len(facts), results.count(None))
+        condensed = "Key facts extracted from a long document, in order:\n" + "\n".join(f"- {fact}" for fact in facts)
+        if len(condensed) >= len(text_body):
+            break  # Another round would not make it any shorter
+        text_body = condensed
+    return text_body
+
+
+def _flashcards_prompt(text_body, num_cards):
+    """System prompt for generating `num_cards` flashcards from `text_body`"""
+    # ✅ IMPROVED: More specific prompt for unique titles
+    return (
         f"You are an AI study helper. From the material below, generate exactly {num_cards} "
         "simple question-answer flashcards. Create a SPECIFIC title that includes key topics "
         "or concepts from the material (not just generic titles like 'Flashcards' or 'Study Cards').\n\n"
@@ -419,62 +717,73 @@ def generate_flashcards_from_material(material, num_cards: int = 5, specific_att
         f"Material:\n\"\"\"\n{text_body}\n\"\"\"\n"
     )
 
-    try:
-        response = client.chat.completions.create(
-            model="deepseek/deepseek-chat-v3-0324:free",
-            messages=[{"role": "system", "content": system_prompt}],
-        )
-        raw = response.choices[0].message.content.strip()
 
-        # ✅ Extract JSON from response (handles markdown code blocks)
-        json_content = extract_json_from_response(raw)
-        print(f"🔍 Extracted JSON content: {json_content[:200]}...")
+def _quiz_prompt(text_body, num_questions):
+    """System prompt for generating `num_questions` multiple-choice questions from `text_body`"""
+    # ✅ IMPROVED: More specific prompt for unique titles
+    return (
+        f"You are an AI tutor. Generate exactly {num_questions} multiple-choice questions "
+        "based on the study material below. Create a SPECIFIC quiz title that reflects the "
+        "actual content and topics covered (not generic titles like 'Quiz' or 'Test').\n\n"
+        
+        "**TITLE REQUIREMENTS:**\n"
+        "- Include specific subject matter covered in the quiz\n"
+        "- Add context like chapter/topic/difficulty if apparent\n"
+        "- Use descriptive words that identify the content\n"
+        "- Examples: 'Biology Quiz: Cellular Respiration', 'Chapter 5: World War II Events', 'Advanced Python: OOP Concepts'\n\n"
+        
+        "**RETURN ONLY RAW JSON - NO MARKDOWN, NO CODE BLOCKS, NO EXTRA TEXT.**\n"
+        "Start your response immediately with { and end with }\n\n"
+        "IMPORTANT: For 'correct_answer', provide the FULL TEXT of the correct choice, not just a letter.\n\n"
+        "Expected JSON structure:\n"
+        "{\n"
+        "  \"title\": \"<specific descriptive quiz title>\",\n"
+        "  \"description\": \"<description mentioning topics and difficulty>\",\n"
+        "  \"questions\": [\n"
+        "    {\n"
+        "      \"question_text\": \"What is the main topic?\",\n"
+        "      \"choices\": [\"First option\", \"Second option\", \"Third option\", \"Fourth option\"],\n"
+        "      \"correct_answer\": \"Second option\"\n"
+        "    },\n"
+        f"    ... (exactly {num_questions} questions)\n"
+        "  ]\n"
+        "}\n\n"
+        "REMEMBER: correct_answer must be the EXACT TEXT from one of the choices!\n\n"
+        f"Material:\n\"\"\"\n{text_body}\n\"\"\"\n"
+    )
+
 
-        try:
-            parsed = json.loads(json_content)
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON parsing failed. Raw response: {raw}")
-            raise ValueError(f"AI did not return valid JSON for flashcards: {e}\n\nRaw response: {raw}")
-
-        title = parsed.get("title")
-        description = parsed.get("description")
-        cards = parsed.get("flashcards")
-
-        if not isinstance(title, str) or not title.strip():
-            raise ValueError("AI did not return a valid 'title' for the flashcard set.")
-        if not isinstance(description, str):
-            description = ""
-        if not isinstance(cards, list) or len(cards) < 1:
-            raise ValueError("AI JSON did not contain a valid 'flashcards' array.")
-
-        validated = []
-        for idx, obj in enumerate(cards):
-            q = obj.get("question", "").strip()
-            a = obj.get("answer", "").strip()
-            if not q or not a:
-                raise ValueError(f"Flashcard #{idx+1} missing question or answer: {obj}")
-            validated.append({"question": q, "answer": a})
+def generate_flashcards_from_material(material, num_cards: int = 5, specific_attachment_ids=None, text_body=None) -> dict:
+    """Generate flashcards with more specific titles (`text_body`: already extracted material text)"""
+    if text_body is None:
+        text_body = _material_text(material, specific_attachment_ids)
+    system_prompt = _flashcards_prompt(text_body, num_cards)
+
+    try:
+        # ✅ JSON mode + validation (salvages truncated output, repairs broken JSON)
+        parsed = _generate_json("flashcards", system_prompt, FLASHCARDS_SCHEMA)
+
+        # ✅ Skip cards the material (or this batch) already has
+        flashcards = NearDuplicateFilter(material, "flashcard").filter(parsed["flashcards"])
+        if not flashcards:
+            raise ValueError("All generated flashcards duplicate existing ones")
 
         # ✅ Validate and improve title
-        improved_title = validate_and_improve_title(title.strip(), 'flashcards', material.title)
+        improved_title = validate_and_improve_title(parsed["title"], 'flashcards', material.title)
 
         return {
             "title": improved_title,
-            "description": description.strip(),
-            "flashcards": validated,
+            "description": parsed["description"],
+            "flashcards": flashcards,
         }
     except Exception as e:
         raise ValueError(f"Flashcard generation failed: {str(e)}")
 
 
-def generate_notes_from_material(material, specific_attachment_ids=None) -> dict:
-    """Generate notes with more specific titles"""
-    text_body = gather_material_text(material, specific_attachment_ids)
-    if not text_body:
-        if specific_attachment_ids:
-            raise ValueError("No extractable text found in the specified attachments.")
-        else:
-            raise ValueError("No extractable text found in this Material's attachments.")
+def generate_notes_from_material(material, specific_attachment_ids=None, text_body=None) -> dict:
+    """Generate notes with more specific titles (`text_body`: already extracted material text)"""
+    if text_body is None:
+        text_body = _material_text(material, specific_attachment_ids)
 
     # ✅ IMPROVED: More specific prompt for unique titles
     system_prompt = (
@@ -507,202 +816,109 @@ def generate_notes_from_material(material, specific_attachment_ids=None) -> dict
     )
 
     try:
-        response = client.chat.completions.create(
-            model="deepseek/deepseek-chat-v3-0324:free",
-            messages=[{"role": "system", "content": system_prompt}],
-        )
-        raw = response.choices[0].message.content.strip()
-
-        # ✅ Extract JSON from response (handles markdown code blocks)
-        json_content = extract_json_from_response(raw)
-        print(f"🔍 Extracted JSON content: {json_content[:200]}...")
-
-        try:
-            parsed = json.loads(json_content)
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON parsing failed. Raw response: {raw}")
-            raise ValueError(f"AI did not return valid JSON for notes: {e}\n\nRaw response: {raw}")
-
-        title = parsed.get("title")
-        description = parsed.get("description")
-        content = parsed.get("content")
-
-        if not isinstance(title, str) or not title.strip():
-            raise ValueError("AI did not return a valid 'title' for the note.")
-        if not isinstance(description, str):
-            description = ""
-        if not isinstance(content, str) or not content.strip():
-            raise ValueError("AI did not return valid 'content' for the note.")
+        # ✅ JSON mode + validation (salvages truncated output, repairs broken JSON)
+        parsed = _generate_json("notes", system_prompt, NOTE_SCHEMA)
 
         # ✅ Validate and improve title
-        improved_title = validate_and_improve_title(title.strip(), 'notes', material.title)
+        improved_title = validate_and_improve_title(parsed["title"], 'notes', material.title)
 
         return {
             "title": improved_title,
-            "description": description.strip(),
-            "content": content.strip(),
+            "description": parsed["description"],
+            "content": parsed["content"],
         }
     except Exception as e:
         raise ValueError(f"Notes generation failed: {str(e)}")
 
 
-def generate_quiz_from_material(material, num_questions: int = 5, specific_attachment_ids=None) -> dict:
-    """Generate quiz with more specific titles"""
-    text_body = gather_material_text(material, specific_attachment_ids)
-    if not text_body:
-        if specific_attachment_ids:
-            raise ValueError("No extractable text found in the specified attachments.")
-        else:
-            raise ValueError("No extractable text found in this Material's attachments.")
-
-    # ✅ IMPROVED: More specific prompt for unique titles
-    system_prompt = (
-        f"You are an AI tutor. Generate exactly {num_questions} multiple-choice questions "
-        "based on the study material below. Create a SPECIFIC quiz title that reflects the "
-        "actual content and topics covered (not generic titles like 'Quiz' or 'Test').\n\n"
-        
-        "**TITLE REQUIREMENTS:**\n"
-        "- Include specific subject matter covered in the quiz\n"
-        "- Add context like chapter/topic/difficulty if apparent\n"
-        "- Use descriptive words that identify the content\n"
-        "- Examples: 'Biology Quiz: Cellular Respiration', 'Chapter 5: World War II Events', 'Advanced Python: OOP Concepts'\n\n"
-        
-        "**RETURN ONLY RAW JSON - NO MARKDOWN, NO CODE BLOCKS, NO EXTRA TEXT.**\n"
-        "Start your response immediately with { and end with }\n\n"
-        "IMPORTANT: For 'correct_answer', provide the FULL TEXT of the correct choice, not just a letter.\n\n"
-        "Expected JSON structure:\n"
-        "{\n"
-        "  \"title\": \"<specific descriptive quiz title>\",\n"
-        "  \"description\": \"<description mentioning topics and difficulty>\",\n"
-        "  \"questions\": [\n"
-        "    {\n"
-        "      \"question_text\": \"What is the main topic?\",\n"
-        "      \"choices\": [\"First option\", \"Second option\", \"Third option\", \"Fourth option\"],\n"
-        "      \"correct_answer\": \"Second option\"\n"
-        "    },\n"
-        f"    ... (exactly {num_questions} questions)\n"
-        "  ]\n"
-        "}\n\n"
-        "REMEMBER: correct_answer must be the EXACT TEXT from one of the choices!\n\n"
-        f"Material:\n\"\"\"\n{text_body}\n\"\"\"\n"
-    )
+def generate_quiz_from_material(material, num_questions: int = 5, specific_attachment_ids=None, text_body=None) -> dict:
+    """Generate quiz with more specific titles (`text_body`: already extracted material text)"""
+    if text_body is None:
+        text_body = _material_text(material, specific_attachment_ids)
+    system_prompt = _quiz_prompt(text_body, num_questions)
 
     try:
-        response = client.chat.completions.create(
-            model="deepseek/deepseek-chat-v3-0324:free",
-            messages=[{"role": "system", "content": system_prompt}],
-        )
-        raw = response.choices[0].message.content.strip()
+        # ✅ JSON mode + validation (salvages truncated output, repairs broken JSON)
+        parsed = _generate_json("quiz", system_prompt, QUIZ_SCHEMA)
 
-        # ✅ Extract JSON from response (handles markdown code blocks)
-        json_content = extract_json_from_response(raw)
-        print(f"🔍 Quiz JSON content: {json_content[:200]}...")
+        logger.debug("%d quiz questions validated", len(parsed["questions"]))
 
-        try:
-            parsed = json.loads(json_content)
-        except json.JSONDecodeError as e:
-            print(f"❌ Quiz JSON parsing failed. Raw response: {raw}")
-            raise ValueError(f"AI did not return valid JSON for quiz: {e}\n\nRaw response: {raw}")
-
-        # ✅ Enhanced validation with better error messages
-        title = parsed.get("title")
-        description = parsed.get("description")
-        questions = parsed.get("questions")
-
-        print(f"🔍 Quiz validation - Title: {title}, Description: {description}, Questions count: {len(questions) if questions else 0}")
-
-        if not isinstance(title, str) or not title.strip():
-            raise ValueError("AI did not return a valid 'title' for the quiz.")
-        if not isinstance(description, str):
-            description = ""
-        if not isinstance(questions, list) or len(questions) < 1:
-            raise ValueError("AI JSON did not contain a valid 'questions' array.")
-
-        validated = []
-        for idx, qobj in enumerate(questions):
-            try:
-                # ✅ More robust validation
-                if not isinstance(qobj, dict):
-                    print(f"❌ Question #{idx+1} is not a dict: {qobj}")
-                    raise ValueError(f"Question #{idx+1} is not a valid object: {qobj}")
-                
-                qt = qobj.get("question_text", "").strip()
-                ch = qobj.get("choices")
-                ca = qobj.get("correct_answer", "").strip()
-                
-                print(f"🔍 Question #{idx+1} - Text: '{qt[:50]}...', Choices: {len(ch) if ch else 0}, Correct: '{ca[:50]}...'")
-                
-                # Validate question text
-                if not qt:
-                    raise ValueError(f"Question #{idx+1} has empty question_text")
-                
-                # Validate choices
-                if not isinstance(ch, list):
-                    raise ValueError(f"Question #{idx+1} choices is not a list: {ch}")
-                if len(ch) < 2:
-                    raise ValueError(f"Question #{idx+1} needs at least 2 choices, got: {len(ch)}")
-                
-                # Clean up choices
-                cleaned_choices = []
-                for i, choice in enumerate(ch):
-                    if not isinstance(choice, str):
-                        raise ValueError(f"Question #{idx+1} choice #{i+1} is not a string: {choice}")
-                    cleaned_choice = choice.strip()
-                    if not cleaned_choice:
-                        raise ValueError(f"Question #{idx+1} choice #{i+1} is empty")
-                    cleaned_choices.append(cleaned_choice)
-                
-                # Validate correct answer
-                if not ca:
-                    raise ValueError(f"Question #{idx+1} has empty correct_answer")
-                
-                # ✅ Handle both letter-based and text-based correct answers
-                if ca in ['A', 'B', 'C', 'D', 'E', 'F'] and len(cleaned_choices) >= ord(ca) - ord('A') + 1:
-                    # Convert letter to actual choice text
-                    choice_index = ord(ca.upper()) - ord('A')
-                    ca = cleaned_choices[choice_index]
-                    print(f"🔄 Converted letter '{qobj.get('correct_answer')}' to choice text: '{ca[:50]}...'")
-                
-                # Check if correct answer matches any choice
-                if ca not in cleaned_choices:
-                    print(f"❌ Question #{idx+1} correct answer '{ca}' not found in choices")
-                    # Try to find a close match (case insensitive and trimmed)
-                    ca_lower = ca.lower().strip()
-                    matches = [choice for choice in cleaned_choices if choice.lower().strip() == ca_lower]
-                    if matches:
-                        ca = matches[0]  # Use the first match
-                        print(f"✅ Found case-insensitive match: '{ca[:50]}...'")
-                    else:
-                        print(f"❌ Available choices:")
-                        for i, choice in enumerate(cleaned_choices):
-                            print(f"   {i+1}. {choice}")
-                        raise ValueError(f"Question #{idx+1} correct_answer '{ca}' not found in choices")
-                
-                validated.append({
-                    "question_text": qt,
-                    "choices": cleaned_choices,
-                    "correct_answer": ca,
-                })
-                print(f"✅ Question #{idx+1} validated successfully")
-                
-            except Exception as validation_error:
-                print(f"❌ Question #{idx+1} validation failed: {validation_error}")
-                raise ValueError(f"Question #{idx+1} validation failed: {validation_error}")
+        # ✅ Skip questions the material (or this batch) already has
+        questions = NearDuplicateFilter(material, "quiz_question").filter(parsed["questions"])
+        if not questions:
+            raise ValueError("All generated questions duplicate existing ones")
 
-        print(f"✅ All {len(validated)} questions validated successfully")
-        
         # ✅ Validate and improve title
-        improved_title = validate_and_improve_title(title.strip(), 'quiz', material.title)
+        improved_title = validate_and_improve_title(parsed["title"], 'quiz', material.title)
         
         return {
             "title": improved_title,
-            "description": description.strip(),
-            "questions": validated,
+            "description": parsed["description"],
+            "questions": questions,
         }
     except Exception as e:
-        print(f"❌ Quiz generation failed: {str(e)}")
+        logger.warning("Quiz generation failed: %s", e)
         raise ValueError(f"Quiz generation failed: {str(e)}")
 
+def generate_all_from_material(material, num_cards: int = 5, num_questions: int = 5, specific_attachment_ids=None) -> dict:
+    """
+    Notes, flashcards and quiz in one pass: the attachments are extracted (and
+    condensed, if large) once, then the three generations run concurrently.
+    Returns {"notes": (result, error), "flashcards": ..., "quiz": ...}.
+    """
+    text_body = _material_text(material, specific_attachment_ids)
+    # Build the duplicate-check indexes here, so the workers read them from the cache
+    get_near_duplicate_index(material, "flashcard")
+    get_near_duplicate_index(material, "quiz_question")
+    return run_concurrently({
+        "notes": lambda: generate_notes_from_material(material, text_body=text_body),
+        "flashcards": lambda: generate_flashcards_from_material(material, num_cards, text_body=text_body),
+        "quiz": lambda: generate_quiz_from_material(material, num_questions, text_body=text_body),
+    }, max_workers=3)
+
+
+# ===== STREAMING GENERATION =====
+
+def _stream_items(task, system_prompt, array_key, item_schema, duplicates):
+    """
+    Yield ("field", (key, value)) and ("item", validated_item) events while
+    the model's JSON streams in; invalid and near-duplicate items are skipped.
+    """
+    parser = IncrementalJSONParser(array_key)
+    deltas = _json_mode_call(_stream_completion, task, [{"role": "system", "content": system_prompt}])
+    index = 0
+    for delta in deltas:
+        for event, payload in parser.feed(delta):
+            if event == "field":
+                yield event, payload
+                continue
+            try:
+                item = item_schema(payload, f"{array_key}[{index}]")
+            except SchemaError as e:
+                logger.info("Dropping invalid streamed item: %s", e)
+            else:
+                if not duplicates.is_duplicate(item):
+                    yield event, item
+            index += 1
+
+
+def stream_flashcards_from_material(material, num_cards: int = 5, specific_attachment_ids=None):
+    """
+    Streaming generate_flashcards_from_material: yields ("field", (key, value))
+    for the title/description and ("item", flashcard) for each card as soon as
+    the model has finished writing it.
+    """
+    text_body = _material_text(material, specific_attachment_ids)
+    duplicates = NearDuplicateFilter(material, "flashcard")
+    return _stream_items("flashcards", _flashcards_prompt(text_body, num_cards), "flashcards", FLASHCARD_SCHEMA, duplicates)
+
+
+def stream_quiz_from_material(material, num_questions: int = 5, specific_attachment_ids=None):
+    """Streaming generate_quiz_from_material, see stream_flashcards_from_material."""
+    text_body = _material_text(material, specific_attachment_ids)
+    duplicates = NearDuplicateFilter(material, "quiz_question")
+    return _stream_items("quiz", _quiz_prompt(text_body, num_questions), "questions", QUIZ_QUESTION_SCHEMA, duplicates)
+
 # ===== HELPER FUNCTIONS =====
 
 def update_conversation_summary(conversation):
@@ -724,11 +940,11 @@ def update_conversation_summary(conversation):
             conversation.summary_context = new_summary
             conversation.reset_summary_counter()
             
-            print(f"🔄 Generated new conversation summary: {new_summary[:100]}...")
+            logger.debug("Generated new summary for conversation %s (%d chars)", conversation.pk, len(new_summary))
             return True
             
         except Exception as e:
-            print(f"⚠️ Failed to generate summary: {e}")
+            logger.warning("Failed to generate summary for conversation %s: %s", conversation.pk, e)
             return False
     
     return False
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""
+Opt-in cache of tutor answers to standalone questions about a material.
+
+Answers are keyed on the material's attachments (their content hashes), not
+on the material row, so copies and forks of the same public material share
+one cache, and adding, removing or replacing an attachment starts a new one.
+A question is served from the cache when its normalised text matches a
+stored question exactly, or when their MinHash signatures (hashed character
+shingles, see near_duplicates) are at least TUTOR_ANSWER_CACHE_SIMILARITY
+similar. Since the answers are shared between users, they are generated
+from the material and the question only (generate_standalone_answer).
+"""
+import hashlib
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from api.models import Attachment
+from api.services.near_duplicates import MinHashIndex, signature
+from RataTutor.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = "tutor-answers:{}"
+
+# Longer prompts are rarely asked twice word for word
+MAX_QUESTION_CHARS = 300
+
+# Questions leaning on the conversation so far ("explain that again") are
+# not standalone: their answer depends on history the cache does not key on
+FOLLOW_UP_WORDS = frozenset(
+    "it its this that these those they them he she him her above previous earlier "
+    "again more else another continue same".split()
+)
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def normalise(question):
+    return _NON_WORD_RE.sub(" ", question.lower()).strip()
+
+
+def is_cacheable(question):
+    normalised = normalise(question)
+    if not normalised or len(normalised) > MAX_QUESTION_CHARS:
+        return False
+    return not FOLLOW_UP_WORDS.intersection(normalised.split())
+
+
+def content_fingerprint(material):
+    """Hash of the material's attachment contents, or None if it has no attachments."""
+    hashes = sorted(
+        content_hash or f"attachment:{pk}"
+        for pk, content_hash in Attachment.objects.filter(material=material).values_list("pk", "content_hash")
+    )
+    if not hashes:
+        return None
+    return hashlib.sha256("\n".join(hashes).encode("utf-8")).hexdigest()
+
+
+class AnswerStore:
+    """Stored answers of one attachment set (picklable, so it can live in the cache)."""
+
+    def __init__(self):
+        self.answers = {}    # normalised question -> (answer, stored_at)
+        self.index = MinHashIndex()
+
+    def _expire(self, now, ttl):
+        for question in [q for q, (_, stored_at) in self.answers.items() if now - stored_at > ttl]:
+            self.drop(question)
+
+    def drop(self, question):
+        self.answers.pop(question, None)
+        self.index.remove(question)
+
+    def find(self, question, threshold, now, ttl):
+        """(answer, "exact" | "similar") or (None, "miss")."""
+        entry = self.answers.get(question)
+        if entry and now - entry[1] <= ttl:
+            return entry[0], "exact"
+
+        sig = signature(question)
+        if sig is None:
+            return None, "miss"
+        match, score = self.index.most_similar(sig)
+        if match is not None and score >= threshold:
+            answer, stored_at = self.answers[match]
+            if now - stored_at <= ttl:
+                return answer, "similar"
+        return None, "miss"
+
+    def add(self, question, answer, now, ttl, max_entries):
+        self._expire(now, ttl)
+        self.drop(question)
+        while len(self.answers) >= max_entries:
+            self.drop(min(self.answers, key=lambda q: self.answers[q][1]))
+        sig = signature(question)
+        if sig is not None:
+            self.answers[question] = (answer, now)
+            self.index.add(question, sig)
+
+
+def cache_key_for(material, question):
+    """Cache key for a question about `material`, or None if the cache does not apply."""
+    if not (settings.TUTOR_ANSWER_CACHE and material is not None and material.answer_cache_enabled):
+        return None
+    if not is_cacheable(question):
+        return None
+    fingerprint = content_fingerprint(material)
+    return CACHE_KEY.format(fingerprint) if fingerprint else None
+
+
+def lookup(key, question):
+    """A cached answer to `question` (key from cache_key_for), or None."""
+    answers = cache.get(key)
+    if answers is None:
+        answer, result = None, "miss"
+    else:
+        answer, result = answers.find(
+            normalise(question), settings.TUTOR_ANSWER_CACHE_SIMILARITY,
+            time.time(), settings.TUTOR_ANSWER_CACHE_TTL,
+        )
+    metrics.TUTOR_ANSWER_CACHE_LOOKUPS.inc(result=result)
+    logger.debug("Tutor answer cache %s (%s)", result, key)
+    return answer
+
+
+def store(key, question, answer):
+    """Remember the answer to a standalone question (key from cache_key_for)."""
+    if not answer:
+        return
+
+    # Read-modify-write: concurrent stores for one attachment set may drop
+    # an entry, which only costs a later miss
+    answers = cache.get(key) or AnswerStore()
+    answers.add(
+        normalise(question), answer, time.time(),
+        settings.TUTOR_ANSWER_CACHE_TTL, settings.TUTOR_ANSWER_CACHE_MAX_ENTRIES,
+    )
+    cache.set(key, answers, settings.TUTOR_ANSWER_CACHE_TTL)
@@ -0,0 +1,52 @@
+"""
+In-process background jobs for work that shouldn't hold up a request
+(e.g. extracting and indexing the text of an uploaded attachment).
+
+Jobs run on a small thread pool per queue after the caller returns. They
+live in the worker process only: a restart drops the queued ones, which
+`manage.py index_attachments` picks up again. With BACKGROUND_TASKS_EAGER
+(tests) jobs run inline instead.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from RataTutor.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool(queue):
+    with _pools_lock:
+        if queue not in _pools:
+            _pools[queue] = ThreadPoolExecutor(
+                max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix=f"background-{queue}"
+            )
+        return _pools[queue]
+
+
+def submit(queue, fn, *args):
+    """Run fn(*args) in the background; errors are logged, not raised."""
+    metrics.QUEUE_DEPTH.inc(queue=queue)
+
+    def run():
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception("Background job %s on queue %s failed", getattr(fn, "__name__", fn), queue)
+        finally:
+            if not settings.BACKGROUND_TASKS_EAGER:
+                # Pool threads open their own DB connections; don't leave them behind
+                connections.close_all()
+            metrics.QUEUE_DEPTH.dec(queue=queue)
+
+    if settings.BACKGROUND_TASKS_EAGER:
+        run()
+    else:
+        _pool(queue).submit(run)
@@ -0,0 +1,71 @@
+"""
+Keyword heuristics used to route chat turns (summary frequency, whether to
+include material text, conversation topic).
+
+The recent messages are lowercased once per turn and each keyword list is
+matched against them with one pass of str.__contains__ per keyword (CPython's
+fast substring search): a combined regex is several times slower on long
+messages (see `manage.py benchmark_conversation_router`), and a pure-Python
+Aho-Corasick automaton, stepping through the text one character at a time,
+is slower still. Matching keeps the substring semantics of the original
+checks ("how" also matches "show").
+
+Imported by api.models, so it must not import models.
+"""
+# The helpers look at this many of the most recent messages
+RECENT_MESSAGES = 5
+
+COMPLEXITY_KEYWORDS = [
+    'explain', 'how', 'why', 'complex', 'detail', 'elaborate',
+    'understand', 'clarify', 'what does this mean'
+]
+
+MATERIAL_KEYWORDS = [
+    'document', 'text', 'material', 'content', 'attachment',
+    'what does it say', 'according to', 'in the material',
+    'from the file', 'in the pdf', 'the document says'
+]
+
+# Checked in order; the first topic with a keyword in the recent messages wins
+TOPIC_KEYWORDS = {
+    'flashcards': ['flashcard', 'term', 'definition', 'memorize', 'remember'],
+    'quiz': ['quiz', 'test', 'question', 'answer', 'multiple choice', 'exam'],
+    'notes': ['note', 'summary', 'key point', 'important', 'summarize'],
+    'study': ['study', 'learn', 'understand', 'explain', 'teach me'],
+    'homework': ['homework', 'assignment', 'project', 'due date'],
+}
+
+
+class KeywordMatcher:
+    """Finds which of a fixed set of keywords occur (as substrings) in a lowercased text."""
+
+    def __init__(self, keywords):
+        self.keywords = tuple(dict.fromkeys(keywords))
+
+    def found(self, text):
+        """Set of keywords occurring in `text` (already lowercased)."""
+        return {keyword for keyword in self.keywords if keyword in text}
+
+    def any(self, text):
+        return any(keyword in text for keyword in self.keywords)
+
+
+COMPLEXITY = KeywordMatcher(COMPLEXITY_KEYWORDS)
+MATERIAL = KeywordMatcher(MATERIAL_KEYWORDS)
+TOPICS = {topic: KeywordMatcher(keywords) for topic, keywords in TOPIC_KEYWORDS.items()}
+
+
+def complexity_score(lowered_messages):
+    """Number of (message, complexity keyword) pairs, as get_summary_threshold counts them."""
+    return sum(len(COMPLEXITY.found(content)) for content in lowered_messages)
+
+
+def mentions_material(lowered_prompt):
+    return MATERIAL.any(lowered_prompt)
+
+
+def detect_topic(lowered_text):
+    for topic, matcher in TOPICS.items():
+        if matcher.any(lowered_text):
+            return topic
+    return "general"
@@ -0,0 +1,220 @@
+"""
+Streaming export and import of conversations.
+
+Messages live in one JSON array column:
+- export unnests the array in the database in one query (json_each on
+  SQLite, jsonb_array_elements WITH ORDINALITY on PostgreSQL) and fetches
+  the rows BATCH_SIZE at a time, so the array is parsed once and never
+  loaded whole into Python
+- import validates each line as it is read and keeps only its serialized
+  message, then writes the array in one UPDATE (rewriting the growing array
+  once per batch made imports quadratic)
+Other backends fall back to loading the array.
+
+NDJSON format: one header line, then one line per message:
+  {"type": "conversation", "material": {"id", "title"}, "summary_context", "created_at", "message_count"}
+  {"type": "message", "role", "content", "timestamp"}
+"""
+import json
+from collections import deque
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Func, IntegerField
+
+from api.models import AIConversation
+from api.services import conversation_router
+
+BATCH_SIZE = 200
+
+ROLES = ("user", "assistant")
+
+ARRAY_LENGTH_FUNCTIONS = {
+    "sqlite": "json_array_length",
+    "postgresql": "jsonb_array_length",
+    "mysql": "JSON_LENGTH",
+}
+
+# One row per array element, in array order ({table}: the conversation table)
+ARRAY_ELEMENTS_SQL = {
+    # json_each walks the array in order
+    "sqlite": "SELECT e.value FROM {table} c, json_each(c.messages) e WHERE c.id = %s",
+    "postgresql": (
+        "SELECT e.value::text FROM {table} c, jsonb_array_elements(c.messages) WITH ORDINALITY e(value, position) "
+        "WHERE c.id = %s ORDER BY e.position"
+    ),
+}
+
+# Writes a serialized JSON array to the messages column
+SET_MESSAGES_SQL = {
+    "sqlite": "UPDATE {table} SET messages = json(%s) WHERE id = %s",
+    "postgresql": "UPDATE {table} SET messages = %s::jsonb WHERE id = %s",
+}
+
+
+class ConversationImportError(ValueError):
+    pass
+
+
+# ===== EXPORT =====
+
+def message_count(conversation_pk):
+    function = ARRAY_LENGTH_FUNCTIONS.get(connection.vendor)
+    qs = AIConversation.objects.filter(pk=conversation_pk)
+    if function is None:
+        return len(qs.values_list("messages", flat=True).get())
+    return qs.annotate(
+        message_count=Func("messages", function=function, output_field=IntegerField())
+    ).values_list("message_count", flat=True).get() or 0
+
+
+def iter_messages(conversation_pk, batch_size=BATCH_SIZE):
+    """Yield the messages of a conversation, fetching `batch_size` array elements at a time."""
+    sql = ARRAY_ELEMENTS_SQL.get(connection.vendor)
+    if sql is None:
+        messages = AIConversation.objects.filter(pk=conversation_pk).values_list("messages", flat=True).first()
+        yield from (message for message in messages or [] if isinstance(message, dict))
+        return
+
+    # A server-side cursor on PostgreSQL: rows are sent as they are fetched
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql.format(table=AIConversation._meta.db_table), [conversation_pk])
+        while rows := cursor.fetchmany(batch_size):
+            for (value,) in rows:
+                message = json.loads(value) if isinstance(value, str) else value
+                if isinstance(message, dict):
+                    yield message
+
+
+def export_header(conversation, count):
+    material = conversation.material
+    return {
+        "type": "conversation",
+        "material": {"id": material.pk, "title": material.title} if material else None,
+        "summary_context": conversation.summary_context,
+        "created_at": conversation.created_at.isoformat(),
+        "message_count": count,
+    }
+
+
+def export_ndjson(conversation):
+    """Yield the conversation as NDJSON lines."""
+    yield json.dumps(export_header(conversation, message_count(conversation.pk))) + "\n"
+    for message in iter_messages(conversation.pk):
+        yield json.dumps({
+            "type": "message",
+            "role": message.get("role", "user"),
+            "content": message.get("content", ""),
+            "timestamp": message.get("timestamp"),
+        }) + "\n"
+
+
+def export_markdown(conversation):
+    """Yield the conversation as a Markdown document."""
+    material = conversation.material
+    yield f"# Conversation: {material.title if material else 'No material'}\n\n"
+    if conversation.summary_context:
+        yield f"> **Summary:** {conversation.summary_context}\n\n"
+    for message in iter_messages(conversation.pk):
+        role = "You" if message.get("role") == "user" else "Tutor"
+        timestamp = message.get("timestamp")
+        heading = f"### {role} — {timestamp}" if timestamp else f"### {role}"
+        yield f"{heading}\n\n{message.get('content', '')}\n\n"
+
+
+# ===== IMPORT =====
+
+def _set_messages(conversation_pk, serialized):
+    """Write the messages (a list of JSON-serialized messages) as the stored array, in one UPDATE."""
+    array = "[" + ",".join(serialized) + "]"
+    sql = SET_MESSAGES_SQL.get(connection.vendor)
+    if sql is None:
+        AIConversation.objects.filter(pk=conversation_pk).update(messages=json.loads(array))
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(table=AIConversation._meta.db_table), [array, conversation_pk])
+
+
+def read_lines(stream, max_bytes):
+    """
+    Yield (number, line) from a file-like `stream` (e.g. the HttpRequest).
+    Each readline() call is bounded, so a line longer than `max_bytes` is
+    rejected after reading at most `max_bytes` + 1 bytes of it.
+    """
+    number = 0
+    while True:
+        raw = stream.readline(max_bytes + 1)
+        if not raw:
+            return
+        number += 1
+        if len(raw.rstrip(b"\n")) > max_bytes:
+            raise ConversationImportError(f"Line {number}: longer than {max_bytes} bytes")
+        yield number, raw
+
+
+def _parse_line(number, raw):
+    try:
+        record = json.loads(raw)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ConversationImportError(f"Line {number}: invalid JSON ({e})")
+    if not isinstance(record, dict):
+        raise ConversationImportError(f"Line {number}: expected a JSON object")
+    return record
+
+
+def _message_from(number, record):
+    role = record.get("role")
+    content = record.get("content")
+    if role not in ROLES:
+        raise ConversationImportError(f"Line {number}: role must be one of {', '.join(ROLES)}")
+    if not isinstance(content, str):
+        raise ConversationImportError(f"Line {number}: content must be a string")
+    timestamp = record.get("timestamp")
+    return {"role": role, "content": content, "timestamp": timestamp if isinstance(timestamp, str) else None}
+
+
+@transaction.atomic
+def import_ndjson(stream, user, material=None):
+    """
+    Create a conversation for `user` (on `material`, if given) from the NDJSON
+    read line by line from `stream` (a file-like object, e.g. the request).
+    Raises ConversationImportError (nothing is saved) on bad input, and
+    IntegrityError if `material` already has a conversation of `user`.
+    """
+    # Created first, so a conflicting import fails before its body is read
+    conversation = AIConversation.objects.create(user=user, material=material, messages=[])
+    recent = deque(maxlen=conversation_router.RECENT_MESSAGES)
+    serialized = []
+    summary = ""
+
+    for number, raw in read_lines(stream, settings.CONVERSATION_IMPORT_MAX_LINE_BYTES):
+        if not raw.strip():
+            continue
+        record = _parse_line(number, raw)
+        kind = record.get("type", "message")
+        if kind == "conversation":
+            if isinstance(record.get("summary_context"), str):
+                summary = record["summary_context"]
+            continue
+        if kind != "message":
+            raise ConversationImportError(f"Line {number}: unknown record type {kind!r}")
+
+        message = _message_from(number, record)
+        if len(serialized) >= settings.CONVERSATION_IMPORT_MAX_MESSAGES:
+            raise ConversationImportError(f"More than {settings.CONVERSATION_IMPORT_MAX_MESSAGES} messages")
+        serialized.append(json.dumps(message))
+        recent.append(message["content"].lower())
+
+    count = len(serialized)
+    if not count:
+        raise ConversationImportError("No messages to import")
+    _set_messages(conversation.pk, serialized)
+
+    # The array was written above: update the other fields without saving it
+    AIConversation.objects.filter(pk=conversation.pk).update(
+        summary_context=summary,
+        messages_since_summary=0 if summary else count,
+        complexity_score=conversation_router.complexity_score(recent),
+        topic=conversation_router.detect_topic(" ".join(recent)),
+    )
+    return conversation.pk, count
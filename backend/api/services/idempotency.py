@@ -0,0 +1,63 @@
+"""
+`Idempotency-Key` support for POST endpoints that call the LLM.
+
+A completed response is stored per (user, endpoint, key) for
+IDEMPOTENCY_KEY_TTL seconds. A retry with the same key and the same body
+gets the stored response back instead of running the request again; the
+same key with a different body is rejected. Concurrent retries of a
+request that is still running share its execution (single flight).
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .single_flight import flight_key, run_once
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+STORED_KEY = "idempotency:{}"
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different body."""
+
+
+def request_fingerprint(data):
+    raw = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def run_idempotent(user, endpoint, idempotency_key, data, fn):
+    """
+    Return (status_code, data, replayed) for the request identified by
+    `idempotency_key`, calling fn() -> (status_code, data) at most once per
+    key. Server errors (5xx) are not stored, so they can be retried.
+    """
+    key = flight_key("idempotency", user.pk, endpoint, idempotency_key)
+    stored_key = STORED_KEY.format(key)
+    fingerprint = request_fingerprint(data)
+
+    executed = []
+
+    def run():
+        # A flight for this key may have finished (and stored its response)
+        # between our cache read below and taking the lock
+        entry = cache.get(stored_key)
+        if entry is not None:
+            return entry
+        executed.append(True)
+        status_code, body = fn()
+        entry = {"fingerprint": fingerprint, "status": status_code, "data": body}
+        if status_code < 500:
+            cache.set(stored_key, entry, settings.IDEMPOTENCY_KEY_TTL)
+        return entry
+
+    entry = cache.get(stored_key)
+    if entry is None:
+        entry = run_once(key, run, label=endpoint)
+
+    if entry["fingerprint"] != fingerprint:
+        raise IdempotencyKeyReused()
+    return entry["status"], entry["data"], not executed
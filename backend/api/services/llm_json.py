@@ -0,0 +1,338 @@
+"""
+Parsing and validation of the JSON payloads returned by the model.
+
+- locate_json(): one linear scan for the first balanced {...} object, aware
+  of strings and escapes (so it works with or without ```json fences and
+  surrounding prose, without backtracking regexes).
+- recover_truncated(): when the response was cut off (max_tokens, dropped
+  stream), keep everything up to the last complete array item / object and
+  close the open brackets, e.g. 9 of 10 flashcards instead of an error.
+- Schemas are compiled once into validator functions; invalid items in an
+  array are dropped instead of failing the whole payload.
+- IncrementalJSONParser: the same scan over a streamed response, emitting
+  top-level fields and array items as soon as each one is complete.
+"""
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+item_logger = logging.getLogger("api.items")
+
+CLOSERS = {"{": "}", "[": "]"}
+
+# How many candidate objects to try when the first balanced one is not JSON
+MAX_CANDIDATES = 3
+
+
+class SchemaError(ValueError):
+    pass
+
+
+# ===== LOCATING =====
+
+def _scan(text, start):
+    """
+    Scan from the "{" at `start`. Returns (end, cut, stack):
+    - end: index just past the matching "}", or None if the text ends first
+    - cut/stack: last position where a nested container closed and the
+      containers still open at that point (for recover_truncated)
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    cut, cut_stack = None, None
+
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in CLOSERS:
+            stack.append(char)
+        elif char == "}" or char == "]":
+            if not stack or CLOSERS[stack[-1]] != char:
+                return None, cut, cut_stack
+            stack.pop()
+            if not stack:
+                return i + 1, cut, cut_stack
+            cut, cut_stack = i + 1, list(stack)
+
+    return None, cut, cut_stack
+
+
+def locate_json(text):
+    """
+    Return (start, end) of the first balanced top-level JSON object in
+    `text`; end is None when the object is never closed (truncated).
+    Returns None when there is no "{" at all.
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    end, _, _ = _scan(text, start)
+    return start, end
+
+
+def recover_truncated(fragment):
+    """
+    Close a JSON object that was cut off, dropping the incomplete tail after
+    the last completed nested value. Returns None if nothing is salvageable.
+    """
+    _, cut, stack = _scan(fragment, 0)
+    if cut is None:
+        return None
+    return fragment[:cut] + "".join(CLOSERS[opener] for opener in reversed(stack))
+
+
+def loads_model_json(text):
+    """
+    Parse the JSON object in a model response. Raises ValueError (with the
+    json error) when no object can be parsed or recovered.
+    """
+    position = 0
+    error = None
+    for _ in range(MAX_CANDIDATES):
+        start = text.find("{", position)
+        if start == -1:
+            break
+        end, _, _ = _scan(text, start)
+
+        if end is None:
+            recovered = recover_truncated(text[start:])
+            if recovered is not None:
+                try:
+                    parsed = json.loads(recovered)
+                except json.JSONDecodeError as e:
+                    error = e
+                else:
+                    logger.info("Recovered truncated model JSON (%d of %d chars kept)",
+                                len(recovered), len(text) - start)
+                    return parsed
+            break
+
+        try:
+            return json.loads(text[start:end])
+        except json.JSONDecodeError as e:
+            # Prose with braces before the payload; try the next object
+            error = e
+            position = start + 1
+
+    raise ValueError(f"No valid JSON object in model response: {error or 'no object found'}")
+
+
+# ===== SCHEMAS =====
+
+def string(required=True):
+    """Non-empty string, stripped. Optional strings default to ""."""
+    def check(value, path):
+        if isinstance(value, str) and value.strip():
+            return value.strip()
+        if required:
+            raise SchemaError(f"'{path}' must be a non-empty string")
+        return ""
+    return check
+
+
+def array(item, min_items=1, drop_invalid=True):
+    """List whose items pass `item`; invalid items are dropped (and logged) by default."""
+    def check(value, path):
+        if not isinstance(value, list):
+            raise SchemaError(f"'{path}' must be an array")
+        cleaned = []
+        for idx, entry in enumerate(value):
+            try:
+                cleaned.append(item(entry, f"{path}[{idx}]"))
+            except SchemaError as e:
+                if not drop_invalid:
+                    raise
+                logger.info("Dropping invalid item from model output: %s", e)
+        if len(cleaned) < min_items:
+            raise SchemaError(f"'{path}' needs at least {min_items} valid item(s), got {len(cleaned)}")
+        return cleaned
+    return check
+
+
+def obj(fields, clean=None):
+    """Object with the given fields (extra keys are ignored); `clean` post-processes it."""
+    def check(value, path):
+        if not isinstance(value, dict):
+            raise SchemaError(f"'{path}' must be an object")
+        cleaned = {name: field(value.get(name), f"{path}.{name}" if path else name) for name, field in fields.items()}
+        return clean(cleaned, path) if clean else cleaned
+    return check
+
+
+def _resolve_correct_answer(question, path):
+    choices = question["choices"]
+    answer = question["correct_answer"]
+
+    # Letter answers ("B") point at a choice
+    if len(answer) == 1 and answer in "ABCDEF" and ord(answer) - ord("A") < len(choices):
+        answer = choices[ord(answer) - ord("A")]
+        item_logger.debug("%s: converted letter answer to choice text", path)
+
+    if answer not in choices:
+        matches = [choice for choice in choices if choice.lower() == answer.lower()]
+        if not matches:
+            raise SchemaError(f"'{path}.correct_answer' {answer!r} is not one of the choices")
+        answer = matches[0]
+
+    question["correct_answer"] = answer
+    return question
+
+
+FLASHCARD_SCHEMA = obj({
+    "question": string(),
+    "answer": string(),
+})
+
+FLASHCARDS_SCHEMA = obj({
+    "title": string(),
+    "description": string(required=False),
+    "flashcards": array(FLASHCARD_SCHEMA),
+})
+
+NOTE_SCHEMA = obj({
+    "title": string(),
+    "description": string(required=False),
+    "content": string(),
+})
+
+QUIZ_QUESTION_SCHEMA = obj({
+    "question_text": string(),
+    "choices": array(string(), min_items=2, drop_invalid=False),
+    "correct_answer": string(),
+}, clean=_resolve_correct_answer)
+
+QUIZ_SCHEMA = obj({
+    "title": string(),
+    "description": string(required=False),
+    "questions": array(QUIZ_QUESTION_SCHEMA),
+})
+
+KEY_FACTS_SCHEMA = obj({
+    "facts": array(string(), min_items=0),
+})
+
+
+def parse_model_output(text, schema):
+    """Locate, parse (recovering truncation) and validate a model response against `schema`."""
+    return schema(loads_model_json(text), "")
+
+
+# ===== STREAMING =====
+
+class IncrementalJSONParser:
+    """
+    Parse a JSON object as it streams in, character by character, without
+    re-scanning what was already seen.
+
+    feed() returns the events completed by the new chunk:
+    - ("field", (key, value)) for each top-level field other than `array_key`
+    - ("item", value) for each object in the top-level `array_key` array
+    Anything before the first "{" (prose, a ```json fence) is skipped.
+    """
+
+    def __init__(self, array_key):
+        self.array_key = array_key
+        self.fields = {}
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._key = None
+        self._key_chars = None   # top-level key being read
+        self._value = None       # top-level value being read
+        self._item = None        # array item being read
+        self._in_array = False
+
+    def _append(self, char):
+        if self._key_chars is not None:
+            self._key_chars.append(char)
+        elif self._item is not None:
+            self._item.append(char)
+        elif self._value is not None:
+            self._value.append(char)
+
+    def _finish_value(self, events):
+        if self._value is not None and self._key is not None:
+            try:
+                value = json.loads("".join(self._value))
+            except json.JSONDecodeError:
+                logger.debug("Skipping unparsable streamed field %r", self._key)
+            else:
+                self.fields[self._key] = value
+                events.append(("field", (self._key, value)))
+        self._value = None
+        self._key = None
+
+    def feed(self, chunk):
+        events = []
+        for char in chunk:
+            if self.done:
+                break
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                self._append(char)
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._key = json.loads("".join(self._key_chars))
+                        self._key_chars = None
+                continue
+
+            if char.isspace():
+                continue
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._value is None and not self._in_array:
+                    self._key_chars = [char]
+                else:
+                    self._append(char)
+            elif char == ":" and self._depth == 1:
+                self._value = []
+            elif char == "," and self._depth == 1:
+                self._finish_value(events)
+            elif char in CLOSERS:
+                if self._depth == 1 and self._value == [] and char == "[" and self._key == self.array_key:
+                    self._in_array = True
+                    self._value = None
+                elif self._in_array and self._depth == 2 and char == "{":
+                    self._item = [char]
+                else:
+                    self._append(char)
+                self._depth += 1
+            elif char == "}" or char == "]":
+                self._depth -= 1
+                if self._in_array and self._depth == 2 and self._item is not None:
+                    self._item.append(char)
+                    try:
+                        events.append(("item", json.loads("".join(self._item))))
+                    except json.JSONDecodeError:
+                        logger.debug("Skipping unparsable streamed %s item", self.array_key)
+                    self._item = None
+                elif self._in_array and self._depth == 1:
+                    self._in_array = False
+                    self._key = None
+                elif self._depth == 0:
+                    self._finish_value(events)
+                    self.done = True
+                else:
+                    self._append(char)
+            else:
+                self._append(char)
+        return events
@@ -0,0 +1,138 @@
+"""
+Helpers for map-reduce generation over materials larger than one prompt.
+
+The material is split into chunks, a map function runs on every chunk with
+bounded parallelism, and the per-chunk results are merged and deduplicated
+before the final (reduce) generation call.
+"""
+import contextvars
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+from RataTutor.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUE = "map_reduce"
+
+_WORD_RE = re.compile(r"\w+")
+
+# Facts whose word sets overlap at least this much are treated as duplicates
+DUPLICATE_SIMILARITY = 0.8
+
+
+def chunk_text(text, size):
+    """
+    Split `text` into chunks of at most `size` characters, breaking at
+    paragraph boundaries where possible (long paragraphs are split at lines,
+    then hard-cut).
+    """
+    chunks = []
+    current = []
+    current_len = 0
+
+    def pieces():
+        for paragraph in text.split("\n\n"):
+            if len(paragraph) <= size:
+                yield paragraph
+                continue
+            for line in paragraph.split("\n"):
+                for start in range(0, len(line), size):
+                    yield line[start:start + size]
+
+    for piece in pieces():
+        if not piece.strip():
+            continue
+        if current and current_len + len(piece) + 2 > size:
+            chunks.append("\n\n".join(current))
+            current, current_len = [], 0
+        current.append(piece)
+        current_len += len(piece) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def _submit(pool, fn, *args):
+    # Each task gets its own copy of the caller's context, so request
+    # instrumentation and profiling spans still see the LLM calls it makes
+    metrics.QUEUE_DEPTH.inc(queue=QUEUE)
+
+    def run():
+        try:
+            return fn(*args)
+        finally:
+            # Pool threads open their own DB connections (e.g. the duplicate
+            # check's index build); don't leave them behind
+            connections.close_all()
+            metrics.QUEUE_DEPTH.dec(queue=QUEUE)
+
+    return pool.submit(contextvars.copy_context().run, run)
+
+
+def map_bounded(fn, items, max_workers):
+    """
+    Return [fn(item) for item in items], running at most `max_workers` calls
+    at once. Items whose call raised map to None (the error is logged).
+    """
+    def safe(index, item):
+        try:
+            return fn(item)
+        except Exception as e:
+            logger.warning("Map step %d/%d failed: %s", index + 1, len(items), e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="map-reduce") as pool:
+        futures = [_submit(pool, safe, index, item) for index, item in enumerate(items)]
+        return [future.result() for future in futures]
+
+
+def run_concurrently(jobs, max_workers):
+    """
+    Run the callables in `jobs` ({name: fn}) in parallel and return
+    {name: (result, error)}, with error None on success.
+    """
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="map-reduce") as pool:
+        futures = {name: _submit(pool, fn) for name, fn in jobs.items()}
+        for name, future in futures.items():
+            try:
+                outcomes[name] = (future.result(), None)
+            except Exception as e:
+                outcomes[name] = (None, e)
+    return outcomes
+
+
+def _words(fact):
+    return frozenset(word.lower() for word in _WORD_RE.findall(fact))
+
+
+def dedupe_facts(facts):
+    """
+    Drop exact and near-duplicate facts (same words up to order/punctuation,
+    or heavily overlapping word sets), keeping the first occurrence.
+    """
+    kept = []
+    kept_words = []
+    seen = set()
+    for fact in facts:
+        words = _words(fact)
+        if not words or words in seen:
+            continue
+        duplicate = False
+        for other in kept_words:
+            # Cheap size bound before computing the overlap
+            if min(len(words), len(other)) < DUPLICATE_SIMILARITY * max(len(words), len(other)):
+                continue
+            if len(words & other) / len(words | other) >= DUPLICATE_SIMILARITY:
+                duplicate = True
+                break
+        if duplicate:
+            continue
+        seen.add(words)
+        kept.append(fact)
+        kept_words.append(words)
+    return kept
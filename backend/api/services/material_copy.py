@@ -0,0 +1,274 @@
+import uuid
+
+from django.db import transaction
+
+from api.models import (
+    AIConversation,
+    Material,
+    Attachment,
+    Note,
+    FlashcardSet,
+    Flashcard,
+    Quiz,
+    QuizQuestion,
+)
+from api.services.search import copy_attachment_pages, index_material_content
+
+
+@transaction.atomic
+def copy_material_tree(source, owner, title):
+    """
+    Deep-copy a Material and everything under it for a new owner.
+
+    Runs in a single transaction with one bulk INSERT per level. Attachments
+    are not re-uploaded: the new rows point at the same stored blobs, which
+    are reference counted by `delete_attachment_file`.
+    Copied items are always private and unpinned.
+    """
+    new_material = _create_copy(source, owner, title)
+    _copy_attachments(source, new_material)
+    _copy_content(source.content_material, new_material)
+    index_material_content(new_material)
+    return new_material
+
+
+@transaction.atomic
+def fork_material(source, owner, title):
+    """
+    Create a copy-on-write fork of a Material.
+
+    Only the Material row and its attachment rows (which share blobs) are
+    written. Notes, flashcard sets and quizzes keep living on the source and
+    are copied by `materialize_fork` the first time the fork is written to.
+    If the source's content changes first, the fork is moved onto a frozen
+    snapshot of it (see `freeze_forks_of`).
+    """
+    new_material = _create_copy(source, owner, title, shared_from=source.content_material)
+    _copy_attachments(source, new_material)
+    return new_material
+
+
+@transaction.atomic
+def materialize_fork(material):
+    """
+    Give a fork its own copies of the source content and detach it.
+
+    Returns a mapping of {model class: {source pk: new instance}} so callers
+    can redirect a write aimed at a shared row to the fork's own copy.
+    Does nothing (and returns an empty mapping) for regular materials.
+    """
+    locked = Material.objects.select_for_update().filter(pk=material.pk).first()
+    if locked is None or locked.shared_from_id is None:
+        material.shared_from = None
+        return {}
+
+    shared_from_id = locked.shared_from_id
+    mapping = _copy_content(locked.shared_from, locked)
+    locked.shared_from = None
+    locked.save(update_fields=['shared_from'])
+    index_material_content(locked)
+    material.shared_from = None
+    drop_unused_snapshot(shared_from_id)
+    return mapping
+
+
+def materialize_forks_of(source):
+    """Materialize every pending fork of `source` (e.g. before its owner is deleted)."""
+    for fork in source.forks.all():
+        materialize_fork(fork)
+
+
+@transaction.atomic
+def freeze_forks_of(material_id):
+    """
+    Move the pending forks of a material onto a frozen snapshot of its
+    current content, before the source owner changes or deletes it.
+
+    The content is copied once however many forks there are; each fork
+    still copies the snapshot lazily, on its own first write. Returns the
+    snapshot, or None if the material has no pending forks.
+    """
+    fork_ids = list(Material.objects.select_for_update().filter(shared_from_id=material_id).values_list('pk', flat=True))
+    if not fork_ids:
+        return None
+
+    source = Material.objects.get(pk=material_id)
+    snapshot = Material.objects.create(
+        owner_id=source.owner_id,
+        # Titles are unique per owner; snapshots are never listed
+        title=f"{source.title[:200]} (snapshot {uuid.uuid4().hex[:12]})",
+        description=source.description,
+        status='snapshot',
+        answer_cache_enabled=source.answer_cache_enabled,
+    )
+    _copy_content(source, snapshot)
+    Material.objects.filter(pk__in=fork_ids).update(shared_from=snapshot)
+    return snapshot
+
+
+def freeze_forks_sharing(obj):
+    """
+    Freeze the pending forks that show `obj` (a note, set, card, quiz or
+    question of their source, or a new one being added to it), so a change
+    by the source owner doesn't show up in the forks.
+
+    Cards and questions are checked once per parent instance: saving the
+    cards of a set (which share the set instance) looks the forks up once,
+    not once per card.
+    """
+    if isinstance(obj, Flashcard):
+        parent = obj.flashcard_set
+    elif isinstance(obj, QuizQuestion):
+        parent = obj.quiz
+    else:
+        freeze_forks_of(obj.material_id)
+        return
+    if getattr(parent, '_forks_frozen', False):
+        return
+    freeze_forks_of(parent.material_id)
+    parent._forks_frozen = True
+
+
+def drop_unused_snapshot(material_id):
+    """Delete a snapshot once no fork shows it any more."""
+    Material.objects.filter(pk=material_id, status='snapshot', forks__isnull=True).delete()
+
+
+def get_material_of(obj):
+    """Return the Material that a note, set, card, quiz or question belongs to."""
+    if isinstance(obj, Flashcard):
+        return obj.flashcard_set.material
+    if isinstance(obj, QuizQuestion):
+        return obj.quiz.material
+    return obj.material
+
+
+def resolve_fork_write_target(user, obj):
+    """
+    Return the row a write by `user` on `obj` should actually touch.
+
+    Rows of the user's own materials are returned unchanged. Rows that the
+    user only sees through a pending fork trigger materialization of that
+    fork (the most recently created one if there are several) and the
+    fork's copy of the row is returned. Anything else returns None.
+    """
+    material = get_material_of(obj)
+    if material.owner_id == user.id:
+        return obj
+
+    fork = (
+        Material.objects.filter(owner=user, shared_from=material)
+        .order_by('-created_at')
+        .first()
+    )
+    if fork is None:
+        return None
+
+    mapping = materialize_fork(fork)
+    return mapping.get(type(obj), {}).get(obj.pk)
+
+
+# ===== INTERNAL HELPERS =====
+
+def _create_copy(source, owner, title, shared_from=None):
+    return Material.objects.create(
+        owner=owner,
+        title=title,
+        description=source.description,
+        status=source.status,
+        pinned=False,
+        public=False,
+        answer_cache_enabled=source.answer_cache_enabled,
+        shared_from=shared_from
+    )
+
+
+def _copy_attachments(source, target):
+    # Attachments share the source blobs (no bytes are copied), and their
+    # indexed page text is copied instead of extracting the files again. The
+    # source rows are locked so their blobs can't be deleted mid-copy.
+    source_attachments = list(source.attachments.select_for_update())
+    new_attachments = Attachment.objects.bulk_create([
+        Attachment(
+            material=target,
+            file=attachment.file.name,
+            content_hash=attachment.content_hash,
+        )
+        for attachment in source_attachments
+    ])
+    copy_attachment_pages(_pair(source_attachments, new_attachments))
+    if new_attachments:
+        # bulk_create sends no post_save, so flag_conversations_with_attachments doesn't run
+        AIConversation.objects.filter(
+            material=target, material_has_attachments=False
+        ).update(material_has_attachments=True)
+
+
+def _copy_content(source, target):
+    """Bulk-copy notes, flashcard sets (with cards) and quizzes (with questions)."""
+    mapping = {}
+
+    # 1) Notes
+    source_notes = list(source.notes.all())
+    new_notes = Note.objects.bulk_create([
+        Note(
+            material=target,
+            title=note.title,
+            description=note.description,
+            content=note.content,
+            public=False
+        )
+        for note in source_notes
+    ])
+    mapping[Note] = _pair(source_notes, new_notes)
+
+    # 2) Flashcard sets, then all of their cards in one insert
+    source_sets = list(source.flashcard_sets.prefetch_related('cards'))
+    new_sets = FlashcardSet.objects.bulk_create([
+        FlashcardSet(
+            material=target,
+            title=flashcard_set.title,
+            description=flashcard_set.description,
+            public=False
+        )
+        for flashcard_set in source_sets
+    ])
+    source_cards = [card for source_set in source_sets for card in source_set.cards.all()]
+    new_cards = Flashcard.objects.bulk_create([
+        Flashcard(flashcard_set=new_set, question=card.question, answer=card.answer)
+        for source_set, new_set in zip(source_sets, new_sets)
+        for card in source_set.cards.all()
+    ])
+    mapping[FlashcardSet] = _pair(source_sets, new_sets)
+    mapping[Flashcard] = _pair(source_cards, new_cards)
+
+    # 3) Quizzes, then all of their questions in one insert
+    source_quizzes = list(source.quizzes.prefetch_related('questions'))
+    new_quizzes = Quiz.objects.bulk_create([
+        Quiz(
+            material=target,
+            title=quiz.title,
+            description=quiz.description,
+            public=False
+        )
+        for quiz in source_quizzes
+    ])
+    source_questions = [q for source_quiz in source_quizzes for q in source_quiz.questions.all()]
+    new_questions = QuizQuestion.objects.bulk_create([
+        QuizQuestion(
+            quiz=new_quiz,
+            question_text=q.question_text,
+            choices=q.choices,
+            correct_answer=q.correct_answer
+        )
+        for source_quiz, new_quiz in zip(source_quizzes, new_quizzes)
+        for q in source_quiz.questions.all()
+    ])
+    mapping[Quiz] = _pair(source_quizzes, new_quizzes)
+    mapping[QuizQuestion] = _pair(source_questions, new_questions)
+
+    return mapping
+
+
+def _pair(originals, copies):
+    return {original.pk: copy for original, copy in zip(originals, copies)}
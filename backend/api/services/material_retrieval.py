@@ -0,0 +1,157 @@
+"""
+Retrieval of the attachment passages relevant to a chat question.
+
+The question is matched against the material's indexed attachment pages
+(SearchEntry rows written by api.services.search) through the same
+full-text index the search endpoints use: SQLite FTS5 or PostgreSQL
+tsvector, ranked by the database. The best pages are split into chunks, and
+only chunks containing at least MATERIAL_CONTEXT_MIN_SCORE of the question's
+terms are sent to the model, so material context is included when the
+question is about it and left out otherwise.
+"""
+import logging
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from api.models import SearchEntry
+from api.services.map_reduce import chunk_text
+
+logger = logging.getLogger(__name__)
+
+# search.ATTACHMENT_KIND etc. (not imported: search imports ai_service, which imports this module)
+ATTACHMENT_KIND = "attachment_page"
+ENTRY_TABLE = SearchEntry._meta.db_table
+FTS_TABLE = f"{ENTRY_TABLE}_fts"
+# Must match the GIN index expression created in migration 0006_search_index
+PG_DOCUMENT = "to_tsvector('english', coalesce(e.title, '') || ' ' || coalesce(e.body, ''))"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+STOP_WORDS = frozenset("""
+a an the and or but if then else of to in on at by for with from into onto about as is are was were be been
+being am do does did done have has had having i me my we our you your he she it its they them their this that
+these those there here what which who whom whose when where why how can could should would will shall may might
+must not no yes so than too very just also any some all each both more most other such only own same s t don
+please tell explain show give help me know need want like get make let lets use using
+""".split())
+
+
+def _stem(token):
+    """Crude suffix stripping, enough for "absorbs"/"absorbed"/"absorbing" to meet "absorb"."""
+    if len(token) <= 4:
+        return token
+    if token.endswith("ies"):
+        return token[:-3] + "y"
+    for suffix in ("ing", "ed", "s"):
+        if token.endswith(suffix) and not token.endswith("ss") and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def query_words(text):
+    """The words of `text` worth matching: lowercased, without stop words."""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if len(token) > 1 and token not in STOP_WORDS]
+
+
+def tokenize(text):
+    return [_stem(token) for token in query_words(text)]
+
+
+def _ranked_pages(material_id, words, limit):
+    """
+    [(attachment id, page, title, body)] of the material's attachment pages
+    matching any of `words`, best first (at most `limit`).
+    """
+    if connection.vendor == "sqlite":
+        sql = f"""
+            SELECT e.object_id, e.page, e.title, e.body
+            FROM {FTS_TABLE}
+            JOIN {ENTRY_TABLE} e ON e.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s AND e.kind = %s AND e.material_id = %s
+            ORDER BY bm25({FTS_TABLE}, 2.0, 1.0)
+            LIMIT %s
+        """
+        params = [" OR ".join(f'"{word}"' for word in words), ATTACHMENT_KIND, material_id, limit]
+    elif connection.vendor == "postgresql":
+        sql = f"""
+            SELECT e.object_id, e.page, e.title, e.body
+            FROM {ENTRY_TABLE} e, to_tsquery('english', %s) q
+            WHERE {PG_DOCUMENT} @@ q AND e.kind = %s AND e.material_id = %s
+            ORDER BY ts_rank({PG_DOCUMENT}, q) DESC
+            LIMIT %s
+        """
+        params = [" | ".join(words), ATTACHMENT_KIND, material_id, limit]
+    else:
+        # No full-text index: unranked LIKE match
+        match = Q()
+        for word in words:
+            match |= Q(body__icontains=word)
+        return list(
+            SearchEntry.objects.filter(match, kind=ATTACHMENT_KIND, material_id=material_id)
+            .order_by("object_id", "page")
+            .values_list("object_id", "page", "title", "body")[:limit]
+        )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _first_pages(material_id, limit):
+    return list(
+        SearchEntry.objects.filter(kind=ATTACHMENT_KIND, material_id=material_id)
+        .order_by("object_id", "page")
+        .values_list("object_id", "page", "title", "body")[:limit]
+    )
+
+
+def relevant_chunks(material, query, explicit=False):
+    """
+    Return ([(label, text)], status) for the chunks worth sending with `query`.
+
+    Chunks must contain at least MATERIAL_CONTEXT_MIN_SCORE of the question's
+    terms, unless `explicit` (the question asks about the material itself),
+    in which case the best matches are used whatever their score. status is
+    "retrieved", "explicit", "skipped" (nothing relevant) or "unindexed"
+    (no indexed pages).
+    """
+    limit = settings.MATERIAL_CONTEXT_CHUNKS
+    threshold = 0.0 if explicit else settings.MATERIAL_CONTEXT_MIN_SCORE
+    words = sorted(set(query_words(query)))
+    terms = {_stem(word) for word in words}
+
+    pages = _ranked_pages(material.pk, words, limit) if words else []
+    if not pages and not SearchEntry.objects.filter(kind=ATTACHMENT_KIND, material_id=material.pk).exists():
+        return [], "unindexed"
+
+    # (score, page rank, document position, label, text) of every chunk of the best pages
+    candidates = [
+        (len(terms & set(tokenize(chunk))) / len(terms), rank, (attachment_id, page, position),
+         f"{title}, page {page}", chunk)
+        for rank, (attachment_id, page, title, body) in enumerate(pages)
+        for position, chunk in enumerate(chunk_text(body, settings.MATERIAL_CONTEXT_CHUNK_CHARS))
+    ]
+    best = sorted(
+        (candidate for candidate in candidates if candidate[0] > 0 and candidate[0] >= threshold),
+        key=lambda candidate: (-candidate[0], candidate[1]),
+    )[:limit]
+
+    if not best and explicit:
+        # Asked about the material but no word matches: fall back to its beginning
+        best = [
+            (0.0, 0, (attachment_id, page, position), f"{title}, page {page}", chunk)
+            for attachment_id, page, title, body in _first_pages(material.pk, limit)
+            for position, chunk in enumerate(chunk_text(body, settings.MATERIAL_CONTEXT_CHUNK_CHARS))
+        ][:limit]
+
+    if candidates:
+        logger.debug("Material %s retrieval: best score %.2f (threshold %.2f), %d chunk(s) kept",
+                     material.pk, max(candidate[0] for candidate in candidates), threshold, len(best))
+    if not best:
+        return [], "skipped"
+    # Document order reads better than score order
+    chunks = [(label, text) for _, _, _, label, text in sorted(best, key=lambda candidate: candidate[2])]
+    return chunks, "explicit" if explicit else "retrieved"
@@ -0,0 +1,259 @@
+"""
+Near-duplicate filtering of generated flashcards and quiz questions.
+
+Each question is reduced to a MinHash signature over character shingles;
+signatures are bucketed with LSH (banding), so checking a candidate only
+compares it with the few existing items sharing a bucket instead of every
+card of the material. The per-material index is built once from the
+database and cached; signals add and remove single signatures when
+cards/questions change, and drop it when a whole set or quiz goes.
+"""
+import logging
+import random
+import re
+import time
+import zlib
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from api.models import Flashcard, FlashcardSet, Quiz, QuizQuestion
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# Universal hashing (a*x + b) mod a Mersenne prime; seeded so signatures are
+# identical in every worker (the index is shared through the cache)
+_PRIME = (1 << 61) - 1
+_rng = random.Random(4242)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+INDEX_KEY = "near-duplicates:{}:{}"
+# Held around read-modify-writes of a cached index
+INDEX_LOCK_TIMEOUT = 10
+INDEX_LOCK_WAIT = 1.0
+
+KINDS = {
+    # kind -> (model, lookup from the item to its material, text field)
+    "flashcard": (Flashcard, "flashcard_set__material", "question"),
+    "quiz_question": (QuizQuestion, "quiz__material", "question_text"),
+}
+
+
+def shingles(text):
+    """Stable 32-bit hashes of the character shingles of the normalised text."""
+    normalised = _NON_WORD_RE.sub(" ", text.lower()).strip()
+    if len(normalised) <= SHINGLE_SIZE:
+        return {zlib.crc32(normalised.encode("utf-8"))} if normalised else set()
+    return {
+        zlib.crc32(normalised[i:i + SHINGLE_SIZE].encode("utf-8"))
+        for i in range(len(normalised) - SHINGLE_SIZE + 1)
+    }
+
+
+def signature(text):
+    hashes = shingles(text)
+    if not hashes:
+        return None
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+class MinHashIndex:
+    """LSH index of item signatures (picklable, so it can live in the cache)."""
+
+    def __init__(self):
+        self.signatures = {}
+        self.buckets = {}
+
+    @staticmethod
+    def _bands(sig):
+        for band in range(BANDS):
+            yield band, sig[band * ROWS:(band + 1) * ROWS]
+
+    def add(self, key, sig):
+        self.signatures[key] = sig
+        for band in self._bands(sig):
+            self.buckets.setdefault(band, []).append(key)
+
+    def remove(self, key):
+        sig = self.signatures.pop(key, None)
+        if sig is None:
+            return
+        for band in self._bands(sig):
+            bucket = self.buckets[band]
+            bucket.remove(key)
+            if not bucket:
+                del self.buckets[band]
+
+    def most_similar(self, sig):
+        """(key, similarity) of the closest indexed item sharing an LSH bucket, or (None, 0)."""
+        candidates = set()
+        for band in self._bands(sig):
+            candidates.update(self.buckets.get(band, ()))
+        best, best_score = None, 0.0
+        for key in candidates:
+            score = similarity(sig, self.signatures[key])
+            if score > best_score:
+                best, best_score = key, score
+        return best, best_score
+
+
+def _index_key(kind, material_id):
+    return INDEX_KEY.format(kind, material_id)
+
+
+def get_index(material, kind):
+    """Index of the existing items of `kind` shown by `material` (built on a cache miss)."""
+    material = material.content_material
+    key = _index_key(kind, material.pk)
+    index = cache.get(key)
+    if index is None:
+        model, material_lookup, field = KINDS[kind]
+        index = MinHashIndex()
+        rows = model.objects.filter(**{material_lookup: material}).values_list("pk", field)
+        for pk, text in rows.iterator():
+            sig = signature(text)
+            if sig is not None:
+                index.add(pk, sig)
+        cache.set(key, index, settings.NEAR_DUPLICATE_INDEX_TTL)
+    return index
+
+
+def invalidate(kind, material_id):
+    cache.delete(_index_key(kind, material_id))
+    # Queued changes may be for items that just went with their set/quiz
+    pending = _pending_updates(create=False)
+    if pending is not None:
+        pending.changes.pop((kind, material_id), None)
+
+
+def invalidate_for(instance):
+    """Drop the index a deleted set or quiz belongs to."""
+    if isinstance(instance, FlashcardSet):
+        invalidate("flashcard", instance.material_id)
+    elif isinstance(instance, Quiz):
+        invalidate("quiz_question", instance.material_id)
+
+
+def _item_key(instance):
+    if isinstance(instance, Flashcard):
+        return "flashcard", instance.flashcard_set.material_id
+    return "quiz_question", instance.quiz.material_id
+
+
+def update_for(instance):
+    """Refresh the signature of a saved card/question in its cached index, once the transaction commits."""
+    kind, material_id = _item_key(instance)
+    _pending_updates().changes[kind, material_id][instance.pk] = getattr(instance, KINDS[kind][2])
+
+
+def remove_for(instance):
+    """Remove a deleted card/question from its cached index, once the transaction commits."""
+    kind, material_id = _item_key(instance)
+    _pending_updates().changes[kind, material_id][instance.pk] = None
+
+
+class _PendingUpdates:
+    """Card/question changes applied to the cached indexes when the transaction commits."""
+
+    def __init__(self):
+        # (kind, material id) -> {item pk: its text, or None once deleted}
+        self.changes = defaultdict(dict)
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        for (kind, material_id), changes in self.changes.items():
+            _apply(kind, material_id, changes)
+
+
+def _pending_updates(create=True):
+    # Reuse the batch already registered on this transaction, if any (a
+    # batch registered in a rolled back savepoint is gone from the list)
+    for _, callback, _ in connection.run_on_commit:
+        if isinstance(callback, _PendingUpdates) and not callback.done:
+            return callback
+    if not create:
+        return None
+    pending = _PendingUpdates()
+    transaction.on_commit(pending)
+    return pending
+
+
+def _apply(kind, material_id, changes):
+    key = _index_key(kind, material_id)
+    lock_key = f"{key}:lock"
+    deadline = time.monotonic() + INDEX_LOCK_WAIT
+    while not cache.add(lock_key, 1, INDEX_LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            # Can't update it safely: it is rebuilt from the database on next use
+            invalidate(kind, material_id)
+            return
+        time.sleep(0.01)
+    try:
+        index = cache.get(key)
+        if index is None:
+            return  # Not built yet; it will be from the database
+        for pk, text in changes.items():
+            index.remove(pk)
+            sig = signature(text) if text is not None else None
+            if sig is not None:
+                index.add(pk, sig)
+        cache.set(key, index, settings.NEAR_DUPLICATE_INDEX_TTL)
+    finally:
+        cache.delete(lock_key)
+
+
+class NearDuplicateFilter:
+    """
+    Checks generated items against the material's existing items and the
+    items already accepted from the same batch.
+    """
+
+    def __init__(self, material, kind):
+        self.enabled = settings.NEAR_DUPLICATE_FILTER
+        self.kind = kind
+        self.field = KINDS[kind][2]
+        self.threshold = settings.NEAR_DUPLICATE_THRESHOLD
+        self.index = get_index(material, kind) if self.enabled else None
+        self._batch_keys = 0
+        self.dropped = 0
+
+    def is_duplicate(self, item):
+        """True if `item` is a near-duplicate; otherwise it is remembered for the rest of the batch."""
+        if not self.enabled:
+            return False
+        sig = signature(item[self.field])
+        if sig is None:
+            return False
+
+        match, score = self.index.most_similar(sig)
+        if score >= self.threshold:
+            self.dropped += 1
+            logger.debug("Dropping generated %s similar (%.2f) to %s", self.kind, score, match)
+            return True
+
+        # Negative keys: accepted in this batch, not saved yet (the local
+        # copy of the index is not written back; saving updates the cached one)
+        self._batch_keys -= 1
+        self.index.add(self._batch_keys, sig)
+        return False
+
+    def filter(self, items):
+        kept = [item for item in items if not self.is_duplicate(item)]
+        if self.dropped:
+            logger.info("Dropped %d near-duplicate generated %s item(s)", self.dropped, self.kind)
+        return kept
@@ -0,0 +1,84 @@
+from api.models import Flashcard, FlashcardSet, Quiz, QuizQuestion
+from api.serializers import FlashcardSetSerializer, QuizSerializer
+from api.services.ai_service import validate_and_improve_title
+from api.services.material_copy import materialize_fork
+
+
+class ProgressiveWriter:
+    """
+    Saves streamed generation output as it arrives: the parent row (set or
+    quiz) is created with the first valid item, and every item is saved on
+    its own, so whatever was generated survives a failed or aborted stream.
+    """
+    model = None
+    # Owns the title dedupe for `model` (_generate_unique_title)
+    serializer_class = None
+    item_model = None
+    parent_field = None
+    content_type = None
+
+    def __init__(self, material):
+        self.material = material
+        self.fields = {}
+        self.parent = None
+        self.count = 0
+        self._titled = False
+
+    def field(self, key, value):
+        self.fields[key] = value
+
+    def add(self, item):
+        if self.parent is None:
+            self._create_parent()
+        row = self.item_model.objects.create(**{self.parent_field: self.parent}, **item)
+        self.count += 1
+        return row
+
+    def _title(self):
+        title = self.fields.get("title")
+        return validate_and_improve_title(title if isinstance(title, str) else "", self.content_type, self.material.title)
+
+    def _description(self):
+        description = self.fields.get("description")
+        return description.strip() if isinstance(description, str) else ""
+
+    def _unique_title(self, exclude=None):
+        return self.serializer_class()._generate_unique_title(self._title(), self.material, exclude_instance=exclude)
+
+    def _create_parent(self):
+        # Copy-on-write fork: give it its own content before adding to it
+        if self.material.shared_from_id:
+            materialize_fork(self.material)
+        self._titled = "title" in self.fields
+        self.parent = self.model.objects.create(
+            material=self.material,
+            title=self._unique_title(),
+            description=self._description(),
+            public=False,
+        )
+
+    def finish(self):
+        """Apply fields that arrived after the first item; returns the parent row."""
+        if self.parent is None:
+            raise ValueError(f"AI did not return any valid {self.content_type}.")
+        if not self._titled and "title" in self.fields:
+            self.parent.title = self._unique_title(exclude=self.parent)
+        self.parent.description = self.parent.description or self._description()
+        self.parent.save()
+        return self.parent
+
+
+class FlashcardSetWriter(ProgressiveWriter):
+    model = FlashcardSet
+    serializer_class = FlashcardSetSerializer
+    item_model = Flashcard
+    parent_field = "flashcard_set"
+    content_type = "flashcards"
+
+
+class QuizWriter(ProgressiveWriter):
+    model = Quiz
+    serializer_class = QuizSerializer
+    item_model = QuizQuestion
+    parent_field = "quiz"
+    content_type = "quiz"
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = "public-feed:version"
+
+
+def get_feed_version():
+    """Current generation of the public feed cache."""
+    return cache.get_or_set(VERSION_KEY, 1, timeout=None)
+
+
+def bump_feed_version():
+    """Invalidate every cached feed page at once by moving to a new generation."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, timeout=None)
+
+
+def feed_page_cache_key(scope, cursor, page_size):
+    return f"public-feed:v{get_feed_version()}:{scope or 'all'}:{cursor or 'first'}:{page_size}"
+
+
+def get_cached_feed_page(scope, cursor, page_size):
+    return cache.get(feed_page_cache_key(scope, cursor, page_size))
+
+
+def set_cached_feed_page(scope, cursor, page_size, page):
+    cache.set(feed_page_cache_key(scope, cursor, page_size), page, settings.PUBLIC_FEED_CACHE_TIMEOUT)
@@ -0,0 +1,341 @@
+import html
+import logging
+import os
+import re
+import shutil
+import tempfile
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import Q, Value
+
+from api.models import (
+    Material,
+    Attachment,
+    Note,
+    Flashcard,
+    QuizQuestion,
+    SearchEntry,
+)
+from api.services.ai_service import SUPPORTED_EXTENSIONS, iter_file_pages
+from RataTutor.utils.instrumentation import timed
+
+logger = logging.getLogger(__name__)
+
+ENTRY_TABLE = SearchEntry._meta.db_table
+MATERIAL_TABLE = Material._meta.db_table
+FTS_TABLE = f"{ENTRY_TABLE}_fts"
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+# The database marks matches with these control characters; the snippet is
+# HTML-escaped before they are turned into the <mark> tags above
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+# Must match the GIN index expression created in migration 0006_search_index,
+# otherwise PostgreSQL will not use the index.
+PG_DOCUMENT = "to_tsvector('english', coalesce(e.title, '') || ' ' || coalesce(e.body, ''))"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+KIND_BY_MODEL = {
+    Material: "material",
+    Note: "note",
+    Flashcard: "flashcard",
+    QuizQuestion: "quiz_question",
+}
+ATTACHMENT_KIND = "attachment_page"
+
+# kind -> (model, material id, title, body) lookups of its search document
+DOCUMENT_FIELDS = {
+    "material": (Material, "id", "title", "description"),
+    "note": (Note, "material_id", "title", "content"),
+    "flashcard": (Flashcard, "flashcard_set__material_id", "question", "answer"),
+    "quiz_question": (QuizQuestion, "quiz__material_id", "question_text", None),
+}
+
+
+# ===== INDEXING =====
+
+class _PendingEntries:
+    """Rows whose search entries are rebuilt in bulk when the transaction commits."""
+
+    def __init__(self):
+        self.object_ids = defaultdict(set)
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        reindex(self.object_ids)
+
+
+def _pending_entries():
+    # Reuse the batch already registered on this transaction, if any (a
+    # batch registered in a rolled back savepoint is gone from the list)
+    for _, callback, _ in connection.run_on_commit:
+        if isinstance(callback, _PendingEntries) and not callback.done:
+            return callback
+    pending = _PendingEntries()
+    transaction.on_commit(pending)
+    return pending
+
+
+def index_instance(instance):
+    """Create or refresh the search entry for one row, once the transaction commits."""
+    _pending_entries().object_ids[KIND_BY_MODEL[type(instance)]].add(instance.pk)
+
+
+def unindex_instance(instance):
+    """Remove the search entry for one row, once the transaction commits."""
+    _pending_entries().object_ids[KIND_BY_MODEL[type(instance)]].add(instance.pk)
+
+
+def reindex(object_ids):
+    """
+    Rebuild the search entries of {kind: object ids} from the database in
+    one delete and one insert; ids of deleted rows just lose their entry.
+    """
+    entries = []
+    stale = Q(pk__in=[])
+    for kind, ids in object_ids.items():
+        if not ids:
+            continue
+        model, material_field, title_field, body_field = DOCUMENT_FIELDS[kind]
+        rows = model.objects.filter(pk__in=ids).values_list(
+            "pk", material_field, title_field, body_field or Value("")
+        )
+        entries += [
+            SearchEntry(kind=kind, object_id=pk, material_id=material_id, title=title, body=body or "")
+            for pk, material_id, title, body in rows
+        ]
+        stale |= Q(kind=kind, object_id__in=ids)
+
+    with transaction.atomic():
+        SearchEntry.objects.filter(stale).delete()
+        SearchEntry.objects.bulk_create(entries)
+
+
+def index_material_content(material):
+    """
+    Rebuild every search entry of a material in bulk.
+    Used after bulk inserts (copies, fork materialization) that skip signals.
+    """
+    entries = [SearchEntry(kind="material", object_id=material.pk, material=material,
+                           title=material.title, body=material.description)]
+    entries += [
+        SearchEntry(kind="note", object_id=note.pk, material=material, title=note.title, body=note.content)
+        for note in material.notes.all()
+    ]
+    entries += [
+        SearchEntry(kind="flashcard", object_id=card.pk, material=material, title=card.question, body=card.answer)
+        for card in Flashcard.objects.filter(flashcard_set__material=material)
+    ]
+    entries += [
+        SearchEntry(kind="quiz_question", object_id=q.pk, material=material, title=q.question_text, body="")
+        for q in QuizQuestion.objects.filter(quiz__material=material)
+    ]
+
+    SearchEntry.objects.filter(material=material, kind__in=KIND_BY_MODEL.values()).delete()
+    SearchEntry.objects.bulk_create(entries)
+
+
+def index_attachment(attachment):
+    """
+    Index the extracted text of an attachment, one entry per page/slide/section.
+    Text already extracted for another attachment with the same content hash
+    is reused instead of parsing the file again. Never raises: an unreadable
+    file only leaves the attachment unsearchable.
+    """
+    SearchEntry.objects.filter(kind=ATTACHMENT_KIND, object_id=attachment.pk).delete()
+    if not attachment.file:
+        return
+
+    if attachment.content_hash:
+        twin_ids = (
+            Attachment.objects.filter(content_hash=attachment.content_hash)
+            .exclude(pk=attachment.pk)
+            .values("pk")
+        )
+        existing = SearchEntry.objects.filter(kind=ATTACHMENT_KIND, object_id__in=twin_ids)
+        source_id = existing.values_list("object_id", flat=True).first()
+        if source_id is not None:
+            copy_attachment_pages({source_id: attachment})
+            return
+
+    ext = os.path.splitext(attachment.file.name)[1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        return
+
+    title = os.path.basename(attachment.file.name)
+    try:
+        with timed("extraction"), _local_path(attachment.file) as path:
+            entries = [
+                SearchEntry(kind=ATTACHMENT_KIND, object_id=attachment.pk, page=page,
+                            material_id=attachment.material_id, title=title, body=text)
+                for page, text in iter_file_pages(path)
+                if text.strip()
+            ]
+    except Exception as e:
+        logger.error("Could not index attachment %s (%s): %s", attachment.pk, attachment.file.name, e)
+        return
+
+    SearchEntry.objects.bulk_create(entries)
+    logger.info("Indexed %d page(s) of attachment %s", len(entries), attachment.pk)
+
+
+def copy_attachment_pages(targets):
+    """
+    Copy indexed pages to attachments sharing the same blob.
+    `targets` maps a source attachment pk to the new Attachment instance.
+    """
+    if not targets:
+        return
+    SearchEntry.objects.bulk_create([
+        SearchEntry(kind=ATTACHMENT_KIND, object_id=targets[entry.object_id].pk, page=entry.page,
+                    material_id=targets[entry.object_id].material_id, title=entry.title, body=entry.body)
+        for entry in SearchEntry.objects.filter(kind=ATTACHMENT_KIND, object_id__in=list(targets))
+    ])
+
+
+def unindex_attachment(attachment):
+    SearchEntry.objects.filter(kind=ATTACHMENT_KIND, object_id=attachment.pk).delete()
+
+
+@contextmanager
+def _local_path(field_file):
+    """Yield a filesystem path for a stored file, downloading it first for remote storage."""
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        path = None
+    if path:
+        yield path
+        return
+
+    suffix = os.path.splitext(field_file.name)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+        with field_file.open("rb") as source:
+            shutil.copyfileobj(source, tmp)
+        tmp.flush()
+        yield tmp.name
+
+
+# ===== QUERYING =====
+
+def build_match_query(text):
+    """
+    Turn free user input into a safe FTS5 MATCH expression:
+    every word must appear, the last one may be a prefix.
+    """
+    tokens = _TOKEN_RE.findall(text)
+    if not tokens:
+        return ""
+    quoted = [f'"{token}"' for token in tokens]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search(user, text, limit=20, offset=0, kinds=None):
+    """
+    Ranked full-text search over the user's own and public active materials.
+    Returns a list of dicts, best match first. "snippet" is safe HTML (the
+    text is escaped, matches are wrapped in <mark>); "title" is plain text.
+    """
+    if not _TOKEN_RE.search(text or ""):
+        return []
+
+    if connection.vendor == "sqlite":
+        return _search_sqlite(user, text, limit, offset, kinds)
+    if connection.vendor == "postgresql":
+        return _search_postgres(user, text, limit, offset, kinds)
+    return _search_fallback(user, text, limit, offset, kinds)
+
+
+def _kind_clause(kinds, params):
+    if not kinds:
+        return ""
+    params.extend(kinds)
+    return f" AND e.kind IN ({', '.join(['%s'] * len(kinds))})"
+
+
+def _search_sqlite(user, text, limit, offset, kinds):
+    params = [MATCH_START, MATCH_END, build_match_query(text), user.pk, True]
+    kind_sql = _kind_clause(kinds, params)
+    params += [limit, offset]
+    sql = f"""
+        SELECT e.kind, e.object_id, e.page, e.material_id, m.title, e.title,
+               snippet({FTS_TABLE}, -1, %s, %s, '…', 16),
+               -bm25({FTS_TABLE}, 2.0, 1.0) AS score
+        FROM {FTS_TABLE}
+        JOIN {ENTRY_TABLE} e ON e.id = {FTS_TABLE}.rowid
+        JOIN {MATERIAL_TABLE} m ON m.id = e.material_id
+        WHERE {FTS_TABLE} MATCH %s
+          AND m.status = 'active'
+          AND (m.owner_id = %s OR m.public = %s){kind_sql}
+        ORDER BY score DESC
+        LIMIT %s OFFSET %s
+    """
+    return _fetch(sql, params)
+
+
+def _search_postgres(user, text, limit, offset, kinds):
+    options = f"StartSel={MATCH_START}, StopSel={MATCH_END}, MaxWords=30, MinWords=10"
+    params = [options, text, user.pk, True]
+    kind_sql = _kind_clause(kinds, params)
+    params += [limit, offset]
+    sql = f"""
+        SELECT e.kind, e.object_id, e.page, e.material_id, m.title, e.title,
+               ts_headline('english', coalesce(nullif(e.body, ''), e.title), q, %s),
+               ts_rank({PG_DOCUMENT}, q) AS score
+        FROM {ENTRY_TABLE} e
+        JOIN {MATERIAL_TABLE} m ON m.id = e.material_id,
+             plainto_tsquery('english', %s) q
+        WHERE {PG_DOCUMENT} @@ q
+          AND m.status = 'active'
+          AND (m.owner_id = %s OR m.public = %s){kind_sql}
+        ORDER BY score DESC
+        LIMIT %s OFFSET %s
+    """
+    return _fetch(sql, params)
+
+
+def _search_fallback(user, text, limit, offset, kinds):
+    """Unranked LIKE search for backends without a full-text index."""
+    qs = SearchEntry.objects.filter(material__status="active").filter(
+        Q(material__owner=user) | Q(material__public=True)
+    ).select_related("material")
+    for token in _TOKEN_RE.findall(text):
+        qs = qs.filter(Q(title__icontains=token) | Q(body__icontains=token))
+    if kinds:
+        qs = qs.filter(kind__in=kinds)
+
+    return [
+        _result(e.kind, e.object_id, e.page, e.material_id, e.material.title, e.title, e.body[:200], 0.0)
+        for e in qs.order_by("-id")[offset:offset + limit]
+    ]
+
+
+def _fetch(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [_result(*row) for row in cursor.fetchall()]
+
+
+def highlight(snippet):
+    """HTML-escape a snippet and turn the database's match markers into <mark> tags."""
+    return html.escape(snippet or "").replace(MATCH_START, HIGHLIGHT_START).replace(MATCH_END, HIGHLIGHT_END)
+
+
+def _result(kind, object_id, page, material_id, material_title, title, snippet, score):
+    return {
+        "kind": kind,
+        "id": object_id,
+        "page": page or None,
+        "material": material_id,
+        "material_title": material_title,
+        "title": title,
+        "snippet": highlight(snippet),
+        "score": round(float(score), 4),
+    }
@@ -0,0 +1,72 @@
+"""
+Coalescing of identical in-flight requests ("single flight").
+
+The first request for a key runs; identical requests arriving while it is
+still running wait for its result instead of doing the same work again.
+Coordination goes through the cache, so duplicates are coalesced across
+gunicorn workers too (given a shared cache backend).
+"""
+import hashlib
+import json
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from RataTutor.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = "single-flight:{}"
+RESULT_KEY = "single-flight:{}:result:{}"
+# Waiters poll the cache, backing off from POLL_INTERVAL to MAX_POLL_INTERVAL
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 1.0
+
+
+def flight_key(*parts):
+    """Stable key for JSON-serializable `parts`."""
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def run_once(key, fn, label=""):
+    """
+    Return fn() for the first caller of `key`; concurrent callers with the
+    same key wait and get that same (cached, so picklable) return value.
+
+    If the running call raises, or the wait exceeds SINGLE_FLIGHT_TIMEOUT,
+    waiting callers fall back to running fn() themselves.
+    """
+    flight_id = uuid.uuid4().hex
+    lock_key = LOCK_KEY.format(key)
+
+    if cache.add(lock_key, flight_id, settings.SINGLE_FLIGHT_TIMEOUT):
+        try:
+            result = fn()
+            # Waiters only read the result of the flight they saw running
+            cache.set(RESULT_KEY.format(key, flight_id), result, settings.SINGLE_FLIGHT_RESULT_TTL)
+            return result
+        finally:
+            cache.delete(lock_key)
+
+    running_id = cache.get(lock_key)
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_TIMEOUT
+    interval = POLL_INTERVAL
+    while running_id is not None and time.monotonic() < deadline:
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+        # The result is stored before the lock is released, so read the lock first
+        still_running = cache.get(lock_key) == running_id
+        result = cache.get(RESULT_KEY.format(key, running_id))
+        if result is not None:
+            metrics.COALESCED_REQUESTS.inc(view=label)
+            logger.debug("Coalesced duplicate %s request onto flight %s", label, running_id)
+            return result
+        if not still_running:
+            break
+
+    logger.info("Flight for duplicate %s request did not produce a result; running it again", label)
+    return fn()
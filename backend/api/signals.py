@@ -1,56 +1,260 @@
-from django.db.models.signals import pre_delete
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from django.conf import settings
-from .models import Attachment
+from .models import AIConversation, Material, Attachment, Note, FlashcardSet, Flashcard, Quiz, QuizQuestion
+from .services import background, near_duplicates
+from .services.material_copy import (
+    drop_unused_snapshot,
+    freeze_forks_of,
+    freeze_forks_sharing,
+    materialize_fork,
+    materialize_forks_of,
+)
+from .services.public_feed import bump_feed_version
+from .services.search import index_attachment, index_instance, unindex_attachment, unindex_instance
 import cloudinary.uploader
 import logging
 import os
 
 logger = logging.getLogger(__name__)
 
-@receiver(pre_delete, sender=Attachment)
+@receiver(pre_delete, sender=Material)
+def freeze_forks_before_delete(sender, instance, origin=None, **kwargs):
+    """
+    Copy-on-write forks only reference the source's content, so keep it for
+    them before the source (and its content) goes away.
+    """
+    if is_cascade(instance, origin):
+        # The owner is being deleted: a snapshot owned by them would go too
+        materialize_forks_of(instance)
+    else:
+        freeze_forks_of(instance.pk)
+
+
+@receiver(post_delete, sender=Material)
+def drop_snapshot_of_deleted_fork(sender, instance, **kwargs):
+    if instance.shared_from_id:
+        drop_unused_snapshot(instance.shared_from_id)
+
+
+@receiver(pre_save, sender=Note)
+@receiver(pre_save, sender=FlashcardSet)
+@receiver(pre_save, sender=Flashcard)
+@receiver(pre_save, sender=Quiz)
+@receiver(pre_save, sender=QuizQuestion)
+@receiver(pre_delete, sender=Note)
+@receiver(pre_delete, sender=FlashcardSet)
+@receiver(pre_delete, sender=Flashcard)
+@receiver(pre_delete, sender=Quiz)
+@receiver(pre_delete, sender=QuizQuestion)
+def freeze_forks_before_source_write(sender, instance, origin=None, **kwargs):
+    """
+    Forks show their source's rows until they are written to, so move them
+    onto a snapshot before the source owner adds, edits or deletes content.
+    """
+    if is_cascade(instance, origin):
+        return  # The parent's pre_delete has already frozen the forks
+    freeze_forks_sharing(instance)
+
+
+def is_cascade(instance, origin):
+    """Whether a pre/post_delete of `instance` comes from deleting its parent."""
+    if origin is None or origin is instance:
+        return False
+    return not (isinstance(origin, QuerySet) and origin.model is type(instance))
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_delete, sender=Material)
+def invalidate_public_feed(sender, instance, **kwargs):
+    """Drop cached public feed pages when a public (or formerly public) material changes."""
+    if instance.affects_public_feed:
+        bump_feed_version()
+
+
+@receiver(post_save, sender=Attachment)
+@receiver(post_save, sender=Note)
+@receiver(post_save, sender=FlashcardSet)
+@receiver(post_save, sender=Quiz)
+@receiver(post_delete, sender=Attachment)
+@receiver(post_delete, sender=Note)
+@receiver(post_delete, sender=FlashcardSet)
+@receiver(post_delete, sender=Quiz)
+def invalidate_public_feed_counts(sender, instance, created=True, origin=None, **kwargs):
+    """Feed pages show content counts: drop them when a public material gains or loses content."""
+    if not created or is_cascade(instance, origin):
+        return  # Edits don't change the counts; a deleted material bumps the feed itself
+    if Material.objects.filter(pk=instance.material_id, public=True).exists():
+        bump_feed_version()
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_save, sender=Note)
+@receiver(post_save, sender=Flashcard)
+@receiver(post_save, sender=QuizQuestion)
+def update_search_entry(sender, instance, **kwargs):
+    """Keep the full-text search index in sync with searchable content."""
+    index_instance(instance)
+
+
+@receiver(post_delete, sender=Note)
+@receiver(post_delete, sender=Flashcard)
+@receiver(post_delete, sender=QuizQuestion)
+def remove_search_entry(sender, instance, **kwargs):
+    # Material entries go away with the material through the foreign key cascade
+    unindex_instance(instance)
+
+
+@receiver(post_save, sender=Flashcard)
+@receiver(post_save, sender=QuizQuestion)
+def update_near_duplicate_index(sender, instance, **kwargs):
+    """Keep the generation-time duplicate check's cached index in step, one signature at a time."""
+    near_duplicates.update_for(instance)
+
+
+@receiver(post_delete, sender=Flashcard)
+@receiver(post_delete, sender=QuizQuestion)
+@receiver(post_delete, sender=FlashcardSet)
+@receiver(post_delete, sender=Quiz)
+def invalidate_near_duplicate_index(sender, instance, origin=None, **kwargs):
+    if isinstance(instance, (FlashcardSet, Quiz)):
+        # The index is rebuilt from the database on next use
+        near_duplicates.invalidate_for(instance)
+        return
+    if is_cascade(instance, origin):
+        return  # The set/quiz's own post_delete invalidates once for all its items
+    try:
+        near_duplicates.remove_for(instance)
+    except (FlashcardSet.DoesNotExist, Quiz.DoesNotExist):
+        # Parent already gone
+        pass
+
+
+@receiver(post_save, sender=Attachment)
+def update_attachment_search_entries(sender, instance, **kwargs):
+    """
+    Index the attachment's page text in the background once the upload has
+    been committed, so the request doesn't wait for the file to be parsed.
+    """
+    pk = instance.pk
+    transaction.on_commit(lambda: background.submit("attachment_index", _index_attachment_job, pk))
+
+
+def _index_attachment_job(pk):
+    attachment = Attachment.objects.filter(pk=pk).first()
+    if attachment is not None:  # Deleted before its turn came
+        index_attachment(attachment)
+
+
+@receiver(post_save, sender=Attachment)
+def flag_conversations_with_attachments(sender, instance, created, **kwargs):
+    """Keep AIConversation.material_has_attachments in sync (only writes when it flips)."""
+    if created:
+        AIConversation.objects.filter(
+            material_id=instance.material_id, material_has_attachments=False
+        ).update(material_has_attachments=True)
+
+
+@receiver(post_delete, sender=Attachment)
+def unflag_conversations_without_attachments(sender, instance, **kwargs):
+    if not Attachment.objects.filter(material_id=instance.material_id).exists():
+        AIConversation.objects.filter(
+            material_id=instance.material_id, material_has_attachments=True
+        ).update(material_has_attachments=False)
+
+
+@receiver(post_delete, sender=Attachment)
+def remove_attachment_search_entries(sender, instance, **kwargs):
+    unindex_attachment(instance)
+
+
+@receiver(pre_save, sender=Note)
+@receiver(pre_save, sender=FlashcardSet)
+@receiver(pre_save, sender=Quiz)
+def materialize_fork_on_write(sender, instance, **kwargs):
+    """
+    First write of new content into a fork: copy the shared content over so
+    the fork stops showing the source's rows.
+    """
+    material = instance.material
+    if material.shared_from_id:
+        materialize_fork(material)
+
+
+@receiver(post_delete, sender=Attachment)
 def delete_attachment_file(sender, instance, **kwargs):
     """
-    Delete the file when an Attachment instance is deleted.
+    Delete the file when the last Attachment referencing it is deleted.
+    Copied materials share stored blobs, so the file is only removed once
+    no other Attachment row points at the same name.
     Handles both local storage (dev) and Cloudinary (prod).
     """
-    if instance.file:
-        try:
-            # Check if we're using Cloudinary storage
-            is_using_cloudinary = 'cloudinary_storage' in settings.DEFAULT_FILE_STORAGE
-            
-            if is_using_cloudinary:
-                # Cloudinary deletion logic
-                file_name = instance.file.name
-                
-                # Handle the public_id construction more robustly
-                if file_name.startswith('attachments/'):
-                    public_id = file_name[12:]  # Remove 'attachments/' prefix
-                else:
-                    public_id = file_name
-                
-                # Remove file extension for Cloudinary
-                if '.' in public_id:
-                    public_id = public_id.rsplit('.', 1)[0]
-                
-                # Try different resource types if auto doesn't work
-                result = cloudinary.uploader.destroy(public_id, resource_type="auto")
-                
-                if result.get('result') == 'ok':
-                    logger.info(f"Successfully deleted file from Cloudinary: {public_id}")
-                elif result.get('result') == 'not found':
-                    logger.info(f"File not found in Cloudinary (may have been deleted already): {public_id}")
-                else:
-                    logger.warning(f"Cloudinary deletion result for {public_id}: {result}")
-                    
+    if not instance.file:
+        return
+
+    if _file_still_referenced(instance):
+        return
+
+    # Only touch storage once the deletion has actually been committed
+    transaction.on_commit(lambda: _delete_stored_file(instance))
+
+
+def _file_still_referenced(instance):
+    file_name = instance.file.name
+    # Rows sharing a blob share its content hash, which (unlike file) is indexed
+    referencing = Attachment.objects.filter(file=file_name)
+    if instance.content_hash:
+        referencing = referencing.filter(content_hash=instance.content_hash)
+    if referencing.exists():
+        logger.info("Keeping shared file still referenced by other attachments: %s", file_name)
+        return True
+    return False
+
+
+def _delete_stored_file(instance):
+    # Check again after the commit: an upload deduplicated onto this blob
+    # (Attachment.save locks the row it shares with) may have committed since
+    if _file_still_referenced(instance):
+        return
+
+    try:
+        # Check if we're using Cloudinary storage
+        is_using_cloudinary = 'cloudinary_storage' in settings.DEFAULT_FILE_STORAGE
+
+        if is_using_cloudinary:
+            # Cloudinary deletion logic
+            file_name = instance.file.name
+
+            # Handle the public_id construction more robustly
+            if file_name.startswith('attachments/'):
+                public_id = file_name[12:]  # Remove 'attachments/' prefix
             else:
-                # Local file deletion logic
-                if hasattr(instance.file, 'path') and instance.file.path and os.path.isfile(instance.file.path):
-                    os.remove(instance.file.path)
-                    logger.info(f"Successfully deleted local file: {instance.file.path}")
-                else:
-                    logger.info(f"Local file not found or no path available: {instance.file.name}")
-                
-        except Exception as e:
-            logger.error(f"Error deleting file for attachment {instance.id}: {e}")
-            # Don't raise the exception - allow model deletion to continue
\ No newline at end of file
+                public_id = file_name
+
+            # Remove file extension for Cloudinary
+            if '.' in public_id:
+                public_id = public_id.rsplit('.', 1)[0]
+
+            # Try different resource types if auto doesn't work
+            result = cloudinary.uploader.destroy(public_id, resource_type="auto")
+
+            if result.get('result') == 'ok':
+                logger.info("Successfully deleted file from Cloudinary: %s", public_id)
+            elif result.get('result') == 'not found':
+                logger.info("File not found in Cloudinary (may have been deleted already): %s", public_id)
+            else:
+                logger.warning("Cloudinary deletion result for %s: %s", public_id, result)
+
+        else:
+            # Local file deletion logic
+            if hasattr(instance.file, 'path') and instance.file.path and os.path.isfile(instance.file.path):
+                os.remove(instance.file.path)
+                logger.info("Successfully deleted local file: %s", instance.file.path)
+            else:
+                logger.info("Local file not found or no path available: %s", instance.file.name)
+
+    except Exception as e:
+        logger.error("Error deleting file for attachment %s: %s", instance.id, e)
+        # Don't raise the exception - the rows are already gone
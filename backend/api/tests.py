@@ -1,3 +1,1575 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import httpx
+from openai import BadRequestError
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.models import AIConversation, Attachment, Flashcard, FlashcardSet, Material, Note, SearchEntry
+from api.services import ai_service, answer_cache, conversation_router, conversation_transfer, idempotency, near_duplicates, single_flight
+from api.services.llm_json import (
+    FLASHCARDS_SCHEMA,
+    KEY_FACTS_SCHEMA,
+    NOTE_SCHEMA,
+    QUIZ_SCHEMA,
+    IncrementalJSONParser,
+    SchemaError,
+    loads_model_json,
+    locate_json,
+    parse_model_output,
+    recover_truncated,
+)
+from api.services import material_copy
+from api.services.material_copy import fork_material
+from api.services.material_retrieval import relevant_chunks
+from api.services.progressive_generation import FlashcardSetWriter
+from api.services.search import search
+from api.throttling import GenerationRateThrottle, _inflight_key
+from api.views.streaming import FlashcardStreamView
+from RataTutor.utils import metrics
+from RataTutor.utils.log_handlers import NonBlockingStreamHandler, SamplingFilter
+
+
+# For SimpleTestCases exercising the cache: the test runner's DEBUG=False
+# default is a database cache otherwise
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    Base class for asserting that hot queries are served by an index.
+    Plans are read with EXPLAIN QUERY PLAN, so the checks only run on SQLite.
+    """
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        table = queryset.model._meta.db_table
+        self.assertRegex(plan, rf"USING (COVERING )?INDEX {index_name}\b", f"Index not used:\n{plan}")
+        # "SCAN <table> USING INDEX" walks an index; a bare "SCAN <table>" reads every row
+        self.assertIsNone(re.search(rf"SCAN {table}\s*$", plan, re.MULTILINE), f"Full table scan:\n{plan}")
+        self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plan, f"Sort not served by the index:\n{plan}")
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN checks are SQLite specific")
+class HotQueryIndexTests(QueryPlanTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("planner")
+
+    def test_owner_materials_use_owner_status_index(self):
+        queryset = Material.objects.filter(owner=self.user, status="active").order_by("-pinned", "-updated_at")
+        self.assertUsesIndex(queryset, "material_owner_status_idx")
+
+    def test_trash_uses_partial_index(self):
+        queryset = Material.objects.filter(owner=self.user, status="trash").order_by("-updated_at")
+        self.assertUsesIndex(queryset, "material_owner_trash_idx")
+
+    def test_public_feed_uses_partial_index(self):
+        queryset = Material.objects.filter(public=True, status="active").order_by("-updated_at", "-id")
+        self.assertUsesIndex(queryset, "material_public_feed_idx")
+
+    def test_conversation_list_uses_user_recent_index(self):
+        queryset = AIConversation.objects.filter(user=self.user).order_by("-updated_at")
+        self.assertUsesIndex(queryset, "conversation_user_recent_idx")
+
+
+@skipUnless(connection.vendor == "sqlite" and "init_command" in settings.DATABASES["default"].get("OPTIONS", {}),
+            "SQLite tuning is off")
+class DatabaseProfileTests(TransactionTestCase):
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_connections_are_tuned(self):
+        options = settings.DATABASES["default"]["OPTIONS"]
+
+        self.assertEqual(self.pragma("synchronous"), 1)  # NORMAL
+        self.assertEqual(self.pragma("busy_timeout"), options["timeout"] * 1000)
+        self.assertEqual(self.pragma("temp_store"), 2)  # MEMORY
+
+    def test_write_benchmark_runs_and_cleans_up(self):
+        out = io.StringIO()
+
+        call_command("benchmark_db_writes", workers=2, writes=6, stdout=out)
+
+        self.assertRegex(out.getvalue(), r"Committed:\s+\d+")
+        self.assertIn("writes/s", out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith="db-benchmark-").exists())
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+    BACKGROUND_TASKS_EAGER=True,
+)
+class SharedAttachmentBlobTests(TestCase):
+
+    def setUp(self):
+        self.material = Material.objects.create(owner=User.objects.create_user("uploader"), title="Blobs")
+
+    def upload(self, name, data):
+        return Attachment.objects.create(material=self.material, file=SimpleUploadedFile(name, data))
+
+    def test_backfilled_attachments_deduplicate(self):
+        backfill = importlib.import_module("api.migrations.0011_backfill_attachment_content_hash")
+        old = self.upload("old.txt", b"photosynthesis")
+        content_hash = old.content_hash
+        Attachment.objects.filter(pk=old.pk).update(content_hash="")
+        Attachment.objects.create(material=self.material, file="attachments/missing.txt")
+
+        backfill.backfill_attachment_content_hash(apps, None)
+
+        old.refresh_from_db()
+        self.assertEqual(old.content_hash, content_hash)
+        self.assertEqual(self.upload("new.txt", b"photosynthesis").file.name, old.file.name)
+
+    def test_blobs_are_not_shared_between_users(self):
+        mine = self.upload("Jane_Doe_transcript.pdf", b"grades")
+        other = Material.objects.create(owner=User.objects.create_user("stranger"), title="Blobs")
+
+        theirs = Attachment.objects.create(material=other, file=SimpleUploadedFile("transcript.pdf", b"grades"))
+
+        self.assertEqual(theirs.content_hash, mine.content_hash)
+        self.assertNotEqual(theirs.file.name, mine.file.name)
+        self.assertNotIn("Jane_Doe", theirs.file.name)
+
+    def test_blob_deleted_with_last_reference(self):
+        first = self.upload("a.txt", b"osmosis")
+        second = self.upload("b.txt", b"osmosis")
+        storage, name = first.file.storage, first.file.name
+        self.assertEqual(second.file.name, name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(storage.exists(name))
+
+
+class MaterialForkTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user("author")
+        self.copier = User.objects.create_user("copier")
+        self.source = Material.objects.create(owner=self.owner, title="Biology", public=True)
+        self.note = Note.objects.create(material=self.source, title="Cells", content="Original")
+        self.flashcard_set = FlashcardSet.objects.create(material=self.source, title="Terms")
+        Flashcard.objects.create(flashcard_set=self.flashcard_set, question="ATP?", answer="Energy")
+        self.fork = fork_material(self.source, self.copier, "Biology")
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def assert_fork_keeps_original(self, fork=None):
+        fork = fork or self.fork
+        fork.refresh_from_db()
+        content = fork.content_material
+        self.assertEqual(list(content.notes.values_list("content", flat=True)), ["Original"])
+        cards = Flashcard.objects.filter(flashcard_set__material=content)
+        self.assertEqual(list(cards.values_list("question", flat=True)), ["ATP?"])
+
+    def test_copier_write_goes_to_fork_copy(self):
+        response = self.client_for(self.copier).patch(
+            f"/api/notes/{self.note.pk}/", {"content": "Mine"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content, "Original")
+        self.fork.refresh_from_db()
+        self.assertIsNone(self.fork.shared_from_id)
+        self.assertEqual(list(self.fork.notes.values_list("content", flat=True)), ["Mine"])
+
+    def test_source_edit_does_not_reach_fork(self):
+        response = self.client_for(self.owner).patch(
+            f"/api/notes/{self.note.pk}/", {"content": "Edited"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content, "Edited")
+        self.assert_fork_keeps_original()
+
+    def test_source_delete_does_not_reach_fork(self):
+        response = self.client_for(self.owner).delete(f"/api/flashcard-sets/{self.flashcard_set.pk}/")
+
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(self.source.flashcard_sets.exists())
+        self.assert_fork_keeps_original()
+
+    def test_source_addition_does_not_reach_fork(self):
+        Note.objects.create(material=self.source, title="Tissues", content="New")
+
+        self.assert_fork_keeps_original()
+
+    def test_source_material_delete_does_not_reach_fork(self):
+        self.source.delete()
+
+        self.assert_fork_keeps_original()
+
+    def test_forks_share_one_snapshot_until_their_own_write(self):
+        forks = [self.fork] + [fork_material(self.source, self.copier, f"Biology {i}") for i in range(3)]
+
+        self.note.content = "Edited"
+        self.note.save()
+
+        snapshot = Material.objects.get(status="snapshot")
+        self.assertEqual({fork.shared_from_id for fork in Material.objects.filter(pk__in=[f.pk for f in forks])},
+                         {snapshot.pk})
+        self.assertEqual(Note.objects.count(), 2)
+        for fork in forks:
+            self.assert_fork_keeps_original(fork)
+
+        snapshot_note = snapshot.notes.get()
+        for fork in forks:
+            Note.objects.create(material=fork, title="Extra", content="Mine")
+            fork.refresh_from_db()
+            self.assertIsNone(fork.shared_from_id)
+            self.assertEqual(fork.notes.get(title="Cells").content, "Original")
+
+        # The last fork to leave deletes the snapshot
+        self.assertFalse(Material.objects.filter(status="snapshot").exists())
+        self.assertFalse(Note.objects.filter(pk=snapshot_note.pk).exists())
+
+    def test_snapshot_status_cannot_be_set(self):
+        response = self.client_for(self.owner).patch(
+            f"/api/materials/{self.source.pk}/", {"status": "snapshot"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_forks_are_looked_up_once_per_parent(self):
+        flashcard_set = FlashcardSet.objects.get(pk=self.flashcard_set.pk)
+
+        with mock.patch("api.services.material_copy.freeze_forks_of", return_value=None) as freeze:
+            for i in range(5):
+                Flashcard.objects.create(flashcard_set=flashcard_set, question=f"Q{i}?", answer="A")
+
+        freeze.assert_called_once_with(self.source.pk)
+
+
+class NearDuplicateIndexTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create_user("carder")
+        self.material = Material.objects.create(owner=owner, title="Genetics")
+        self.flashcard_set = FlashcardSet.objects.create(material=self.material, title="Genes")
+        Flashcard.objects.bulk_create(
+            Flashcard(flashcard_set=self.flashcard_set, question=f"What does gene {i} code for?", answer="A protein")
+            for i in range(5)
+        )
+        self.key = near_duplicates._index_key("flashcard", self.material.pk)
+
+    @override_settings(NEAR_DUPLICATE_INDEX_TTL=123)
+    def test_index_is_cached_with_a_ttl(self):
+        with mock.patch.object(near_duplicates.cache, "set", wraps=near_duplicates.cache.set) as cache_set:
+            near_duplicates.get_index(self.material, "flashcard")
+
+        cache_set.assert_called_once_with(self.key, mock.ANY, 123)
+
+    def test_cascade_delete_invalidates_once_per_parent(self):
+        near_duplicates.get_index(self.material, "flashcard")
+
+        with mock.patch.object(near_duplicates, "invalidate_for", wraps=near_duplicates.invalidate_for) as invalidate, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.flashcard_set.delete()
+
+        self.assertEqual(invalidate.call_count, 1)
+        self.assertIsNone(cache.get(self.key))
+
+    def test_card_changes_update_the_cached_index(self):
+        near_duplicates.get_index(self.material, "flashcard")
+        cards = list(Flashcard.objects.filter(flashcard_set=self.flashcard_set).order_by("pk"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cards[0].delete()
+            cards[1].question = "Which organelle makes ATP?"
+            cards[1].save()
+            added = Flashcard.objects.create(
+                flashcard_set=self.flashcard_set, question="Where is DNA stored?", answer="The nucleus"
+            )
+
+        index = cache.get(self.key)
+        self.assertEqual(set(index.signatures), {card.pk for card in cards[1:]} | {added.pk})
+        self.assertEqual(index.signatures[cards[1].pk], near_duplicates.signature("Which organelle makes ATP?"))
+        self.assertEqual(index.most_similar(near_duplicates.signature("Where is DNA stored?"))[0], added.pk)
+
+    def test_card_saves_do_not_rebuild_the_index(self):
+        near_duplicates.get_index(self.material, "flashcard")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Flashcard.objects.create(flashcard_set=self.flashcard_set, question="What is RNA?", answer="A copy")
+        with mock.patch.object(Flashcard.objects, "filter") as rebuild:
+            index = near_duplicates.get_index(self.material, "flashcard")
+
+        rebuild.assert_not_called()
+        self.assertEqual(len(index.signatures), 6)
+
+    def test_contended_update_drops_the_index(self):
+        near_duplicates.get_index(self.material, "flashcard")
+        cache.add(f"{self.key}:lock", 1, 10)
+
+        with mock.patch.object(near_duplicates, "INDEX_LOCK_WAIT", 0), self.captureOnCommitCallbacks(execute=True):
+            Flashcard.objects.create(flashcard_set=self.flashcard_set, question="What is RNA?", answer="A copy")
+
+        self.assertIsNone(cache.get(self.key))
+
+
+class ConversationAttachmentFlagTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("chatter")
+        self.material = Material.objects.create(owner=self.user, title="Genetics")
+        self.conv = AIConversation.objects.create(user=self.user, material=self.material)
+
+    def test_chat_turn_keeps_flag_set_during_the_llm_call(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        def generate(conv, prompt):
+            # An attachment is uploaded while the model is answering
+            AIConversation.objects.filter(pk=conv.pk).update(material_has_attachments=True)
+            return "Genes code for proteins."
+
+        with mock.patch("api.views.conversations.update_conversation_summary", return_value=False), \
+                mock.patch("api.views.conversations.generate_ai_response_with_context", side_effect=generate):
+            response = client.post(f"/api/conversations/{self.conv.pk}/chat/", {"prompt": "What is a gene?"}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.conv.refresh_from_db()
+        self.assertTrue(self.conv.material_has_attachments)
+        self.assertEqual([msg["role"] for msg in self.conv.messages], ["user", "assistant"])
+
+    def test_copied_attachments_flag_conversations(self):
+        source = Material.objects.create(owner=self.user, title="Source")
+        Attachment.objects.create(material=source, file="attachments/genes.pdf", content_hash="abc")
+
+        material_copy._copy_attachments(source, self.material)
+
+        self.conv.refresh_from_db()
+        self.assertTrue(self.conv.material_has_attachments)
+
+
+class ConversationRouterTests(SimpleTestCase):
+
+    def test_keywords_match_as_substrings(self):
+        # Same semantics as the original checks: "how" also matches "show"
+        self.assertEqual(conversation_router.complexity_score(["show me", "why? explain why"]), 3)
+        self.assertTrue(conversation_router.mentions_material("what does the document say?"))
+        self.assertFalse(conversation_router.mentions_material("what is a gene?"))
+        # The first topic in TOPIC_KEYWORDS order wins
+        self.assertEqual(conversation_router.detect_topic("quiz me on this definition"), "flashcards")
+        self.assertEqual(conversation_router.detect_topic("hello"), "general")
+
+    def test_tracked_fields_match_a_full_recount(self):
+        conv = AIConversation(messages=[])
+        turns = [
+            "Explain how osmosis works", "Water moves across the membrane.",
+            "Why?", "Concentration gradients.", "Make a quiz", "Sure.",
+            "Thanks", "Anytime.", "Summarize the key points", "Done.",
+        ]
+        for index, content in enumerate(turns):
+            if index % 2:
+                conv.add_assistant_message(content)
+            else:
+                conv.last_user_message = content
+                conv.addToMessage()
+
+            tracked = (conv.complexity_score, conv.topic)
+            conv.refresh_derived_fields()
+            self.assertEqual(tracked, (conv.complexity_score, conv.topic), f"after message {index}")
+
+
+class TutorAnswerCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.clients = []
+        for name in ["first", "second"]:
+            user = User.objects.create_user(name)
+            material = Material.objects.create(owner=user, title=f"{name}'s genetics", answer_cache_enabled=True)
+            Attachment.objects.create(material=material, file="attachments/genes.pdf", content_hash="abc")
+            conv = AIConversation.objects.create(
+                user=user, material=material, summary_context=f"{name} struggles with meiosis."
+            )
+            client = APIClient()
+            client.force_authenticate(user)
+            self.clients.append((client, conv))
+
+    def chat(self, who, prompt):
+        client, conv = self.clients[who]
+        with mock.patch("api.views.conversations.update_conversation_summary", return_value=False), \
+                mock.patch("api.views.conversations.generate_standalone_answer",
+                           return_value="Four bases: A, C, G and T.") as standalone, \
+                mock.patch("api.views.conversations.generate_ai_response_with_context",
+                           return_value="As discussed, meiosis...") as with_context:
+            response = client.post(f"/api/conversations/{conv.pk}/chat/", {"prompt": prompt}, format="json")
+        self.assertEqual(response.status_code, 200)
+        return response.data, standalone, with_context
+
+    def test_stored_answer_is_generated_without_the_conversation(self):
+        data, standalone, with_context = self.chat(0, "What are the four bases of DNA?")
+
+        self.assertFalse(data["cached_answer"])
+        standalone.assert_called_once_with(self.clients[0][1].material, "What are the four bases of DNA?")
+        with_context.assert_not_called()
+
+    def test_exact_hit_for_another_user(self):
+        self.chat(0, "What are the four bases of DNA?")
+
+        data, standalone, with_context = self.chat(1, "what are the four bases of DNA")
+
+        self.assertTrue(data["cached_answer"])
+        self.assertEqual(data["ai_response"], "Four bases: A, C, G and T.")
+        standalone.assert_not_called()
+        with_context.assert_not_called()
+
+    def test_similar_hit_for_another_user(self):
+        self.chat(0, "What are the four nitrogenous bases found in DNA molecules?")
+
+        data, standalone, _ = self.chat(1, "What are the four nitrogenous bases found in DNA molecule?")
+
+        self.assertTrue(data["cached_answer"])
+        standalone.assert_not_called()
+
+    def test_follow_up_uses_the_conversation_and_is_not_cached(self):
+        data, standalone, with_context = self.chat(0, "Can you explain that again?")
+
+        self.assertFalse(data["cached_answer"])
+        standalone.assert_not_called()
+        with_context.assert_called_once()
+
+        data, _, with_context = self.chat(1, "Can you explain that again?")
+
+        self.assertFalse(data["cached_answer"])
+        with_context.assert_called_once()
+
+    def test_attachment_change_starts_a_new_cache(self):
+        self.chat(0, "What are the four bases of DNA?")
+        material = self.clients[1][1].material
+        extra = Attachment.objects.create(material=material, file="attachments/rna.pdf", content_hash="def")
+
+        data, standalone, _ = self.chat(1, "What are the four bases of DNA?")
+
+        self.assertFalse(data["cached_answer"])
+        standalone.assert_called_once()
+
+        # Back to the same attachments as the first material: its answers apply again
+        extra.delete()
+        data, standalone, _ = self.chat(1, "What are the four bases of DNA?")
+        self.assertTrue(data["cached_answer"])
+        standalone.assert_not_called()
+
+    @override_settings(TUTOR_ANSWER_CACHE_TTL=60)
+    def test_expired_answers_are_not_served(self):
+        now = time.time()
+        with mock.patch.object(answer_cache.time, "time", return_value=now):
+            self.chat(0, "What are the four bases of DNA?")
+
+        with mock.patch.object(answer_cache.time, "time", return_value=now + 61):
+            data, standalone, _ = self.chat(1, "What are the four bases of DNA?")
+
+        self.assertFalse(data["cached_answer"])
+        standalone.assert_called_once()
+
+    def test_materials_without_opt_in_neither_read_nor_write(self):
+        self.chat(0, "What are the four bases of DNA?")
+        Material.objects.filter(pk=self.clients[1][1].material_id).update(answer_cache_enabled=False)
+
+        data, standalone, with_context = self.chat(1, "What are the four bases of DNA?")
+
+        self.assertFalse(data["cached_answer"])
+        standalone.assert_not_called()
+        with_context.assert_called_once()
+
+
+class PublicFeedTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user("reader")
+        self.author = User.objects.create_user("author")
+        for index in range(3):
+            Material.objects.create(owner=self.author, title=f"Shared {index}", public=True)
+
+    def feed(self, user, **params):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get("/api/materials/public/", params).data
+
+    def test_own_materials_do_not_shorten_pages(self):
+        self.feed(self.reader, page_size=2)  # Shared page cached first
+        for index in range(2):
+            Material.objects.create(owner=self.reader, title=f"Mine {index}", public=True)
+
+        page = self.feed(self.reader, page_size=2)
+
+        self.assertEqual([m["owner"] for m in page["results"]], ["author", "author"])
+        self.assertIsNotNone(page["next"])
+        self.assertEqual(len(self.feed(self.author, page_size=2)["results"]), 2)
+
+    def test_counts_refresh_when_content_changes(self):
+        material = Material.objects.filter(owner=self.author).first()
+        self.assertEqual(self.feed(self.reader)["results"][-1]["notes_count"], 0)
+
+        note = Note.objects.create(material=material, title="Cells", content="Text")
+        counts = {m["id"]: m["notes_count"] for m in self.feed(self.reader)["results"]}
+        self.assertEqual(counts[material.pk], 1)
+
+        note.delete()
+        counts = {m["id"]: m["notes_count"] for m in self.feed(self.reader)["results"]}
+        self.assertEqual(counts[material.pk], 0)
+
+
+class LogHandlerTests(SimpleTestCase):
+
+    def logger(self, handler):
+        logger = logging.getLogger(f"api.tests.{self._testMethodName}")
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        return logger
+
+    def test_records_are_written_by_the_listener_thread(self):
+        writers = []
+
+        class Stream(io.StringIO):
+            def write(self, text):
+                writers.append(threading.current_thread())
+                return super().write(text)
+
+        stream = Stream()
+        handler = NonBlockingStreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+
+        self.logger(handler).info("Indexed %d page(s)", 3)
+        handler.close()  # Flushes the queue
+
+        self.assertEqual(stream.getvalue(), "INFO Indexed 3 page(s)\n")
+        self.assertNotIn(threading.current_thread(), writers)
+
+    def test_full_queue_drops_records_instead_of_blocking(self):
+        stream = io.StringIO()
+        handler = NonBlockingStreamHandler(stream, maxsize=1)
+        handler.listener.stop()  # Nothing drains the queue
+        logger = self.logger(handler)
+
+        for n in range(3):
+            logger.info("record %d", n)
+
+        self.assertEqual(handler.dropped, 2)
+        handler.close()
+
+    def test_sampling_keeps_warnings(self):
+        records = [
+            logging.LogRecord("api.items", level, __file__, 1, "item", None, None)
+            for level in (logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR)
+        ]
+
+        self.assertEqual([SamplingFilter(0).filter(r) for r in records], [False, False, True, True])
+        self.assertTrue(all(SamplingFilter(1).filter(r) for r in records))
+
+
+class RequestInstrumentationTests(TestCase):
+
+    def test_streaming_response_measured_until_closed(self):
+        user = User.objects.create_user("streamer")
+        messages = [{"role": "user", "content": f"Message {index}"} for index in range(450)]
+        conversation = AIConversation.objects.create(user=user, messages=messages)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        with self.assertLogs("RataTutor.requests", "INFO") as logs:
+            response = client.get(f"/api/conversations/{conversation.pk}/export/")
+            self.assertEqual(logs.output, [])  # Nothing logged before the body is sent
+            body = b"".join(response.streaming_content)
+
+        self.assertEqual(len(body.splitlines()), 451)
+        self.assertNotIn("Server-Timing", response)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record["endpoint"], "GET api:conversation-export")
+        # Conversation lookup, then the message count and the messages query while streaming
+        self.assertGreaterEqual(record["db_queries"], 3)
+
+    def test_regular_response_has_server_timing(self):
+        user = User.objects.create_user("reader")
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.get("/api/conversations/")
+
+        self.assertIn('db;dur=', response["Server-Timing"])
+
+
+@override_settings(PROFILING_DIR=tempfile.mkdtemp(), PROFILING_SAMPLE_INTERVAL=0.001)
+class RequestProfilingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("profiler", is_staff=True)
+        self.material = Material.objects.create(owner=self.user, title="Genetics")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def generate(self, **headers):
+        n = FlashcardSet.objects.count()
+        result = {"title": f"Genes and alleles {n}", "description": "",
+                  "flashcards": [{"question": f"DNA {n}?", "answer": "Code"}]}
+        with mock.patch("api.views.conversations.generate_flashcards_from_material", return_value=result):
+            response = self.client.post(
+                f"/api/materials/{self.material.pk}/generate-flashcards/", {"num_cards": 1}, format="json", **headers
+            )
+        self.assertEqual(response.status_code, 201)
+        return response
+
+    def output(self, response, suffix):
+        return os.path.join(settings.PROFILING_DIR, f"{response['X-Profile-Id']}.{suffix}")
+
+    def test_staff_header_writes_spans_and_cprofile_dump(self):
+        response = self.generate(HTTP_X_PROFILE="cprofile")
+
+        with open(self.output(response, "spans.json"), encoding="utf-8") as f:
+            spans = json.load(f)
+        self.assertEqual((spans["view"], spans["mode"], spans["status"]), ("FlashcardGenerationView", "cprofile", 201))
+        self.assertTrue({"generate", "db_write"} <= {span["name"] for span in spans["spans"]})
+        self.assertTrue(os.path.exists(self.output(response, "prof")))
+
+    def demote(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=False)
+        self.user.refresh_from_db()
+        self.client.force_authenticate(self.user)
+
+    def test_header_is_ignored_for_other_users(self):
+        self.demote()
+
+        response = self.generate(HTTP_X_PROFILE="cprofile")
+
+        self.assertNotIn("X-Profile-Id", response)
+
+    def test_admin_toggle_profiles_every_request(self):
+        self.demote()
+        admin = User.objects.create_superuser("admin", password="x")
+        admin_client = APIClient()
+        admin_client.force_authenticate(admin)
+
+        self.assertEqual(self.client.post("/api/admin/profiling/", {"mode": "sampling"}).status_code, 403)
+        self.assertEqual(admin_client.post("/api/admin/profiling/", {"mode": "flame"}).status_code, 400)
+        self.assertEqual(admin_client.post("/api/admin/profiling/", {"mode": "sampling"}).data, {"mode": "sampling"})
+
+        response = self.generate()
+        self.assertTrue(os.path.exists(self.output(response, "folded")))
+
+        admin_client.post("/api/admin/profiling/", {"mode": None}, format="json")
+        self.assertNotIn("X-Profile-Id", self.generate())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MetricsRetirementTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+        patcher = mock.patch.object(metrics.time, "time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def worker(self, name):
+        registry = metrics.Registry()
+        registry._worker = (os.getpid(), name)
+        return registry, registry.counter("jobs_total", "Jobs."), registry.gauge("busy", "Busy.")
+
+    @staticmethod
+    def value(registry, name):
+        return sum(registry.collect()[name].values())
+
+    def test_idle_worker_totals_are_kept(self):
+        scraper, scraper_jobs, _ = self.worker("scraper")
+        idle, idle_jobs, idle_busy = self.worker("idle")
+        scraper_jobs.inc(5)
+        idle_jobs.inc(7)
+        idle_busy.set(3)
+        idle.publish()
+        self.assertEqual(self.value(scraper, "jobs_total"), 12)
+
+        self.now += metrics.RETIRE_AFTER + 1
+        self.assertEqual(self.value(scraper, "jobs_total"), 12)
+        self.assertEqual(self.value(scraper, "busy"), 0)  # Gauges of retired workers are dropped
+
+        # The retired worker comes back and only adds what it counted since
+        idle_jobs.inc()
+        idle.publish()
+        self.assertEqual(self.value(scraper, "jobs_total"), 13)
+        self.assertEqual(self.value(scraper, "busy"), 3)
+
+        self.now += metrics.RETIRE_AFTER + 1
+        self.assertEqual(self.value(scraper, "jobs_total"), 13)
+
+    def test_workers_starting_together_all_register(self):
+        workers = [self.worker(f"w{i}") for i in range(8)]
+        barrier = threading.Barrier(len(workers))
+
+        def start(registry, jobs):
+            jobs.inc()
+            barrier.wait(5)
+            registry.publish()
+
+        threads = [threading.Thread(target=start, args=(registry, jobs)) for registry, jobs, _ in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(cache.get(metrics.WORKERS_KEY), {f"w{i}" for i in range(8)})
+        self.assertEqual(self.value(self.worker("scraper")[0], "jobs_total"), 8)
+
+    def test_worker_that_published_again_is_not_retired(self):
+        scraper = self.worker("scraper")[0]
+        busy, busy_jobs, _ = self.worker("busy")
+        busy_jobs.inc(2)
+        busy.publish()
+
+        self.now += metrics.RETIRE_AFTER + 1
+        busy_jobs.inc()
+        busy.publish()  # After the scrape found it stale, before it was folded
+        scraper._retire({"busy"})
+
+        self.assertIn("busy", cache.get(metrics.WORKERS_KEY))
+        busy.publish()
+        self.assertEqual(self.value(scraper, "jobs_total"), 3)
+
+    def test_publish_waits_for_the_workers_lock(self):
+        registry, jobs, _ = self.worker("late")
+        jobs.inc(4)
+        cache.add(metrics.WORKERS_LOCK_KEY, "other", 10)
+
+        with mock.patch.object(metrics, "WORKERS_LOCK_WAIT", 0):
+            registry.publish()
+        self.assertIsNone(cache.get(metrics.WORKERS_KEY))
+
+        cache.delete(metrics.WORKERS_LOCK_KEY)
+        self.assertEqual(self.value(registry, "jobs_total"), 4)
+
+
+class MetricsEndpointTests(SimpleTestCase):
+
+    @override_settings(METRICS_TOKEN="", DEBUG=False)
+    def test_denied_without_a_token_outside_debug(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+
+    @override_settings(METRICS_TOKEN="s3cret", CACHES=LOCMEM_CACHES)
+    def test_token_required(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE", response.content)
+
+
+class CoalescedGenerationTests(TestCase):
+    params = {"num_cards": 5}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("clicker")
+        self.material = Material.objects.create(owner=self.user, title="Genetics")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/materials/{self.material.pk}/generate-flashcards/"
+
+    def fill_llm_slots(self):
+        cache.set(_inflight_key(self.user), settings.LLM_MAX_INFLIGHT_PER_USER, 60)
+
+    def test_duplicate_waits_without_taking_a_slot(self):
+        key = single_flight.flight_key(
+            "FlashcardGenerationView", self.user.pk, {"material_id": self.material.pk}, self.params, "all"
+        )
+        # An identical request is running (and holding a slot) elsewhere and has just finished
+        cache.set(single_flight.LOCK_KEY.format(key), "leader", 60)
+        cache.set(single_flight.RESULT_KEY.format(key, "leader"), (201, {"id": 42}), 60)
+        self.fill_llm_slots()
+
+        with mock.patch("api.views.conversations.generate_flashcards_from_material") as generate:
+            response = self.client.post(self.url, self.params, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {"id": 42})
+        generate.assert_not_called()
+        self.assertEqual(cache.get(_inflight_key(self.user)), settings.LLM_MAX_INFLIGHT_PER_USER)
+
+    def test_running_request_takes_a_slot(self):
+        self.fill_llm_slots()
+
+        response = self.client.post(self.url, self.params, format="json")
+
+        self.assertEqual(response.status_code, 429)
+
+    def test_slot_held_while_generating_and_released(self):
+        def generate(material, num_cards, specific_attachments):
+            self.assertEqual(cache.get(_inflight_key(self.user)), 1)
+            return {"title": "Genes", "description": "", "flashcards": [{"question": "DNA?", "answer": "Code"}]}
+
+        with mock.patch("api.views.conversations.generate_flashcards_from_material", side_effect=generate):
+            response = self.client.post(self.url, self.params, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(cache.get(_inflight_key(self.user)), 0)
+
+
+class StreamingGenerationSlotTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("streamer")
+        self.material = Material.objects.create(owner=self.user, title="Genetics")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/materials/{self.material.pk}/generate-flashcards/stream/"
+        self.events_closed = False
+
+    def post(self):
+        def events():
+            try:
+                yield "field", ("title", "Genes")
+                yield "item", {"question": "DNA?", "answer": "Code"}
+            finally:
+                self.events_closed = True
+
+        def start(material, count, specific_attachments):
+            # Mirrors the real stream functions: the model call starts before the body is read
+            stream = events()
+            next(stream)
+            return stream
+
+        with mock.patch.object(FlashcardStreamView, "stream_function", staticmethod(start)):
+            response = self.client.post(self.url, {"num_cards": 1}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cache.get(_inflight_key(self.user)), 1)
+        return response
+
+    def test_slot_released_when_client_disconnects_before_first_event(self):
+        response = self.post()
+
+        response.close()
+
+        self.assertEqual(cache.get(_inflight_key(self.user)), 0)
+        self.assertTrue(self.events_closed)
+        self.assertFalse(FlashcardSet.objects.exists())
+
+    def test_slot_released_when_stream_finishes(self):
+        response = self.post()
+
+        body = b"".join(response.streaming_content).decode()
+
+        self.assertEqual(re.findall(r"^event: (\w+)$", body, re.M), ["set", "item", "done"])
+        self.assertEqual(cache.get(_inflight_key(self.user)), 0)
+        self.assertTrue(self.events_closed)
+        response.close()
+        self.assertEqual(cache.get(_inflight_key(self.user)), 0)
+
+
+class ProgressiveWriterTests(TestCase):
+
+    def test_titles_are_made_unique_within_the_material(self):
+        material = Material.objects.create(owner=User.objects.create_user("streamer"), title="Genetics")
+        FlashcardSet.objects.create(material=material, title="Mendelian inheritance")
+
+        first = FlashcardSetWriter(material)
+        first.field("title", "Mendelian inheritance")
+        first.add({"question": "Alleles?", "answer": "Gene variants"})
+        # The title may also arrive after the first item, renaming the set
+        second = FlashcardSetWriter(material)
+        second.add({"question": "Dominant?", "answer": "Expressed"})
+        second.field("title", "Mendelian inheritance")
+
+        self.assertEqual(first.finish().title, "Mendelian inheritance (2)")
+        self.assertEqual(second.finish().title, "Mendelian inheritance (3)")
+
+
+class GenerateAllTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("batcher")
+        self.material = Material.objects.create(owner=self.user, title="Genetics")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/materials/{self.material.pk}/generate-all/"
+
+    def test_extracts_once_and_generates_concurrently(self):
+        # Each generator waits for the other two, so this only passes if they run in parallel
+        barrier = threading.Barrier(3, timeout=5)
+
+        def generator(name):
+            def generate(material, *args, text_body):
+                barrier.wait()
+                return name, text_body
+            return generate
+
+        with mock.patch.object(ai_service, "_material_text", return_value="Genes") as extract, \
+                mock.patch.object(ai_service, "generate_notes_from_material", side_effect=generator("notes")), \
+                mock.patch.object(ai_service, "generate_flashcards_from_material", side_effect=generator("flashcards")), \
+                mock.patch.object(ai_service, "generate_quiz_from_material", side_effect=generator("quiz")):
+            outcomes = ai_service.generate_all_from_material(self.material, 3, 4)
+
+        extract.assert_called_once_with(self.material, None)
+        self.assertEqual(outcomes, {
+            "notes": (("notes", "Genes"), None),
+            "flashcards": (("flashcards", "Genes"), None),
+            "quiz": (("quiz", "Genes"), None),
+        })
+
+    def test_failed_artifact_is_reported_and_the_others_saved(self):
+        Note.objects.create(material=self.material, title="Genes", content="Old")
+        outcomes = {
+            "notes": ({"title": "Genes", "description": "", "content": "DNA carries genes."}, None),
+            "flashcards": ({"title": "Genes", "description": "", "flashcards": [{"question": "DNA?", "answer": "Code"}]}, None),
+            "quiz": (None, ValueError("Quiz generation failed: timeout")),
+        }
+
+        with mock.patch("api.views.conversations.generate_all_from_material", return_value=outcomes):
+            response = self.client.post(self.url, {"num_cards": 1, "num_questions": 1}, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["note"]["title"], "Genes (2)")
+        self.assertEqual(response.data["flashcard_set"]["title"], "Genes")
+        self.assertIsNone(response.data["quiz"])
+        self.assertEqual(response.data["errors"], {"quiz": "Quiz generation failed: timeout"})
+        self.assertEqual(cache.get(_inflight_key(self.user)), 0)
+
+    def test_all_artifacts_failing_is_an_error(self):
+        outcomes = {artifact: (None, ValueError("down")) for artifact in ("notes", "flashcards", "quiz")}
+
+        with mock.patch("api.views.conversations.generate_all_from_material", return_value=outcomes):
+            response = self.client.post(self.url, {"num_cards": 1, "num_questions": 1}, format="json")
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(set(response.data["errors"]), {"notes", "flashcards", "quiz"})
+        self.assertFalse(Note.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class IdempotencyTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User(pk=1, username="retrier")
+        self.calls = []
+
+    def run_request(self, key, body, status_code=201):
+        def fn():
+            self.calls.append(body)
+            return status_code, {"call": len(self.calls)}
+        return idempotency.run_idempotent(self.user, "FlashcardGenerationView", key, body, fn)
+
+    def test_retry_replays_stored_response(self):
+        self.assertEqual(self.run_request("k1", {"num_cards": 5}), (201, {"call": 1}, False))
+        self.assertEqual(self.run_request("k1", {"num_cards": 5}), (201, {"call": 1}, True))
+        self.assertEqual(len(self.calls), 1)
+
+    def test_key_reused_with_different_body_is_rejected(self):
+        self.run_request("k1", {"num_cards": 5})
+        with self.assertRaises(idempotency.IdempotencyKeyReused):
+            self.run_request("k1", {"num_cards": 10})
+        self.assertEqual(len(self.calls), 1)
+
+    def test_server_errors_are_not_stored(self):
+        self.assertEqual(self.run_request("k1", {"num_cards": 5}, status_code=502)[0], 502)
+        self.assertEqual(self.run_request("k1", {"num_cards": 5}), (201, {"call": 2}, False))
+
+    def test_client_errors_are_stored(self):
+        self.run_request("k1", {"num_cards": 5}, status_code=400)
+        self.assertEqual(self.run_request("k1", {"num_cards": 5}), (400, {"call": 1}, True))
+
+    def test_concurrent_retries_run_once(self):
+        started, release = threading.Event(), threading.Event()
+        results = []
+
+        def fn():
+            self.calls.append(1)
+            started.set()
+            release.wait(5)
+            return 201, {"id": 7}
+
+        def request():
+            results.append(idempotency.run_idempotent(self.user, "QuizGenerationView", "k1", {}, fn))
+
+        first = threading.Thread(target=request)
+        first.start()
+        started.wait(5)
+        retry = threading.Thread(target=request)
+        retry.start()
+        release.set()
+        first.join(5)
+        retry.join(5)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(sorted(replayed for _, _, replayed in results), [False, True])
+        self.assertTrue(all(data == {"id": 7} for _, data, _ in results))
+
+
+class IdempotencyKeyHeaderTests(TestCase):
+
+    def setUp(self):
+        cache.clear()  # Stored responses and rate limit buckets
+
+    def test_reused_key_with_different_body_is_422(self):
+        user = User.objects.create_user("retrier")
+        material = Material.objects.create(owner=user, title="Genetics")
+        client = APIClient()
+        client.force_authenticate(user)
+        url = f"/api/materials/{material.pk}/generate-flashcards/"
+        result = {"title": "Genes", "description": "", "flashcards": [{"question": "DNA?", "answer": "Code"}]}
+
+        with mock.patch("api.views.conversations.generate_flashcards_from_material", return_value=result) as generate:
+            first = client.post(url, {"num_cards": 5}, format="json", HTTP_IDEMPOTENCY_KEY="abc")
+            replay = client.post(url, {"num_cards": 5}, format="json", HTTP_IDEMPOTENCY_KEY="abc")
+            reused = client.post(url, {"num_cards": 6}, format="json", HTTP_IDEMPOTENCY_KEY="abc")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual(replay["Idempotent-Replayed"], "true")
+        self.assertEqual(replay.data, first.data)
+        self.assertEqual(reused.status_code, 422)
+        self.assertEqual(generate.call_count, 1)
+
+    def test_replay_does_not_spend_a_rate_limit_token(self):
+        user = User.objects.create_user("retrier")
+        material = Material.objects.create(owner=user, title="Genetics")
+        client = APIClient()
+        client.force_authenticate(user)
+        url = f"/api/materials/{material.pk}/generate-flashcards/"
+        results = (
+            {"title": f"Genes {n}", "description": "", "flashcards": [{"question": f"DNA {n}?", "answer": "Code"}]}
+            for n in range(10)
+        )
+
+        with mock.patch.object(GenerationRateThrottle, "THROTTLE_RATES", {"llm_generation": "2/hour"}), \
+                mock.patch("api.views.conversations.generate_flashcards_from_material", side_effect=results):
+            first = client.post(url, {"num_cards": 5}, format="json", HTTP_IDEMPOTENCY_KEY="abc")
+            replays = [
+                client.post(url, {"num_cards": 5}, format="json", HTTP_IDEMPOTENCY_KEY="abc")
+                for _ in range(3)
+            ]
+            second = client.post(url, {"num_cards": 5}, format="json", HTTP_IDEMPOTENCY_KEY="def")
+            third = client.post(url, {"num_cards": 5}, format="json")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual([replay.status_code for replay in replays], [201] * 3)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(third.status_code, 429)
+        self.assertIn("Retry-After", third)
+
+
+class ModelJSONTests(SimpleTestCase):
+
+    def test_loads_model_json(self):
+        cases = [
+            ("bare", '{"a": 1}', {"a": 1}),
+            ("fenced", '```json\n{"a": 1}\n```', {"a": 1}),
+            ("prose-wrapped", 'Here you go: {"a": [1, 2]} Hope it helps!', {"a": [1, 2]}),
+            ("prose with braces first", 'Use {curly} braces: {"a": 1}', {"a": 1}),
+            ("escaped quotes", '{"q": "Say \\"hi\\" {not a brace}"}', {"q": 'Say "hi" {not a brace}'}),
+            ("truncated array", '{"cards": [{"q": "1"}, {"q": "2"}, {"q": "3', {"cards": [{"q": "1"}, {"q": "2"}]}),
+            ("truncated nested", '```json\n{"a": {"b": [1, 2]}, "c": {"d": "e', {"a": {"b": [1, 2]}}),
+        ]
+        for name, text, expected in cases:
+            with self.subTest(name):
+                self.assertEqual(loads_model_json(text), expected)
+
+    def test_loads_model_json_rejects_unrecoverable(self):
+        for text in ["no json here", '{"a": "cut off', '{"a": 1,,}']:
+            with self.subTest(text):
+                with self.assertRaises(ValueError):
+                    loads_model_json(text)
+
+    def test_locate_and_recover(self):
+        self.assertEqual(locate_json('x {"a": "}"} y'), (2, 12))
+        self.assertEqual(locate_json('x {"a": 1'), (2, None))
+        self.assertIsNone(locate_json("nothing"))
+        self.assertEqual(recover_truncated('{"a": [1, [2]], "b": [3'), '{"a": [1, [2]]}')
+        self.assertIsNone(recover_truncated('{"a": 1'))
+
+    def test_flashcards_schema_drops_invalid_items(self):
+        text = '{"title": " Cells ", "flashcards": [{"question": "Q1", "answer": "A1"}, {"question": "", "answer": "A2"}]}'
+        parsed = parse_model_output(text, FLASHCARDS_SCHEMA)
+        self.assertEqual(parsed["title"], "Cells")
+        self.assertEqual(parsed["description"], "")
+        self.assertEqual(parsed["flashcards"], [{"question": "Q1", "answer": "A1"}])
+
+        with self.assertRaises(SchemaError):
+            parse_model_output('{"title": "Cells", "flashcards": [{"question": ""}]}', FLASHCARDS_SCHEMA)
+
+    def test_note_quiz_and_key_facts_schemas(self):
+        self.assertEqual(
+            parse_model_output('{"title": " Osmosis ", "content": " Water moves. "}', NOTE_SCHEMA),
+            {"title": "Osmosis", "description": "", "content": "Water moves."},
+        )
+        with self.assertRaises(SchemaError):
+            parse_model_output('{"title": "Osmosis"}', NOTE_SCHEMA)
+
+        # A question with a blank choice is dropped whole, not patched
+        quiz = parse_model_output(json.dumps({"title": "Cells", "questions": [
+            {"question_text": "Q1", "choices": ["A", ""], "correct_answer": "A"},
+            {"question_text": "Q2", "choices": ["X", "Y"], "correct_answer": "Y"},
+        ]}), QUIZ_SCHEMA)
+        self.assertEqual([q["question_text"] for q in quiz["questions"]], ["Q2"])
+
+        self.assertEqual(parse_model_output('{"facts": []}', KEY_FACTS_SCHEMA), {"facts": []})
+
+    def test_extract_json_from_response(self):
+        self.assertEqual(ai_service.extract_json_from_response('Sure! ```json\n{"a": 1}\n``` Bye'), '{"a": 1}')
+        self.assertEqual(ai_service.extract_json_from_response('cut {"a": [1'), '{"a": [1')
+        self.assertEqual(ai_service.extract_json_from_response(" no json "), "no json")
+
+    def test_quiz_correct_answer_resolution(self):
+        cases = [
+            ("letter", "B", "Mitochondria"),
+            ("exact", "Nucleus", "Nucleus"),
+            ("case-insensitive", "nucleus", "Nucleus"),
+            ("letter past the choices", "D", None),
+            ("not a choice", "Ribosome", None),
+        ]
+        for name, answer, expected in cases:
+            with self.subTest(name):
+                payload = json.dumps({"title": "Cells", "questions": [{
+                    "question_text": "Powerhouse?",
+                    "choices": ["Nucleus", "Mitochondria", "Golgi"],
+                    "correct_answer": answer,
+                }]})
+                if expected is None:
+                    with self.assertRaises(SchemaError):
+                        parse_model_output(payload, QUIZ_SCHEMA)
+                else:
+                    parsed = parse_model_output(payload, QUIZ_SCHEMA)
+                    self.assertEqual(parsed["questions"][0]["correct_answer"], expected)
+
+    def test_incremental_parser_chunk_boundaries(self):
+        text = ('```json\n{"title": "Br{ace} \\"quoted\\"", "flashcards": ['
+                '{"question": "a, b]", "answer": "}{"}, {"question": "\\\\", "answer": "x"}'
+                '], "description": "done"}\n```')
+        expected = [
+            ("field", ("title", 'Br{ace} "quoted"')),
+            ("item", {"question": "a, b]", "answer": "}{"}),
+            ("item", {"question": "\\", "answer": "x"}),
+            ("field", ("description", "done")),
+        ]
+        # Every chunk size splits some string (and escape) at a different point
+        for size in [1, 2, 3, 5, 7, 11, len(text)]:
+            with self.subTest(chunk_size=size):
+                parser = IncrementalJSONParser("flashcards")
+                events = []
+                for i in range(0, len(text), size):
+                    events.extend(parser.feed(text[i:i + size]))
+                self.assertEqual(events, expected)
+                self.assertTrue(parser.done)
+                self.assertEqual(parser.fields, {"title": 'Br{ace} "quoted"', "description": "done"})
+
+
+@override_settings(LLM_JSON_MODE=True)
+class JSONModeFallbackTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(ai_service, "_json_mode_unsupported", set())
+        self.unsupported = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def bad_request(message, param=None):
+        response = httpx.Response(400, request=httpx.Request("POST", "https://llm.test/chat/completions"))
+        return BadRequestError(message, response=response, body={"message": message, "param": param})
+
+    def call(self, error):
+        calls = []
+
+        def completion(task, **kwargs):
+            calls.append(kwargs)
+            if "response_format" in kwargs:
+                raise error
+            return "ok"
+
+        return ai_service._json_mode_call(completion, "notes", []), calls
+
+    def test_falls_back_when_json_mode_is_rejected(self):
+        for error in [
+            self.bad_request("Invalid value", param="response_format"),
+            self.bad_request("This model does not support response_format of type json_object"),
+        ]:
+            with self.subTest(str(error)):
+                self.unsupported.clear()
+                result, calls = self.call(error)
+                self.assertEqual(result, "ok")
+                self.assertEqual(len(calls), 2)
+                self.assertNotIn("response_format", calls[1])
+                self.assertIn(ai_service.GENERATION_MODEL, self.unsupported)
+
+    def test_other_bad_requests_are_raised(self):
+        error = self.bad_request("This model's maximum context length is 8192 tokens", param="messages")
+        with self.assertRaises(BadRequestError):
+            self.call(error)
+        self.assertEqual(self.unsupported, set())
+
+
+class StubLLMClient:
+    """Stands in for ai_service.client: answers key_facts prompts from the excerpt."""
+
+    def __init__(self, facts_for):
+        self.facts_for = facts_for
+        self.excerpts = []
+        self.running = self.max_running = 0
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, **kwargs):
+        excerpt = messages[0]["content"].split('Excerpt:\n"""\n', 1)[1].rsplit('\n"""', 1)[0]
+        with self.lock:
+            self.excerpts.append(excerpt)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(0.005)
+            content = json.dumps({"facts": self.facts_for(excerpt)})
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+@override_settings(
+    LLM_JSON_MODE=False,
+    MAP_REDUCE_THRESHOLD_CHARS=1000,
+    MAP_REDUCE_CHUNK_CHARS=200,
+    MAP_REDUCE_MAX_CHUNKS=3,
+    MAP_REDUCE_MAX_WORKERS=2,
+)
+class CondenseMaterialTests(SimpleTestCase):
+
+    # 60 paragraphs of ~150 characters, every word unique
+    TEXT = "\n\n".join(
+        f"Topic{i}: " + " ".join(f"w{i}x{j}" for j in range(24)) for i in range(60)
+    )
+
+    @staticmethod
+    def lines(excerpt):
+        return [
+            line.removeprefix("- ") for line in excerpt.splitlines()
+            if line.strip() and not line.startswith("Key facts extracted")
+        ]
+
+    def condense(self, facts_for):
+        stub = StubLLMClient(facts_for)
+        with mock.patch.object(ai_service, "client", stub):
+            return ai_service._condense_material(self.TEXT), stub
+
+    def test_chunks_fit_one_prompt_and_run_in_bounded_passes(self):
+        condensed, stub = self.condense(lambda excerpt: [line.split(":")[0] for line in self.lines(excerpt)])
+
+        self.assertEqual(len(stub.excerpts), 60)
+        self.assertTrue(all(len(excerpt) <= 200 for excerpt in stub.excerpts))
+        self.assertLessEqual(stub.max_running, 2)
+        self.assertEqual(
+            condensed.splitlines(),
+            ["Key facts extracted from a long document, in order:"] + [f"- Topic{i}" for i in range(60)],
+        )
+
+    def test_long_digests_are_condensed_again(self):
+        # Every fact keeps half of its line, so one round is not enough
+        condensed, stub = self.condense(lambda excerpt: [line[:len(line) // 2] for line in self.lines(excerpt)])
+
+        self.assertLessEqual(len(condensed), 1000)
+        self.assertGreater(len(stub.excerpts), 60)
+        self.assertTrue(all(len(excerpt) <= 200 for excerpt in stub.excerpts))
+        self.assertEqual(re.findall(r"Topic\d+", condensed), [f"Topic{i}" for i in range(60)])
+
+    def test_failed_chunks_are_skipped(self):
+        def facts_for(excerpt):
+            if "Topic7:" in excerpt:
+                raise ValueError("model overloaded")
+            return [line.split(":")[0] for line in self.lines(excerpt)]
+
+        condensed, _ = self.condense(facts_for)
+
+        self.assertNotIn("- Topic7\n", condensed)
+        self.assertIn("- Topic8", condensed)
+
+
+class ConversationTransferTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("exporter")
+        self.source = Material.objects.create(owner=self.user, title="Cell Biology")
+        self.target = Material.objects.create(owner=self.user, title="Cell Biology (imported)")
+        self.messages = [
+            {
+                "role": "assistant" if i % 2 else "user",
+                "content": f"Message {i} about mitochondria",
+                "timestamp": f"2026-01-01T00:00:{i % 60:02d}",
+            }
+            for i in range(conversation_transfer.BATCH_SIZE * 2 + 50)
+        ]
+        self.conv = AIConversation.objects.create(
+            user=self.user, material=self.source, messages=self.messages, summary_context="Mitochondria basics."
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, fmt):
+        response = self.client.get(f"/api/conversations/{self.conv.pk}/export/?format={fmt}")
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def import_body(self, body, material):
+        return self.client.post(
+            f"/api/conversations/import/?material={material.pk}", data=body, content_type="application/x-ndjson"
+        )
+
+    def test_round_trip_over_several_batches(self):
+        body = self.export("ndjson")
+        header = json.loads(body.splitlines()[0])
+        self.assertEqual(header["message_count"], len(self.messages))
+
+        response = self.import_body(body, self.target)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["messages_imported"], len(self.messages))
+        imported = AIConversation.objects.get(pk=response.data["id"])
+        self.assertEqual(imported.material, self.target)
+        self.assertEqual(imported.messages, self.messages)
+        self.assertEqual(imported.summary_context, "Mitochondria basics.")
+
+    def test_markdown_export(self):
+        body = self.export("md").decode()
+
+        self.assertTrue(body.startswith("# Conversation: Cell Biology\n\n> **Summary:** Mitochondria basics.\n"))
+        self.assertIn("### You — 2026-01-01T00:00:00\n\nMessage 0 about mitochondria\n", body)
+        self.assertIn("### Tutor — 2026-01-01T00:00:01\n\nMessage 1 about mitochondria\n", body)
+        self.assertEqual(body.count("### "), len(self.messages))
+
+    def test_import_into_material_with_a_conversation_is_409(self):
+        response = self.import_body(self.export("ndjson"), self.source)
+
+        self.assertEqual(response.status_code, 409)
+
+    def test_export_and_import_query_counts_do_not_grow_with_batches(self):
+        with CaptureQueriesContext(connection) as export_queries:
+            exported = list(conversation_transfer.iter_messages(self.conv.pk, batch_size=50))
+        with CaptureQueriesContext(connection) as import_queries:
+            response = self.import_body(self.export("ndjson"), self.target)
+
+        self.assertEqual(exported, self.messages)
+        self.assertEqual(len(export_queries), 1)
+        self.assertEqual(response.status_code, 201)
+        # The array and the derived fields, each written once
+        self.assertEqual(sum(query["sql"].startswith("UPDATE") for query in import_queries), 2)
+
+    def test_import_losing_a_race_for_the_material_is_409(self):
+        # Another import creates the material's conversation after the view's check
+        with mock.patch("django.db.models.query.QuerySet.exists", return_value=False):
+            response = self.import_body(self.export("ndjson"), self.source)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(AIConversation.objects.count(), 1)
+
+    def test_bad_line_rolls_back_the_import(self):
+        lines = self.export("ndjson").splitlines()
+        body = b"\n".join(lines[:conversation_transfer.BATCH_SIZE + 10] + [b'{"type": "message", "role": "robot"}'])
+
+        response = self.import_body(body, self.target)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("role must be one of", response.data["error"])
+        self.assertEqual(AIConversation.objects.count(), 1)
+
+    @override_settings(CONVERSATION_IMPORT_MAX_LINE_BYTES=100)
+    def test_long_line_is_rejected_after_a_bounded_read(self):
+        line = json.dumps({"type": "message", "role": "user", "content": "x" * 1000}).encode()
+        stream = io.BytesIO(b'{"type": "message", "role": "user", "content": "hi"}\n' + line + b"\n")
+
+        with self.assertRaisesMessage(conversation_transfer.ConversationImportError, "Line 2: longer than 100 bytes"):
+            conversation_transfer.import_ndjson(stream, self.user, self.target)
+
+        self.assertLess(stream.tell(), 200)
+        self.assertEqual(self.import_body(line, self.target).status_code, 400)
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("searcher")
+        self.other = User.objects.create_user("neighbour")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mine = Material.objects.create(owner=self.user, title="Plant biology")
+            self.public = Material.objects.create(owner=self.other, title="Shared notes", public=True)
+            self.private = Material.objects.create(owner=self.other, title="Diary")
+            self.trashed = Material.objects.create(owner=self.user, title="Old stuff", status="trash")
+            self.title_match = Note.objects.create(material=self.mine, title="Photosynthesis", content="Light")
+            self.body_match = Note.objects.create(
+                material=self.public, title="Leaves", content="Leaves run photosynthesis in chloroplasts"
+            )
+            Note.objects.create(material=self.private, title="Photosynthesis secrets", content="Private")
+            Note.objects.create(material=self.trashed, title="Photosynthesis draft", content="Trashed")
+
+    def ids(self, text, **kwargs):
+        return [(result["kind"], result["id"]) for result in search(self.user, text, **kwargs)]
+
+    def test_own_and_public_materials_ranked_title_first(self):
+        self.assertEqual(self.ids("photosynthesis"), [("note", self.title_match.pk), ("note", self.body_match.pk)])
+
+    def test_prefix_and_kind_filter(self):
+        self.assertEqual(self.ids("photosynth"), [("note", self.title_match.pk), ("note", self.body_match.pk)])
+        self.assertEqual(self.ids("plant", kinds=["material"]), [("material", self.mine.pk)])
+        self.assertEqual(self.ids("plant", kinds=["note"]), [])
+
+    def test_snippet_is_escaped_html(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Note.objects.create(
+                material=self.public, title="Payload", content='<img src=x onerror="alert(1)"> stomata & guard cells'
+            )
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get("/api/search/", {"q": "stomata"})
+
+        snippet = response.data["results"][0]["snippet"]
+        self.assertNotIn("<img", snippet)
+        self.assertIn("&lt;img src=x onerror=&quot;alert(1)&quot;&gt;", snippet)
+        self.assertIn("<mark>stomata</mark> &amp; guard", snippet)
+
+    def test_entries_follow_edits_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.title_match.title = "Respiration"
+            self.title_match.save()
+        self.assertEqual(self.ids("respiration"), [("note", self.title_match.pk)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.title_match.delete()
+        self.assertEqual(self.ids("respiration"), [])
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_set_is_indexed_in_bulk_on_commit(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        body = {
+            "material": self.mine.pk,
+            "title": "Terms",
+            "flashcards": [{"question": f"Chlorophyll {i}?", "answer": "Pigment"} for i in range(20)],
+        }
+
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = client.post("/api/flashcard-sets/", body, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertLess(len(queries), 45)
+        self.assertEqual(SearchEntry.objects.filter(kind="flashcard").count(), 20)
+        self.assertEqual(len(self.ids("chlorophyll", kinds=["flashcard"], limit=50)), 20)
+
+
+class AttachmentSearchTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("reader")
+        other = User.objects.create_user("writer")
+        self.mine = Material.objects.create(owner=self.user, title="Cells")
+        self.public = Material.objects.create(owner=other, title="Public cells", public=True)
+        self.private = Material.objects.create(owner=other, title="Private cells")
+        self.pages = {}
+        for material, page, body in [
+            (self.mine, 1, "The <b>nucleus</b> stores DNA. " + "Filler text about cells. " * 20 + "Mitochondria too."),
+            (self.mine, 2, "Mitochondria: mitochondria make ATP"),
+            (self.public, 1, "Mitochondria have their own DNA"),
+            (self.private, 1, "Mitochondria secrets"),
+        ]:
+            attachment = Attachment.objects.create(material=material, file=f"attachments/{material.pk}.pdf")
+            SearchEntry.objects.create(kind="attachment_page", object_id=attachment.pk, page=page,
+                                       material=material, title=f"{material.pk}.pdf", body=body)
+            self.pages[(material.pk, page)] = attachment.pk
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_ranked_within_visible_materials(self):
+        response = self.client.get("/api/search/attachments/", {"q": "mitochondria"})
+
+        self.assertEqual(response.status_code, 200)
+        found = [(result["material"], result["page"]) for result in response.data["results"]]
+        self.assertEqual(found[0], (self.mine.pk, 2))
+        self.assertEqual(set(found), {(self.mine.pk, 1), (self.mine.pk, 2), (self.public.pk, 1)})
+        self.assertEqual(response.data["results"][0]["attachment"], self.pages[(self.mine.pk, 2)])
+
+    def test_page_text_is_escaped(self):
+        response = self.client.get("/api/search/attachments/", {"q": "nucleus"})
+
+        snippet = response.data["results"][0]["snippet"]
+        self.assertIn("&lt;b&gt;<mark>nucleus</mark>&lt;/b&gt;", snippet)
+
+
+@override_settings(MATERIAL_CONTEXT_CHUNKS=2, MATERIAL_CONTEXT_CHUNK_CHARS=1000, MATERIAL_CONTEXT_MIN_SCORE=0.5)
+class MaterialRetrievalTests(TestCase):
+
+    def setUp(self):
+        owner = User.objects.create_user("learner")
+        self.material = Material.objects.create(owner=owner, title="Biology")
+        other = Material.objects.create(owner=owner, title="Chemistry")
+        for material, attachment, page, body in [
+            (self.material, 1, 1, "Cells divide by mitosis. The cell cycle has four phases."),
+            (self.material, 1, 2, "Photosynthesis happens in chloroplasts. Chloroplasts absorb light "
+                                  "and chlorophyll absorbs red and blue light for photosynthesis."),
+            (self.material, 2, 1, "Leaves are green because chlorophyll reflects green light."),
+            (other, 3, 1, "Chlorophyll absorbs light: a chemistry view of photosynthesis and chloroplasts."),
+        ]:
+            SearchEntry.objects.create(kind="attachment_page", object_id=attachment, page=page,
+                                       material=material, title=f"file{attachment}.pdf", body=body)
+
+    def test_best_matching_pages_of_the_material_are_retrieved(self):
+        chunks, status = relevant_chunks(self.material, "How do chloroplasts absorb light in photosynthesis?")
+
+        self.assertEqual(status, "retrieved")
+        # file2 only mentions "light", one term of four; the Chemistry page belongs to another material
+        self.assertEqual([label for label, _ in chunks], ["file1.pdf, page 2"])
+
+    def test_best_match_wins_when_only_one_fits(self):
+        with override_settings(MATERIAL_CONTEXT_CHUNKS=1):
+            chunks, _ = relevant_chunks(self.material, "Which light does chlorophyll absorb?")
+
+        self.assertEqual([label for label, _ in chunks], ["file1.pdf, page 2"])
+
+    def test_unrelated_question_is_skipped(self):
+        self.assertEqual(relevant_chunks(self.material, "Who won the 1998 world cup final?"), ([], "skipped"))
+        # Matching one word of four is not enough either
+        self.assertEqual(relevant_chunks(self.material, "Who painted green cathedral ceilings?"), ([], "skipped"))
+
+    def test_explicit_question_falls_back_to_the_beginning(self):
+        chunks, status = relevant_chunks(self.material, "Summarize the uploaded file", explicit=True)
+
+        self.assertEqual(status, "explicit")
+        self.assertEqual([label for label, _ in chunks], ["file1.pdf, page 1", "file1.pdf, page 2"])
+
+    def test_material_without_pages_is_unindexed(self):
+        empty = Material.objects.create(owner=self.material.owner, title="Empty")
+
+        self.assertEqual(relevant_chunks(empty, "photosynthesis"), ([], "unindexed"))
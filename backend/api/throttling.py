@@ -0,0 +1,186 @@
+"""
+Fair sharing of the LLM-backed endpoints.
+
+- TokenBucketThrottle: per-user token bucket per endpoint family, with the
+  bucket state in the Django cache so every worker sees the same budget.
+  A rate of "20/min" means bursts of up to 20 requests, refilled
+  continuously at 20 tokens per minute.
+- LLMConcurrencyLimitMixin: caps how many LLM requests one user can have
+  running at the same time (LLM_MAX_INFLIGHT_PER_USER).
+
+Both reject with 429 and a `Retry-After` header. Handlers marked
+`defers_throttling` (idempotent replays) only spend a token once they run.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import SimpleRateThrottle
+
+logger = logging.getLogger(__name__)
+
+LOCK_TIMEOUT = 2
+LOCK_ATTEMPTS = 20
+
+
+@contextmanager
+def _cache_lock(key):
+    """
+    Best-effort mutex around a read-modify-write of `key`, built on the atomic
+    cache.add(). If the lock cannot be taken quickly we go ahead anyway:
+    a slightly off bucket is better than a stalled request.
+    """
+    lock_key = f"{key}:lock"
+    acquired = False
+    for _ in range(LOCK_ATTEMPTS):
+        acquired = cache.add(lock_key, 1, LOCK_TIMEOUT)
+        if acquired:
+            break
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        if acquired:
+            cache.delete(lock_key)
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Token bucket throttle. Rates come from DEFAULT_THROTTLE_RATES[scope] in
+    the usual DRF "<requests>/<period>" format: <requests> is the bucket size
+    (burst) and the bucket refills at <requests> per <period>.
+    """
+    cache = cache
+    cache_format = "throttle:bucket:%(scope)s:%(ident)s"
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {"scope": self.scope, "ident": ident}
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        capacity = self.num_requests
+        refill_rate = capacity / self.duration  # tokens per second
+        self._wait = 0
+
+        with _cache_lock(self.key):
+            now = self.timer()
+            tokens, updated = self.cache.get(self.key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+
+            if tokens < 1:
+                self._wait = (1 - tokens) / refill_rate
+                return False
+
+            self.cache.set(self.key, (tokens - 1, now), self.duration)
+        return True
+
+    def wait(self):
+        return self._wait
+
+
+class ChatRateThrottle(TokenBucketThrottle):
+    scope = "llm_chat"
+
+
+class GenerationRateThrottle(TokenBucketThrottle):
+    scope = "llm_generation"
+
+
+# ===== IN-FLIGHT CAP =====
+
+def _inflight_key(user):
+    return f"llm:inflight:{user.pk}"
+
+
+def acquire_llm_slot(user):
+    """
+    Count one more running LLM request for `user`, or raise Throttled when
+    they already have LLM_MAX_INFLIGHT_PER_USER running. Returns the counter key.
+    """
+    key = _inflight_key(user)
+    # The timeout only matters if a worker dies before releasing its slot
+    cache.add(key, 0, settings.LLM_INFLIGHT_TIMEOUT)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.set(key, 1, settings.LLM_INFLIGHT_TIMEOUT)
+        count = 1
+
+    if count > settings.LLM_MAX_INFLIGHT_PER_USER:
+        release_llm_slot(key)
+        logger.info("User %s hit the in-flight LLM request limit (%s)", user.pk, count - 1)
+        raise Throttled(
+            wait=settings.LLM_INFLIGHT_RETRY_AFTER,
+            detail="You already have AI requests in progress. Please wait for them to finish.",
+        )
+    return key
+
+
+def release_llm_slot(key):
+    try:
+        cache.decr(key)
+    except ValueError:
+        # Counter already expired
+        pass
+
+
+class LLMConcurrencyLimitMixin:
+    """
+    Hold one of the user's in-flight LLM slots while the view runs. The slot
+    is taken after authentication and throttling, and released even if the
+    view raises.
+
+    Handlers marked `defers_llm_slot` (see coalesce_duplicates and
+    idempotent in api/views/mixins.py) call acquire_llm_slot() themselves
+    once they really run, so requests waiting for an identical in-flight
+    request, or replaying a stored response, don't hold a slot. Likewise,
+    handlers marked `defers_throttling` call check_deferred_throttles()
+    once they really run, so a replay doesn't spend a rate limit token.
+    """
+
+    _llm_slot = None
+    _throttles_deferred = False
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self._llm_slot is not None:
+                release_llm_slot(self._llm_slot)
+                self._llm_slot = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        handler = getattr(self, request.method.lower(), None)
+        if not getattr(handler, "defers_llm_slot", False):
+            self.acquire_llm_slot()
+
+    def check_throttles(self, request):
+        handler = getattr(self, request.method.lower(), None)
+        if getattr(handler, "defers_throttling", False):
+            self._throttles_deferred = True
+            return
+        super().check_throttles(request)
+
+    def check_deferred_throttles(self):
+        if self._throttles_deferred:
+            self._throttles_deferred = False
+            super().check_throttles(self.request)
+
+    def acquire_llm_slot(self):
+        if self._llm_slot is None:
+            self._llm_slot = acquire_llm_slot(self.request.user)
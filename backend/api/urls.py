@@ -18,9 +18,18 @@ from .views import (
     GetOrCreateConversationView,
     ConversationDeleteView,
     ConversationSummaryView,
+    ConversationExportView,
+    ConversationImportView,
     NoteGenerationView,
     FlashcardGenerationView,
     QuizGenerationView,
+    GenerateAllView,
+    FlashcardStreamView,
+    QuizStreamView,
+    SearchView,
+    AttachmentSearchView,
+    SlowEndpointsView,
+    ProfilingToggleView,
 )
 
 app_name = "api"
@@ -73,6 +82,16 @@ urlpatterns = [
         ConversationDeleteView.as_view(),
         name="conversation-delete"
     ),
+    path(
+        "conversations/<int:pk>/export/",
+        ConversationExportView.as_view(),
+        name="conversation-export"
+    ),
+    path(
+        "conversations/import/",
+        ConversationImportView.as_view(),
+        name="conversation-import"
+    ),
 
     # 3) AI-powered generation endpoints (now with smart context)
     path(
@@ -90,6 +109,22 @@ urlpatterns = [
         QuizGenerationView.as_view(),
         name="generate-quiz"
     ),
+    path(
+        "materials/<int:material_id>/generate-all/",
+        GenerateAllView.as_view(),
+        name="generate-all"
+    ),
+    # Server-Sent Events: cards/questions are sent (and saved) as they are generated
+    path(
+        "materials/<int:material_id>/generate-flashcards/stream/",
+        FlashcardStreamView.as_view(),
+        name="generate-flashcards-stream"
+    ),
+    path(
+        "materials/<int:material_id>/generate-quiz/stream/",
+        QuizStreamView.as_view(),
+        name="generate-quiz-stream"
+    ),
 
     # 4) Copy material
     path(
@@ -105,6 +140,30 @@ urlpatterns = [
         name="material-conversation"
     ),
 
-    # 5) CRUD routes from router
+    # 5) Full-text search
+    path(
+        "search/",
+        SearchView.as_view(),
+        name="search"
+    ),
+    path(
+        "search/attachments/",
+        AttachmentSearchView.as_view(),
+        name="search-attachments"
+    ),
+
+    # Admin-only request timings
+    path(
+        "admin/slow-endpoints/",
+        SlowEndpointsView.as_view(),
+        name="slow-endpoints"
+    ),
+    path(
+        "admin/profiling/",
+        ProfilingToggleView.as_view(),
+        name="profiling-toggle"
+    ),
+
+    # 6) CRUD routes from router
     path("", include(router.urls)),
 ]
\ No newline at end of file
@@ -9,14 +9,20 @@ from .conversations import (
     FlashcardGenerationView,
     NoteGenerationView,
     QuizGenerationView,
+    GenerateAllView,
 )
 
+from .streaming import FlashcardStreamView, QuizStreamView
+from .conversation_transfer import ConversationExportView, ConversationImportView
+
 from .material import MaterialViewSet
 from .note import NoteViewSet
 from .flashcard import FlashcardSetViewSet, FlashcardViewSet 
 from .attachment import AttachmentUploadView, AttachmentViewSet
 from .quiz import QuizViewSet, QuizQuestionViewSet
 from .copy_material import CopyMaterialView
+from .search import SearchView, AttachmentSearchView
+from .instrumentation import SlowEndpointsView, ProfilingToggleView
 
 
 __all__ = [
@@ -28,11 +34,16 @@ __all__ = [
     "ConversationListView",
     "ConversationDeleteView", 
     "ConversationSummaryView",
+    "ConversationExportView",
+    "ConversationImportView",
     
     # Generation views
     "FlashcardGenerationView",
     "NoteGenerationView", 
     "QuizGenerationView",
+    "GenerateAllView",
+    "FlashcardStreamView",
+    "QuizStreamView",
     
     # Material views
     "MaterialViewSet",
@@ -48,4 +59,12 @@ __all__ = [
     # Attachment views
     "AttachmentUploadView",
     "AttachmentViewSet",
+
+    # Search views
+    "SearchView",
+    "AttachmentSearchView",
+
+    # Instrumentation views
+    "SlowEndpointsView",
+    "ProfilingToggleView",
 ]
\ No newline at end of file
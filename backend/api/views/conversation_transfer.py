@@ -0,0 +1,106 @@
+import json
+
+from django.db import IntegrityError
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.text import slugify
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .imports import APIView, IsAuthenticated, PermissionDenied, Response, status
+from ..models import AIConversation, Material
+from api.services.conversation_transfer import (
+    ConversationImportError,
+    export_markdown,
+    export_ndjson,
+    import_ndjson,
+)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Lets clients ask for `?format=ndjson`; errors are rendered as one JSON line."""
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps(data) + "\n").encode(self.charset)
+
+
+class MarkdownRenderer(BaseRenderer):
+    """Lets clients ask for `?format=md`; errors are rendered as plain text."""
+    media_type = "text/markdown"
+    format = "md"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        detail = data.get("detail", data) if isinstance(data, dict) else data
+        return f"{detail}\n".encode(self.charset)
+
+
+# ===== CONVERSATION EXPORT / IMPORT VIEWS =====
+
+class ConversationExportView(APIView):
+    """
+    GET /api/conversations/{pk}/export/?format=ndjson|md
+    Streams the conversation as NDJSON (default) or Markdown, reading the
+    messages in batches so long conversations are never loaded at once.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [NDJSONRenderer, MarkdownRenderer, JSONRenderer]
+
+    def get(self, request, pk=None):
+        conv = get_object_or_404(AIConversation.objects.select_related("material"), pk=pk)
+        if conv.user != request.user:
+            raise PermissionDenied("You do not have permission to export this conversation.")
+
+        if request.accepted_renderer.format == "md":
+            content, content_type, extension = export_markdown(conv), "text/markdown", "md"
+        else:
+            content, content_type, extension = export_ndjson(conv), "application/x-ndjson", "ndjson"
+
+        name = slugify(conv.material.title) if conv.material else ""
+        response = StreamingHttpResponse(content, content_type=f"{content_type}; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="conversation-{name or conv.pk}.{extension}"'
+        return response
+
+
+class ConversationImportView(APIView):
+    """
+    POST /api/conversations/import/?material=<id>
+    Body: NDJSON as produced by the export (header line optional), e.g.
+      {"type": "message", "role": "user", "content": "...", "timestamp": "..."}
+    Creates a new conversation (on the material, if given) and returns
+    {"id", "messages_imported"}. The body is read one bounded line at a
+    time and the messages array written in one UPDATE at the end.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        material = None
+        material_id = request.query_params.get("material")
+        if material_id:
+            material = get_object_or_404(Material, id=material_id)
+            if material.owner != request.user:
+                return Response(
+                    {"error": "You don't have permission to import a conversation into this material."},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            if AIConversation.objects.filter(user=request.user, material=material).exists():
+                return Response(
+                    {"error": "This material already has a conversation. Delete it before importing."},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+        # ✅ Read the raw body one bounded line at a time (request.data would load it all)
+        try:
+            pk, count = import_ndjson(request._request, request.user, material)
+        except ConversationImportError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError:
+            # A concurrent import (or chat) created the material's conversation after the check above
+            return Response(
+                {"error": "This material already has a conversation. Delete it before importing."},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        return Response({"id": pk, "messages_imported": count}, status=status.HTTP_201_CREATED)
@@ -1,6 +1,7 @@
+import logging
+
 from .imports import generics, status, Response, IsAuthenticatedOrReadOnly, APIView, serializers
 from django.shortcuts import get_object_or_404
-from django.utils import timezone
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.exceptions import PermissionDenied
 
@@ -15,16 +16,25 @@ from ..serializers import (
     FlashcardGenerationSerializer,
     NoteGenerationSerializer,
     QuizGenerationSerializer,
+    GenerateAllSerializer,
 )
+from RataTutor.utils.profiling import span
+from .mixins import ProfiledViewMixin, coalesce_duplicates, idempotent
+from ..throttling import ChatRateThrottle, GenerationRateThrottle, LLMConcurrencyLimitMixin
+from api.services import answer_cache
 from api.services.ai_service import (
     generate_ai_response_with_context,
     generate_ai_response,
+    generate_standalone_answer,
     update_conversation_summary,
     generate_flashcards_from_material,
     generate_notes_from_material,
     generate_quiz_from_material,
+    generate_all_from_material,
 )
 
+logger = logging.getLogger(__name__)
+
 # ===== CONVERSATION VIEWS =====
 
 class CreateConversationView(generics.CreateAPIView):
@@ -43,7 +53,7 @@ class CreateConversationView(generics.CreateAPIView):
         serializer.save(user=self.request.user)
 
 
-class ConversationChatView(generics.GenericAPIView):
+class ConversationChatView(ProfiledViewMixin, LLMConcurrencyLimitMixin, generics.GenericAPIView):
     """
     POST /api/conversations/{pk}/chat/
     {
@@ -53,7 +63,9 @@ class ConversationChatView(generics.GenericAPIView):
     queryset = AIConversation.objects.all()
     serializer_class = AIConversationSerializer
     permission_classes = [IsAuthenticated]
+    throttle_classes = [ChatRateThrottle]
 
+    @idempotent
     def post(self, request, pk=None):
         conv = get_object_or_404(AIConversation, pk=pk)
 
@@ -66,23 +78,41 @@ class ConversationChatView(generics.GenericAPIView):
             return Response({"error": "Missing prompt"}, status=status.HTTP_400_BAD_REQUEST)
 
         # 1) Save the user's message
-        conv.last_user_message = prompt
-        conv.addToMessage()
+        with span("db_write"):
+            conv.last_user_message = prompt
+            conv.addToMessage()
+
+        # ✅ Opt-in answer cache: a standalone question already answered for
+        # the same attachments is served without any LLM call (summary included).
+        # Cached answers are shared across users, so they are generated from
+        # the material and the question only, never from this conversation.
+        answer_key = answer_cache.cache_key_for(conv.material, prompt)
+        cached_reply = answer_cache.lookup(answer_key, prompt) if answer_key else None
 
         # ✅ 2) Smart summary management - update if needed
-        summary_updated = update_conversation_summary(conv)
-        if summary_updated:
-            print(f"📝 Updated conversation summary for conversation {conv.id}")
+        if cached_reply is None:
+            with span("summary"):
+                summary_updated = update_conversation_summary(conv)
+            if summary_updated:
+                logger.debug("Updated conversation summary for conversation %s", conv.id)
 
         # ✅ 3) Get AI reply using smart context management
         try:
-            ai_reply = generate_ai_response_with_context(conv, prompt)
+            if cached_reply is not None:
+                ai_reply = cached_reply
+            elif answer_key:
+                with span("generate"):
+                    ai_reply = generate_standalone_answer(conv.material, prompt)
+                answer_cache.store(answer_key, prompt, ai_reply)
+            else:
+                with span("generate"):
+                    ai_reply = generate_ai_response_with_context(conv, prompt)
         except Exception as e:
             # ✅ Fallback to legacy method if smart context fails
-            print(f"⚠️ Smart context failed, falling back to legacy: {e}")
+            logger.warning("Smart context failed for conversation %s, falling back to legacy: %s", conv.id, e)
             try:
                 material = conv.material
-                if material and material.attachments.exists():
+                if material and conv.material_has_attachments:
                     from api.services.ai_service import generate_ai_response_for_material
                     ai_reply = generate_ai_response_for_material(material, prompt)
                 else:
@@ -94,28 +124,20 @@ class ConversationChatView(generics.GenericAPIView):
                 )
 
         # 4) Append AI reply to conversation
-        assistant_msg = {
-            "role": "assistant",
-            "content": ai_reply,
-            "timestamp": timezone.now().isoformat()
-        }
-        msgs = conv.messages if isinstance(conv.messages, list) else []
-        msgs.append(assistant_msg)
-        conv.messages = msgs
-        
-        # ✅ Keep legacy context for backward compatibility + track messages
-        conv.context += f"\n assistant: {assistant_msg['content']}"
-        conv.messages_since_summary += 1
-        
-        conv.save()
+        # ✅ Also updates the cached topic / complexity score
+        conv.add_assistant_message(ai_reply)
+
+        with span("db_write"):
+            conv.save(update_fields=AIConversation.CHAT_TURN_FIELDS)
 
         # ✅ 5) Enhanced response with context info
         response_data = {
             "user_message": prompt,
             "ai_response": ai_reply,
             "messages": conv.messages,
-            "conversation_topic": conv.detect_conversation_topic(),
+            "conversation_topic": conv.topic,
             "messages_since_summary": conv.messages_since_summary,
+            "cached_answer": cached_reply is not None,
         }
         
         # Include summary info if available (useful for debugging)
@@ -143,7 +165,7 @@ class RetrieveConversationView(generics.RetrieveAPIView):
 
 # ===== GENERATION VIEWS =====
 
-class FlashcardGenerationView(APIView):
+class FlashcardGenerationView(ProfiledViewMixin, LLMConcurrencyLimitMixin, APIView):
     """
     POST /api/materials/{material_id}/generate-flashcards/
     {
@@ -152,7 +174,10 @@ class FlashcardGenerationView(APIView):
     }
     """
     permission_classes = [IsAuthenticated]
+    throttle_classes = [GenerationRateThrottle]
 
+    @idempotent
+    @coalesce_duplicates
     def post(self, request, material_id=None):
         # Get material and check ownership
         material = get_object_or_404(Material, id=material_id)
@@ -169,14 +194,13 @@ class FlashcardGenerationView(APIView):
         
         # ✅ Get specific attachments if provided
         specific_attachments = request.data.get('specific_attachments', None)
-        if specific_attachments:
-            print(f"🎯 Generating flashcards from {len(specific_attachments)} specific attachments")
-        else:
-            print(f"📁 Generating flashcards from all attachments in material")
+        logger.debug("Generating flashcards for material %s from %s", material.pk,
+                     f"{len(specific_attachments)} specific attachments" if specific_attachments else "all attachments")
 
         try:
             # ✅ Generate flashcards from AI
-            result = generate_flashcards_from_material(material, num_cards, specific_attachments)
+            with span("generate"):
+                result = generate_flashcards_from_material(material, num_cards, specific_attachments)
         except Exception as e:
             return Response(
                 {"detail": f"Flashcard generation failed: {str(e)}"},
@@ -203,7 +227,8 @@ class FlashcardGenerationView(APIView):
                 context={"request": request}
             )
             serializer.is_valid(raise_exception=True)
-            flashcard_set = serializer.save()
+            with span("db_write"):
+                flashcard_set = serializer.save()
 
             return Response(
                 FlashcardSetSerializer(flashcard_set, context={"request": request}).data, 
@@ -223,7 +248,7 @@ class FlashcardGenerationView(APIView):
             )
 
 
-class NoteGenerationView(APIView):
+class NoteGenerationView(ProfiledViewMixin, LLMConcurrencyLimitMixin, APIView):
     """
     POST /api/materials/{material_id}/generate-notes/
     {
@@ -231,7 +256,10 @@ class NoteGenerationView(APIView):
     }
     """
     permission_classes = [IsAuthenticated]
+    throttle_classes = [GenerationRateThrottle]
 
+    @idempotent
+    @coalesce_duplicates
     def post(self, request, material_id=None):
         # Get material and check ownership
         material = get_object_or_404(Material, id=material_id)
@@ -243,14 +271,13 @@ class NoteGenerationView(APIView):
 
         # ✅ Get specific attachments if provided
         specific_attachments = request.data.get('specific_attachments', None)
-        if specific_attachments:
-            print(f"🎯 Generating comprehensive note from {len(specific_attachments)} specific attachments")
-        else:
-            print(f"📁 Generating comprehensive note from all attachments in material")
+        logger.debug("Generating note for material %s from %s", material.pk,
+                     f"{len(specific_attachments)} specific attachments" if specific_attachments else "all attachments")
 
         try:
             # ✅ Generate notes from AI
-            result = generate_notes_from_material(material, specific_attachments)
+            with span("generate"):
+                result = generate_notes_from_material(material, specific_attachments)
         except Exception as e:
             return Response(
                 {"detail": f"Note generation failed: {str(e)}"},
@@ -277,7 +304,8 @@ class NoteGenerationView(APIView):
                 context={"request": request}
             )
             serializer.is_valid(raise_exception=True)
-            note_obj = serializer.save()
+            with span("db_write"):
+                note_obj = serializer.save()
             
             # Return single note object (not an array)
             return Response(NoteSerializer(note_obj, context={"request": request}).data, status=status.HTTP_201_CREATED)
@@ -295,7 +323,7 @@ class NoteGenerationView(APIView):
             )
 
 
-class QuizGenerationView(APIView):
+class QuizGenerationView(ProfiledViewMixin, LLMConcurrencyLimitMixin, APIView):
     """
     POST /api/materials/{material_id}/generate-quiz/
     {
@@ -304,7 +332,10 @@ class QuizGenerationView(APIView):
     }
     """
     permission_classes = [IsAuthenticated]
+    throttle_classes = [GenerationRateThrottle]
 
+    @idempotent
+    @coalesce_duplicates
     def post(self, request, material_id=None):
         # Get material and check ownership
         material = get_object_or_404(Material, id=material_id)
@@ -321,14 +352,13 @@ class QuizGenerationView(APIView):
         
         # ✅ Get specific attachments if provided
         specific_attachments = request.data.get('specific_attachments', None)
-        if specific_attachments:
-            print(f"🎯 Generating quiz from {len(specific_attachments)} specific attachments")
-        else:
-            print(f"📁 Generating quiz from all attachments in material")
+        logger.debug("Generating quiz for material %s from %s", material.pk,
+                     f"{len(specific_attachments)} specific attachments" if specific_attachments else "all attachments")
 
         try:
             # ✅ Generate quiz from AI
-            result = generate_quiz_from_material(material, num_q, specific_attachments)
+            with span("generate"):
+                result = generate_quiz_from_material(material, num_q, specific_attachments)
         except Exception as e:
             return Response(
                 {"detail": f"Quiz generation failed: {str(e)}"},
@@ -355,7 +385,8 @@ class QuizGenerationView(APIView):
                 context={"request": request}
             )
             serializer.is_valid(raise_exception=True)
-            quiz = serializer.save()
+            with span("db_write"):
+                quiz = serializer.save()
 
             return Response(
                 QuizSerializer(quiz, context={"request": request}).data,
@@ -375,6 +406,99 @@ class QuizGenerationView(APIView):
             )
 
 
+class GenerateAllView(ProfiledViewMixin, LLMConcurrencyLimitMixin, APIView):
+    """
+    POST /api/materials/{material_id}/generate-all/
+    {
+      "num_cards": 5,
+      "num_questions": 5,
+      "specific_attachments": [1, 2, 3]  // optional - specific attachment IDs
+    }
+    Notes, flashcards and quiz from one extraction, generated concurrently.
+    Returns 201 with {"note", "flashcard_set", "quiz", "errors"}; an artifact
+    that failed is null and its error is listed under "errors".
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [GenerationRateThrottle]
+
+    # artifact -> (response key, serializer, build serializer data from the generated result)
+    ARTIFACTS = {
+        "notes": ("note", NoteSerializer, lambda result: {
+            "title": result["title"],
+            "description": result["description"],
+            "content": result["content"],
+        }),
+        "flashcards": ("flashcard_set", FlashcardSetSerializer, lambda result: {
+            "title": result["title"],
+            "description": result["description"],
+            "flashcards": result["flashcards"],
+        }),
+        "quiz": ("quiz", QuizSerializer, lambda result: {
+            "title": result["title"],
+            "description": result["description"],
+            "questions": result["questions"],
+        }),
+    }
+
+    @idempotent
+    @coalesce_duplicates
+    def post(self, request, material_id=None):
+        # Get material and check ownership
+        material = get_object_or_404(Material, id=material_id)
+        if material.owner != request.user:
+            return Response(
+                {"error": "You don't have permission to generate content for this material."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer_in = GenerateAllSerializer(data=request.data)
+        serializer_in.is_valid(raise_exception=True)
+        specific_attachments = request.data.get('specific_attachments', None)
+
+        try:
+            # ✅ Extract once, then generate all three concurrently
+            with span("generate"):
+                outcomes = generate_all_from_material(
+                    material,
+                    serializer_in.validated_data["num_cards"],
+                    serializer_in.validated_data["num_questions"],
+                    specific_attachments,
+                )
+        except Exception as e:
+            return Response(
+                {"detail": f"Generation failed: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        response_data = {"errors": {}}
+        for artifact, (key, serializer_class, build) in self.ARTIFACTS.items():
+            result, error = outcomes[artifact]
+            response_data[key] = None
+            if error is not None:
+                response_data["errors"][artifact] = str(error)
+                continue
+
+            data = build(result)
+            # Re-generating must not trip the (material, title) unique validator
+            data["title"] = serializer_class()._generate_unique_title(data["title"], material)
+            serializer = serializer_class(
+                data={"material": material.id, "public": False, **data},
+                context={"request": request}
+            )
+            if not serializer.is_valid():
+                response_data["errors"][artifact] = serializer.errors
+                continue
+            with span("db_write"):
+                response_data[key] = serializer_class(serializer.save(), context={"request": request}).data
+
+        if len(response_data["errors"]) == len(self.ARTIFACTS):
+            return Response(
+                {"detail": "Generation failed.", "errors": response_data["errors"]},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
+
 # ===== CONVERSATION MANAGEMENT VIEWS =====
 
 class ConversationListView(generics.ListAPIView):
@@ -428,7 +552,7 @@ class GetOrCreateConversationView(generics.GenericAPIView):
                 created = True
                 
             except Exception as create_error:
-                print(f"❌ Error creating conversation: {create_error}")
+                logger.warning("Error creating conversation: %s", create_error)
                 
                 # Try alternative approach - maybe the messages field is the issue
                 try:
@@ -444,7 +568,7 @@ class GetOrCreateConversationView(generics.GenericAPIView):
                     created = True
                     
                 except Exception as fallback_error:
-                    print(f"❌ Fallback creation also failed: {fallback_error}")
+                    logger.error("Fallback conversation creation also failed: %s", fallback_error)
                     return Response(
                         {
                             "error": "Failed to create conversation", 
@@ -454,7 +578,7 @@ class GetOrCreateConversationView(generics.GenericAPIView):
                     )
 
         except Exception as get_error:
-            print(f"❌ Error getting conversation: {get_error}")
+            logger.error("Error getting conversation: %s", get_error)
             return Response(
                 {"error": "Database error", "details": str(get_error)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -482,13 +606,14 @@ class ConversationDeleteView(generics.DestroyAPIView):
         return obj
 
 
-class ConversationSummaryView(generics.GenericAPIView):
+class ConversationSummaryView(LLMConcurrencyLimitMixin, generics.GenericAPIView):
     """
     POST /api/conversations/{pk}/regenerate-summary/
     Manually regenerate the conversation summary
     """
     queryset = AIConversation.objects.all()
     permission_classes = [IsAuthenticated]
+    throttle_classes = [ChatRateThrottle]
 
     def post(self, request, pk=None):
         conv = get_object_or_404(AIConversation, pk=pk)
@@ -500,18 +625,18 @@ class ConversationSummaryView(generics.GenericAPIView):
             # Force regenerate summary
             summary_updated = update_conversation_summary(conv)
             if summary_updated:
-                conv.save()
+                conv.save(update_fields=AIConversation.SUMMARY_FIELDS)
                 return Response({
                     "message": "Summary regenerated successfully",
                     "summary": conv.summary_context,
-                    "topic": conv.detect_conversation_topic(),
+                    "topic": conv.topic,
                     "messages_since_summary": conv.messages_since_summary
                 }, status=status.HTTP_200_OK)
             else:
                 return Response({
                     "message": "No summary update needed",
                     "summary": conv.summary_context,
-                    "topic": conv.detect_conversation_topic(),
+                    "topic": conv.topic,
                     "messages_since_summary": conv.messages_since_summary
                 }, status=status.HTTP_200_OK)
                 
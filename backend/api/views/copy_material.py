@@ -1,17 +1,9 @@
 from .imports import status, APIView, Response
 from django.shortcuts import get_object_or_404
 
-from api.models import (
-    Material,
-    Attachment,
-    Note,
-    FlashcardSet,
-    Flashcard,
-    Quiz,
-    QuizQuestion,
-)
-
+from api.models import Material
 from api.serializers import MaterialSerializer
+from api.services.material_copy import copy_material_tree, fork_material
 
 
 def get_unique_title(owner, base_title):
@@ -35,9 +27,16 @@ class CopyMaterialView(APIView):
     POST /api/materials/<int:material_id>/copy/
     - Only public Materials can be copied.
     - Creates a brand-new Material owned by request.user,
-      then duplicates attachments, notes, flashcard sets (and cards),
-      quizzes, and quiz questions.
+      then duplicates notes, flashcard sets (and cards), quizzes, and
+      quiz questions with bulk inserts. Attachments reference the
+      source's stored files instead of re-uploading them.
+    - With {"mode": "fork"} a copy-on-write fork is created instead: only
+      the Material and attachment rows are written, and the source's notes,
+      sets and quizzes are copied the first time the fork or the source's
+      content is modified.
     """
+    COPY_MODES = ("copy", "fork")
+
     def post(self, request, material_id=None):
         # 1) Lookup the source material
         source = get_object_or_404(Material, id=material_id)
@@ -49,73 +48,23 @@ class CopyMaterialView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        # 3) Generate unique title for new Material to avoid duplicates
-        unique_title = get_unique_title(request.user, source.title)
-
-        # 4) Create a new Material instance (owned by current user)
-        #    Copy title, description, status but force pinned=False, public=False.
-        new_material = Material.objects.create(
-            owner=request.user,
-            title=unique_title,
-            description=source.description,
-            status=source.status,
-            pinned=False,
-            public=False
-        )
-
-        # 5) Duplicate attachments (physically copy each file)
-        for attachment in source.attachments.all():
-            orig_file = attachment.file
-            orig_file.open("rb")
-            new_attach = Attachment(material=new_material)
-            new_attach.file.save(
-                orig_file.name.split("/")[-1],  # keep same filename
-                orig_file.file,                 # file-like object
-                save=True
-            )
-            orig_file.close()
-
-        # 6) Duplicate notes (including title and description)
-        for note in source.notes.all():
-            Note.objects.create(
-                material=new_material,
-                title=note.title,
-                description=note.description,
-                content=note.content,
-                public=False  # force new notes to be private
+        mode = request.data.get("mode", "copy")
+        if mode not in self.COPY_MODES:
+            return Response(
+                {"detail": f"Invalid mode '{mode}'. Must be one of: {', '.join(self.COPY_MODES)}."},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-        # 7) Duplicate flashcard sets and their nested flashcards
-        for flashcard_set in source.flashcard_sets.all():
-            new_set = FlashcardSet.objects.create(
-                material=new_material,
-                title=flashcard_set.title,
-                description=flashcard_set.description,
-                public=False  # force new sets to be private
-            )
-            for card in flashcard_set.cards.all():
-                Flashcard.objects.create(
-                    flashcard_set=new_set,
-                    question=card.question,
-                    answer=card.answer
-                )
+        # 3) Generate unique title for new Material to avoid duplicates
+        unique_title = get_unique_title(request.user, source.title)
 
-        # 8) Duplicate quizzes and their questions
-        for quiz in source.quizzes.all():
-            new_quiz = Quiz.objects.create(
-                material=new_material,
-                title=quiz.title,
-                description=quiz.description,
-                public=False  # force new quizzes to be private
-            )
-            for q in quiz.questions.all():
-                QuizQuestion.objects.create(
-                    quiz=new_quiz,
-                    question_text=q.question_text,
-                    choices=q.choices,
-                    correct_answer=q.correct_answer
-                )
+        # 4) Copy the whole tree in one transaction (attachments share stored blobs),
+        #    or just fork it and defer copying the content until the first write
+        if mode == "fork":
+            new_material = fork_material(source, request.user, unique_title)
+        else:
+            new_material = copy_material_tree(source, request.user, unique_title)
 
-        # 9) Serialize and return the newly created Material
+        # 5) Serialize and return the newly created Material
         serializer = MaterialSerializer(new_material, context={"request": request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
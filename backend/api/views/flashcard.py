@@ -1,8 +1,9 @@
 from .imports import viewsets
+from .mixins import ForkAwareWriteMixin
 from ..models import FlashcardSet, Flashcard
 from ..serializers import FlashcardSetSerializer, FlashcardSerializer
 
-class FlashcardSetViewSet(viewsets.ModelViewSet):
+class FlashcardSetViewSet(ForkAwareWriteMixin, viewsets.ModelViewSet):
     """
     CRUD for FlashcardSet (the container holding multiple flashcards).
     """
@@ -10,9 +11,11 @@ class FlashcardSetViewSet(viewsets.ModelViewSet):
     serializer_class = FlashcardSetSerializer
 
 
-class FlashcardViewSet(viewsets.ModelViewSet):
+class FlashcardViewSet(ForkAwareWriteMixin, viewsets.ModelViewSet):
     """
     CRUD for individual Flashcards. Each Flashcard belongs to one FlashcardSet.
     """
     queryset = Flashcard.objects.all()
     serializer_class = FlashcardSerializer
+    fork_parent_field = "flashcard_set"
+    fork_parent_model = FlashcardSet
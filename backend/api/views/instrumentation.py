@@ -0,0 +1,50 @@
+from rest_framework.permissions import IsAdminUser
+
+from .imports import APIView, Response, status
+
+from RataTutor.utils import profiling
+from RataTutor.utils.instrumentation import endpoint_tracker
+
+
+class SlowEndpointsView(APIView):
+    """
+    GET /api/admin/slow-endpoints/?limit=20
+    Rolling per-endpoint timings (last requests of every worker), slowest p95 first.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            limit = min(max(int(request.query_params.get("limit", 20)), 1), 100)
+        except ValueError:
+            return Response({"error": "'limit' must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"endpoints": endpoint_tracker.slowest(limit)})
+
+
+class ProfilingToggleView(APIView):
+    """
+    GET  /api/admin/profiling/  -> {"mode": "sampling" | "cprofile" | null}
+    POST /api/admin/profiling/  {"mode": "sampling" | "cprofile" | null, "timeout": 3600}
+    Profile every generation/chat request (all users) until switched off or
+    until `timeout` seconds have passed.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({"mode": profiling.get_global_mode()})
+
+    def post(self, request):
+        mode = request.data.get("mode")
+        if mode is not None and mode not in profiling.MODES:
+            return Response(
+                {"error": f"Invalid mode. Must be one of: {', '.join(profiling.MODES)} or null."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            timeout = int(request.data["timeout"]) if request.data.get("timeout") else None
+        except (TypeError, ValueError):
+            return Response({"error": "'timeout' must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        profiling.set_global_mode(mode, timeout)
+        return Response({"mode": mode})
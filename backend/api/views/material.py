@@ -1,8 +1,26 @@
 from .imports import viewsets, permissions, action, Response
-from ..models import Material
-from ..serializers import MaterialSerializer
+from ..models import Material, Attachment, Note, FlashcardSet, Quiz
+from ..pagination import PublicFeedPagination
+from ..serializers import MaterialSerializer, MaterialSummarySerializer
+from ..services.material_copy import materialize_fork
+from ..services.public_feed import get_cached_feed_page, set_cached_feed_page
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.http import Http404
 
+
+def _count_subquery(model, material_ref):
+    """Correlated COUNT(*) of `model` rows belonging to the referenced material."""
+    counts = (
+        model.objects.filter(material_id=material_ref)
+        .order_by()
+        .values('material_id')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
 class MaterialViewSet(viewsets.ModelViewSet):
     serializer_class = MaterialSerializer
     permission_classes = [permissions.IsAuthenticated]  # Ensure user is authenticated
@@ -15,7 +33,7 @@ class MaterialViewSet(viewsets.ModelViewSet):
         return Material.objects.filter(
             owner=self.request.user,
             status='active'  # Only show active materials by default
-        ).order_by('-pinned', '-updated_at')  # Pinned first, then by recent updates
+        ).select_related('shared_from').order_by('-pinned', '-updated_at')  # Pinned first, then by recent updates
     
     def get_object(self):
         """
@@ -64,6 +82,17 @@ class MaterialViewSet(viewsets.ModelViewSet):
         material.delete()  # This will actually delete the material
         return Response(status=204)
     
+    @action(detail=True, methods=['post'])
+    def materialize(self, request, pk=None):
+        """
+        Give a copy-on-write fork its own copy of the shared content.
+        POST /api/materials/{id}/materialize/
+        """
+        material = self.get_object()
+        materialize_fork(material)
+        serializer = self.get_serializer(material)
+        return Response(serializer.data)
+
     @action(detail=False, methods=['get'])
     def pinned(self, request):
         """
@@ -83,7 +112,7 @@ class MaterialViewSet(viewsets.ModelViewSet):
         trashed_materials = Material.objects.filter(
             owner=request.user,
             status='trash'
-        ).order_by('-updated_at')
+        ).select_related('shared_from').order_by('-updated_at')
         serializer = self.get_serializer(trashed_materials, many=True)
         return Response(serializer.data)
     
@@ -91,17 +120,47 @@ class MaterialViewSet(viewsets.ModelViewSet):
     def public(self, request):
         """
         Custom endpoint to get public materials from other users.
-        GET /api/materials/public/
-        """
-        public_materials = Material.objects.filter(
-            public=True,
-            status='active'
-        ).exclude(
-            owner=request.user  # Exclude current user's materials
-        ).select_related('owner').order_by('-updated_at')
-        
-        serializer = self.get_serializer(public_materials, many=True)
-        return Response(serializer.data)
+        GET /api/materials/public/?cursor=<cursor>&page_size=<n>
+
+        Returns cursor-paginated summaries (content counts, no nested trees).
+        Pages are cached and invalidated whenever a public material or its
+        content changes. The caller's own materials are excluded in the
+        query, so pages are shared by every user without public materials
+        and cached per user for the others.
+        """
+        paginator = PublicFeedPagination()
+        cursor = request.query_params.get(paginator.cursor_query_param)
+        page_size = paginator.get_page_size(request)
+
+        owns_public = Material.objects.filter(owner=request.user, public=True, status='active').exists()
+        scope = request.user.pk if owns_public else None
+
+        page = get_cached_feed_page(scope, cursor, page_size)
+        if page is None:
+            content_ref = Coalesce(OuterRef('shared_from_id'), OuterRef('pk'))
+            public_materials = Material.objects.filter(
+                public=True,
+                status='active'
+            )
+            if owns_public:
+                # Exclude current user's materials
+                public_materials = public_materials.exclude(owner=request.user)
+            public_materials = public_materials.select_related('owner').annotate(
+                attachments_count=_count_subquery(Attachment, OuterRef('pk')),
+                notes_count=_count_subquery(Note, content_ref),
+                flashcard_sets_count=_count_subquery(FlashcardSet, content_ref),
+                quizzes_count=_count_subquery(Quiz, content_ref),
+            )
+
+            results = paginator.paginate_queryset(public_materials, request, view=self)
+            page = {
+                'next': paginator.get_next_link(),
+                'previous': paginator.get_previous_link(),
+                'results': [dict(item) for item in MaterialSummarySerializer(results, many=True).data],
+            }
+            set_cached_feed_page(scope, cursor, page_size, page)
+
+        return Response(page)
     
     @action(detail=True, methods=['post'])
     def toggle_pin(self, request, pk=None):
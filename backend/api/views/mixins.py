@@ -0,0 +1,189 @@
+import functools
+
+from rest_framework.permissions import SAFE_METHODS
+
+from .imports import PermissionDenied, Response, status
+from api.services import idempotency
+from api.services.material_copy import resolve_fork_write_target
+from api.services.single_flight import flight_key, run_once
+from RataTutor.utils import profiling
+
+
+class ForkAwareWriteMixin:
+    """
+    Route writes on study content through copy-on-write forks.
+
+    A fork shows the source material's rows, so clients may send the source
+    row IDs back when editing. Writes on rows of a material the user owns go
+    through unchanged; writes on rows the user only sees through a fork
+    materialize that fork and are applied to its own copy instead. Any other
+    write to someone else's content is rejected.
+    """
+    # Serializer field referencing the parent row (e.g. "flashcard_set"), if any
+    fork_parent_field = None
+    fork_parent_model = None
+
+    def get_object(self):
+        obj = super().get_object()
+        if self.request.method in SAFE_METHODS:
+            return obj
+
+        target = resolve_fork_write_target(self.request.user, obj)
+        if target is None:
+            raise PermissionDenied("You do not have permission to modify this item.")
+        return target
+
+    def get_serializer(self, *args, **kwargs):
+        if (
+            self.fork_parent_field
+            and self.request.method not in SAFE_METHODS
+            and kwargs.get("data") is not None
+        ):
+            kwargs["data"] = self._redirect_parent(kwargs["data"])
+        return super().get_serializer(*args, **kwargs)
+
+    def _redirect_parent(self, data):
+        parent_id = data.get(self.fork_parent_field)
+        if not parent_id:
+            return data
+
+        parent = self.fork_parent_model.objects.filter(pk=parent_id).first()
+        if parent is None:
+            return data
+
+        target = resolve_fork_write_target(self.request.user, parent)
+        if target is None or target.pk == parent.pk:
+            return data
+
+        data = data.copy()
+        data[self.fork_parent_field] = target.pk
+        return data
+
+
+class ProfiledViewMixin:
+    """
+    Opt-in profiling of a view (see RataTutor/utils/profiling.py).
+
+    The profiler starts once the user is authenticated and stops when the
+    response is finalized; the profile id is returned in `X-Profile-Id`.
+    """
+
+    _profile_session = None
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            # Unhandled exceptions skip finalize_response
+            if self._profile_session is not None:
+                self._profile_session.abort()
+                self._profile_session = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        mode = profiling.requested_mode(request)
+        if mode:
+            self._profile_session = profiling.ProfileSession(mode, type(self).__name__)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        session = self._profile_session
+        if session is not None:
+            self._profile_session = None
+            response["X-Profile-Id"] = session.stop(request, response)
+        return response
+
+
+def _acquire_llm_slot(view, handler):
+    """
+    Take the user's in-flight LLM slot (LLMConcurrencyLimitMixin) right
+    before `handler` really runs, unless `handler` takes it itself.
+    """
+    acquire = getattr(view, "acquire_llm_slot", None)
+    if acquire is not None and not getattr(handler, "defers_llm_slot", False):
+        acquire()
+
+
+def _check_deferred_throttles(view):
+    """Spend the rate limit token deferred by a `defers_throttling` handler."""
+    check = getattr(view, "check_deferred_throttles", None)
+    if check is not None:
+        check()
+
+
+def coalesce_duplicates(post):
+    """
+    Decorate a generation view's `post` so identical requests running at the
+    same time (double-clicks, client retries) share one execution: same
+    user, URL kwargs (material), parameters and attachment set. Only the
+    request that runs holds an in-flight LLM slot; the others just wait.
+    """
+    @functools.wraps(post)
+    def wrapper(self, request, *args, **kwargs):
+        params = {name: value for name, value in request.data.items() if name != "specific_attachments"}
+        attachments = request.data.get("specific_attachments")
+        attachments = sorted({str(pk) for pk in attachments}) if isinstance(attachments, list) else "all"
+        label = type(self).__name__
+        key = flight_key(label, request.user.pk, kwargs, params, attachments)
+
+        def run():
+            _acquire_llm_slot(self, post)
+            response = post(self, request, *args, **kwargs)
+            return response.status_code, response.data
+
+        status_code, data = run_once(key, run, label=label)
+        return Response(data, status=status_code)
+
+    wrapper.defers_llm_slot = True
+    return wrapper
+
+
+def idempotent(post):
+    """
+    Decorate a `post` so it honours the `Idempotency-Key` header: a retry
+    with the same key gets the stored response (marked with
+    `Idempotent-Replayed: true`) instead of calling the LLM and writing
+    again, without spending a rate limit token or an in-flight slot.
+    Requests without the header are handled as before.
+    """
+    @functools.wraps(post)
+    def wrapper(self, request, *args, **kwargs):
+        idempotency_key = request.headers.get(idempotency.HEADER)
+        if not idempotency_key:
+            _check_deferred_throttles(self)
+            _acquire_llm_slot(self, post)
+            return post(self, request, *args, **kwargs)
+        if len(idempotency_key) > idempotency.MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"{idempotency.HEADER} must be at most {idempotency.MAX_KEY_LENGTH} characters."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        def run():
+            _check_deferred_throttles(self)
+            _acquire_llm_slot(self, post)
+            response = post(self, request, *args, **kwargs)
+            return response.status_code, response.data
+
+        try:
+            status_code, data, replayed = idempotency.run_idempotent(
+                request.user,
+                type(self).__name__,
+                idempotency_key,
+                {"kwargs": kwargs, "body": request.data},
+                run,
+            )
+        except idempotency.IdempotencyKeyReused:
+            return Response(
+                {"error": f"This {idempotency.HEADER} was already used for a different request."},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+
+        response = Response(data, status=status_code)
+        if replayed:
+            response["Idempotent-Replayed"] = "true"
+        return response
+
+    wrapper.defers_llm_slot = True
+    wrapper.defers_throttling = True
+    return wrapper
@@ -1,7 +1,8 @@
 from .imports import viewsets
+from .mixins import ForkAwareWriteMixin
 from ..models import Note
 from ..serializers import NoteSerializer
 
-class NoteViewSet(viewsets.ModelViewSet):
+class NoteViewSet(ForkAwareWriteMixin, viewsets.ModelViewSet):
     queryset = Note.objects.all()
     serializer_class = NoteSerializer
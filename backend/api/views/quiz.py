@@ -1,8 +1,9 @@
 from .imports import viewsets
+from .mixins import ForkAwareWriteMixin
 from ..models import Quiz, QuizQuestion
 from ..serializers import QuizSerializer, QuizQuestionSerializer
 
-class QuizViewSet(viewsets.ModelViewSet):
+class QuizViewSet(ForkAwareWriteMixin, viewsets.ModelViewSet):
     """
     CRUD for Quiz. Nested questions are read‐only inside the Quiz endpoint;
     to create/edit questions, use QuizQuestionViewSet.
@@ -11,9 +12,11 @@ class QuizViewSet(viewsets.ModelViewSet):
     serializer_class = QuizSerializer
 
 
-class QuizQuestionViewSet(viewsets.ModelViewSet):
+class QuizQuestionViewSet(ForkAwareWriteMixin, viewsets.ModelViewSet):
     """
     CRUD for individual QuizQuestion. Each question must reference a Quiz.
     """
     queryset = QuizQuestion.objects.all()
     serializer_class = QuizQuestionSerializer
+    fork_parent_field = "quiz"
+    fork_parent_model = Quiz
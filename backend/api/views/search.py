@@ -0,0 +1,76 @@
+from .imports import APIView, Response, status, IsAuthenticated
+
+from api.models import SearchEntry
+from api.services.search import ATTACHMENT_KIND, search
+
+
+class SearchView(APIView):
+    """
+    GET /api/search/?q=<text>&page=1&page_size=20&kind=note&kind=flashcard
+    Ranked full-text search over material titles/descriptions, notes,
+    flashcards, quiz questions and attachment text in the user's own and
+    public materials. Each result's "snippet" is safe HTML: the text is
+    escaped and the matched words are wrapped in <mark>.
+    """
+    permission_classes = [IsAuthenticated]
+    default_page_size = 20
+    max_page_size = 50
+
+    def get(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({"error": "Missing search query 'q'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            page = max(int(request.query_params.get("page", 1)), 1)
+            page_size = min(max(int(request.query_params.get("page_size", self.default_page_size)), 1), self.max_page_size)
+        except ValueError:
+            return Response({"error": "'page' and 'page_size' must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        kinds = self.get_kinds(request)
+        valid_kinds = {kind for kind, _ in SearchEntry.KIND_CHOICES}
+        invalid = [kind for kind in kinds if kind not in valid_kinds]
+        if invalid:
+            return Response(
+                {"error": f"Invalid kind(s): {', '.join(invalid)}. Must be one of: {', '.join(sorted(valid_kinds))}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Fetch one extra row to know whether there is a next page
+        results = search(request.user, query, limit=page_size + 1, offset=(page - 1) * page_size, kinds=kinds)
+
+        return Response({
+            "query": query,
+            "page": page,
+            "has_next": len(results) > page_size,
+            "results": [self.format_result(result) for result in results[:page_size]],
+        })
+
+    def get_kinds(self, request):
+        return request.query_params.getlist("kind")
+
+    def format_result(self, result):
+        return result
+
+
+class AttachmentSearchView(SearchView):
+    """
+    GET /api/search/attachments/?q=<text>&page=1&page_size=20
+    Find which uploaded file (and which page/slide of it) mentions the query.
+    Served from the page index built at upload time; files are never parsed per query.
+    The page text comes from user uploads: "snippet" is escaped like SearchView's.
+    """
+
+    def get_kinds(self, request):
+        return [ATTACHMENT_KIND]
+
+    def format_result(self, result):
+        return {
+            "attachment": result["id"],
+            "file_name": result["title"],
+            "page": result["page"],
+            "material": result["material"],
+            "material_title": result["material_title"],
+            "snippet": result["snippet"],
+            "score": result["score"],
+        }
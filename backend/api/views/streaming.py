@@ -0,0 +1,189 @@
+import json
+import logging
+
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .imports import APIView, IsAuthenticated, Response, status
+from ..models import Material
+from ..serializers import (
+    FlashcardGenerationSerializer,
+    FlashcardSerializer,
+    FlashcardSetSerializer,
+    QuizGenerationSerializer,
+    QuizQuestionSerializer,
+    QuizSerializer,
+)
+from ..throttling import GenerationRateThrottle, LLMConcurrencyLimitMixin, release_llm_slot
+from api.services.ai_service import stream_flashcards_from_material, stream_quiz_from_material
+from api.services.progressive_generation import FlashcardSetWriter, QuizWriter
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class SlotHoldingStream:
+    """
+    Body of a streaming generation response. close() stops reading from the
+    model and releases the LLM slot exactly once: when the body is exhausted,
+    or when the server closes the response, even if the client disconnected
+    before the first event was sent (a generator's finally would never run).
+    """
+
+    def __init__(self, content, events, slot):
+        self._content = content
+        self._events = events
+        self._slot = slot
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._content)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._content.close()
+            self._events.close()
+        finally:
+            release_llm_slot(self._slot)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets clients send `Accept: text/event-stream`; errors raised before streaming become an `error` event."""
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse_event("error", data).encode(self.charset)
+
+
+# ===== STREAMING GENERATION VIEWS =====
+
+class StreamingGenerationView(LLMConcurrencyLimitMixin, APIView):
+    """
+    Base for the streaming (Server-Sent Events) generation endpoints.
+
+    Events:
+      event: set    data: {"id", "title", "description"}   (with the first item)
+      event: item   data: <saved card/question>             (one per item)
+      event: done   data: <full set/quiz>
+      event: error  data: {"detail", "saved"}
+    Items are saved as they arrive, so a failed stream keeps what was generated.
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [GenerationRateThrottle]
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
+
+    label = None
+    input_serializer_class = None
+    count_field = None
+    # (material, count, specific_attachments) -> iterator of parser events
+    stream_function = None
+    writer_class = None
+    item_serializer_class = None
+    parent_serializer_class = None
+
+    def post(self, request, material_id=None):
+        # Get material and check ownership
+        material = get_object_or_404(Material, id=material_id)
+        if material.owner != request.user:
+            return Response(
+                {"error": f"You don't have permission to generate {self.label} for this material."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer_in = self.input_serializer_class(data=request.data)
+        serializer_in.is_valid(raise_exception=True)
+        count = serializer_in.validated_data[self.count_field]
+        specific_attachments = request.data.get('specific_attachments', None)
+
+        try:
+            # ✅ Extraction happens here, so "no text" is still a plain error response
+            events = self.stream_function(material, count, specific_attachments)
+        except Exception as e:
+            return Response(
+                {"detail": f"{self.label.capitalize()} generation failed: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        # The LLM slot is held until the stream ends, not until post() returns
+        slot, self._llm_slot = self._llm_slot, None
+        response = StreamingHttpResponse(
+            SlotHoldingStream(self.stream(request, material, events), events, slot),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def stream(self, request, material, events):
+        writer = self.writer_class(material)
+        context = {"request": request}
+        try:
+            for event, payload in events:
+                if event == "field":
+                    writer.field(*payload)
+                    continue
+
+                row = writer.add(payload)
+                if writer.count == 1:
+                    parent = writer.parent
+                    yield sse_event("set", {"id": parent.id, "title": parent.title, "description": parent.description})
+                yield sse_event("item", self.item_serializer_class(row, context=context).data)
+
+            parent = writer.finish()
+            yield sse_event("done", self.parent_serializer_class(parent, context=context).data)
+        except Exception as e:
+            logger.warning("Streaming %s generation failed after %d items: %s", self.label, writer.count, e)
+            yield sse_event("error", {
+                "detail": f"{self.label.capitalize()} generation failed: {str(e)}",
+                "saved": writer.count,
+            })
+
+
+class FlashcardStreamView(StreamingGenerationView):
+    """
+    POST /api/materials/{material_id}/generate-flashcards/stream/
+    {
+      "num_cards": 5,
+      "specific_attachments": [1, 2, 3]  // optional - specific attachment IDs
+    }
+    """
+    label = "flashcards"
+    input_serializer_class = FlashcardGenerationSerializer
+    count_field = "num_cards"
+    writer_class = FlashcardSetWriter
+    item_serializer_class = FlashcardSerializer
+    parent_serializer_class = FlashcardSetSerializer
+    stream_function = staticmethod(stream_flashcards_from_material)
+
+
+class QuizStreamView(StreamingGenerationView):
+    """
+    POST /api/materials/{material_id}/generate-quiz/stream/
+    {
+      "num_questions": 5,
+      "specific_attachments": [1, 2, 3]  // optional - specific attachment IDs
+    }
+    """
+    label = "quiz"
+    input_serializer_class = QuizGenerationSerializer
+    count_field = "num_questions"
+    writer_class = QuizWriter
+    item_serializer_class = QuizQuestionSerializer
+    parent_serializer_class = QuizSerializer
+    stream_function = staticmethod(stream_quiz_from_material)
@@ -9,6 +9,9 @@ echo "🔧 ALLOWED_HOSTS: ${ALLOWED_HOSTS}"
 echo ">>> Running migrations..."
 python manage.py migrate --noinput
 
+echo ">>> Creating cache table (only used when CACHE_URL is a dbcache)..."
+python manage.py createcachetable
+
 echo ">>> Collecting static files..."
 python manage.py collectstatic --noinput
 
@@ -20,6 +20,8 @@ const ExploreScreen = ({ onRefreshProfile }) => {
   const [selectedFilter, setSelectedFilter] = useState('all')
   const [isSearchFocused, setIsSearchFocused] = useState(false)
   const [materialsData, setMaterialsData] = useState([])
+  const [nextPageUrl, setNextPageUrl] = useState(null)
+  const [loadingMore, setLoadingMore] = useState(false)
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState(null)
 
@@ -30,7 +32,8 @@ const ExploreScreen = ({ onRefreshProfile }) => {
       setError(null)
       
       const response = await getPublicMaterials()
-      setMaterialsData(response.data)
+      setMaterialsData(response.data.results)
+      setNextPageUrl(response.data.next)
       
     } catch (err) {
       console.error('Error fetching public materials:', err)
@@ -54,6 +57,25 @@ const ExploreScreen = ({ onRefreshProfile }) => {
     fetchPublicMaterials()
   }, [fetchPublicMaterials])
 
+  const handleLoadMore = useCallback(async () => {
+    if (!nextPageUrl) return
+    try {
+      setLoadingMore(true)
+      const response = await getPublicMaterials(nextPageUrl)
+      setMaterialsData(prev => [...prev, ...response.data.results])
+      setNextPageUrl(response.data.next)
+    } catch (err) {
+      console.error('Error loading more public materials:', err)
+      showToast({
+        variant: "error",
+        title: "Error loading materials",
+        subtitle: "Failed to fetch more public materials. Please try again.",
+      })
+    } finally {
+      setLoadingMore(false)
+    }
+  }, [nextPageUrl, showToast])
+
   const handleCopyMaterial = useCallback(async (materialId) => {
   try {
     showLoading()
@@ -129,9 +151,9 @@ const ExploreScreen = ({ onRefreshProfile }) => {
         material.owner?.toLowerCase().includes(searchQuery.toLowerCase())
 
       const matchesFilter = selectedFilter === 'all' || 
-        (selectedFilter === 'notes' && material.notes && material.notes.length > 0) ||
-        (selectedFilter === 'flashcards' && material.flashcard_sets && material.flashcard_sets.length > 0) ||
-        (selectedFilter === 'quizzes' && material.quizzes && material.quizzes.length > 0)
+        (selectedFilter === 'notes' && material.notes_count > 0) ||
+        (selectedFilter === 'flashcards' && material.flashcard_sets_count > 0) ||
+        (selectedFilter === 'quizzes' && material.quizzes_count > 0)
 
       return matchesSearch && matchesFilter
     })
@@ -334,6 +356,19 @@ const ExploreScreen = ({ onRefreshProfile }) => {
         ))}
       </div>
 
+      {nextPageUrl && (
+        <div className="flex justify-center">
+          <button
+            onClick={handleLoadMore}
+            disabled={loadingMore}
+            className="exam-button-mini py-1 px-2"
+            data-hover="Load More"
+          >
+            {loadingMore ? 'Loading...' : 'Load More'}
+          </button>
+        </div>
+      )}
+
       {!loading && filteredMaterials.length === 0 && (
         <div className="flex flex-col items-center justify-center min-h-[calc(100vh-12rem)] py-12">
           <FileQuestion size={64} className="text-[#1b81d4] mb-6" />
@@ -61,7 +61,8 @@ const useContentTags = (material) => {
     const tags = [];
     
     Object.entries(CONTENT_TAG_CONFIG).forEach(([key, config]) => {
-      const count = material[key]?.length || 0;
+      // Full materials carry nested arrays; feed summaries carry `<key>_count`
+      const count = material[key]?.length ?? material[`${key}_count`] ?? 0;
       if (count > 0) {
         tags.push({
           key,
@@ -9,8 +9,9 @@ export const softDeleteMaterial = (id) => api.delete(`/materials/${id}/`);
 export const permanentDeleteMaterial = (id) => api.post(`/materials/${id}/permanent_delete/`);
 export const restoreMaterial = (id) => api.patch(`/materials/${id}/`, { status: 'active' });
 
-export const getPublicMaterials = () => {
-  return api.get('/materials/public/')
+// Cursor-paginated: pass the `next` URL from a previous page to load more
+export const getPublicMaterials = (pageUrl = null) => {
+  return api.get(pageUrl || '/materials/public/')
 }
 
 // Material specific endpoints